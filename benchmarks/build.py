@@ -0,0 +1,46 @@
+"""
+Build a refined database from one input file and report timings as JSON.
+
+Storage options (TIMESTAMP_STORAGE, KEY_MODE, ...) are read from the
+environment at import time, so each layout is built in its own process:
+
+    KEY_MODE=integer python -m benchmarks.build input/miner-fileDto.json /tmp/db.libsql
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+try:
+    from refiner.refine import create_transformer
+except ImportError:
+    # Checkouts predating create_transformer, e.g. a --reference-tree of golden.py
+    from refiner.transformer.miner_transformer import MinerTransformer
+    from refiner.transformer.webapp_transformer import WebappTransformer
+
+    def create_transformer(input_data: dict, db_path: str, input_filename: str = "input"):
+        transformer_cls = WebappTransformer if input_data.get('source') == 'telegram' else MinerTransformer
+        return transformer_cls(db_path)
+
+
+def build(input_path: str, db_path: str) -> dict:
+    with open(input_path, 'r') as f:
+        input_data = json.load(f)
+
+    start = time.perf_counter()
+    transformer = create_transformer(input_data, db_path, os.path.basename(input_path))
+    transformer.process(input_data)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "input": input_path,
+        "db_path": db_path,
+        "build_seconds": elapsed,
+        "db_bytes": os.path.getsize(db_path),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    print(json.dumps(build(sys.argv[1], sys.argv[2])))
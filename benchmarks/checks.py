@@ -0,0 +1,179 @@
+"""
+Correctness checks that the sample inputs alone do not exercise, run before
+merging changes to the transformers or the encryption backends:
+
+    python -m benchmarks.checks
+    python -m benchmarks.checks cross_chat_edges openpgp_interop
+
+Each check raises AssertionError on failure. Exits with status 1 if any
+check fails.
+"""
+import copy
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import traceback
+from typing import Callable, Dict
+
+from benchmarks.common import ROOT_DIR
+from refiner.config import settings
+from refiner.refine import create_transformer
+from refiner.utils import openpgp
+from refiner.utils.encrypt import decrypt_bytes, encrypt_bytes, encrypt_stream
+
+MINER_SAMPLE = os.path.join(ROOT_DIR, "input", "miner-fileDto.json")
+
+
+def check_cross_chat_edges(tmp: str) -> None:
+    """
+    A reply and a forward to a message of another chat of the miner sample,
+    whose GramJS peers carry the unsigned chat ID, resolve to that message.
+    """
+    with open(MINER_SAMPLE, 'r') as f:
+        data = json.load(f)
+    source_chat, target_chat = data['chats'][1], data['chats'][0]
+    target = next(msg for msg in target_chat['contents'] if msg['className'] == "Message")
+    peer = {"chatId": str(-target_chat['chat_id']), "className": "PeerChat"}
+
+    template = next(msg for msg in source_chat['contents'] if msg['className'] == "Message")
+    reply = copy.deepcopy(template)
+    reply.update(id=10 ** 9, replyTo={"flags": 0, "replyToMsgId": target['id'], "replyToPeerId": peer,
+                                      "className": "MessageReplyHeader"})
+    forward = copy.deepcopy(template)
+    forward.update(id=10 ** 9 + 1, fwdFrom={"flags": 0, "date": target['date'], "savedFromPeer": peer,
+                                            "savedFromMsgId": target['id'], "className": "MessageFwdHeader"})
+    source_chat['contents'] += [reply, forward]
+
+    db_path = os.path.join(tmp, "cross_chat_edges.libsql")
+    edges, settings.BUILD_MESSAGE_EDGES = settings.BUILD_MESSAGE_EDGES, True
+    try:
+        create_transformer(data, db_path).process(data)
+    finally:
+        settings.BUILD_MESSAGE_EDGES = edges
+    conn = sqlite3.connect(db_path)
+    try:
+        target_key = conn.execute(
+            "SELECT m.MessageID FROM chat_messages m JOIN submission_chats c ON c.SubmissionChatID = m.SubmissionChatID "
+            "WHERE c.SourceChatID = ? AND m.SourceMessageID = ?", (str(target_chat['chat_id']), str(target['id']))
+        ).fetchone()[0]
+        edges = {
+            "reply": conn.execute(
+                "SELECT r.ReplyToSourceChatID, r.ReplyToMessageID FROM message_replies r "
+                "JOIN chat_messages m ON m.MessageID = r.MessageID WHERE m.SourceMessageID = ?", (str(reply['id']),)
+            ).fetchone(),
+            "forward": conn.execute(
+                "SELECT f.OriginSourceChatID, f.OriginMessageID FROM message_forwards f "
+                "JOIN chat_messages m ON m.MessageID = f.MessageID WHERE m.SourceMessageID = ?", (str(forward['id']),)
+            ).fetchone(),
+        }
+    finally:
+        conn.close()
+    for name, edge in edges.items():
+        assert edge == (str(target_chat['chat_id']), target_key), f"{name} edge {edge} does not resolve to {target_key}"
+
+
+OPENPGP_PASSPHRASE = "correct horse battery staple"
+OPENPGP_SAMPLES = [b'', b'x', os.urandom(300), bytes(range(256)) * 41, os.urandom(300_001)]
+
+
+def _cross_decrypt(samples) -> None:
+    """Messages of each backend, with and without PGP compression, decrypt with both backends."""
+    for sample in samples:
+        for compression in ("pgp", "none"):
+            for backend in ("native", "pgpy"):
+                encrypted = encrypt_bytes(OPENPGP_PASSPHRASE, sample, compression, backend=backend)
+                for decrypting in ("native", "pgpy"):
+                    decrypted = decrypt_bytes(OPENPGP_PASSPHRASE, encrypted, compression, backend=decrypting)
+                    assert decrypted == sample, \
+                        f"{decrypting} cannot decrypt a {len(sample)} byte {backend} message ({compression})"
+
+
+def check_openpgp_interop(tmp: str) -> None:
+    """The native OpenPGP backend and pgpy agree on the armor checksum and decrypt each other's messages."""
+    from pgpy.types import Armorable
+    for sample in OPENPGP_SAMPLES:
+        assert openpgp.crc24(sample) == Armorable.crc24(sample), f"crc24 of {len(sample)} bytes differs from pgpy"
+    _cross_decrypt(OPENPGP_SAMPLES)
+
+
+def check_openpgp_partial_lengths(tmp: str) -> None:
+    """
+    Packets past the definite length limit, lowered here from 4 GiB to a few
+    KiB, are written with partial body lengths that both backends decrypt.
+    """
+    limit, power = openpgp.DEFINITE_LENGTH_LIMIT, openpgp.PARTIAL_LENGTH_POWER
+    openpgp.DEFINITE_LENGTH_LIMIT, openpgp.PARTIAL_LENGTH_POWER = 4096, 9
+    try:
+        message = openpgp.encrypt(os.urandom(5000), OPENPGP_PASSPHRASE, openpgp.COMPRESSION_UNCOMPRESSED, armor=False)
+        # The session key packet has a one byte length, the encrypted data packet follows it
+        seipd = 2 + message[1]
+        assert message[seipd:seipd + 2] == bytes([0xC0 | openpgp.TAG_SEIPD, 224 + 9]), \
+            "encrypted data packet without partial body lengths"
+        _cross_decrypt([os.urandom(4089), os.urandom(5000), os.urandom(3 * 512 + 7), os.urandom(20_000)])
+    finally:
+        openpgp.DEFINITE_LENGTH_LIMIT, openpgp.PARTIAL_LENGTH_POWER = limit, power
+
+
+def check_openpgp_streaming(tmp: str) -> None:
+    """
+    Messages encrypted from chunks, with partial body lengths lowered to the
+    512 byte minimum, decrypt with both backends whatever the chunking.
+    """
+    power = openpgp.STREAM_PARTIAL_LENGTH_POWER
+    openpgp.STREAM_PARTIAL_LENGTH_POWER = 9
+    try:
+        for sample in [b'', os.urandom(1024), bytes(5000), os.urandom(20_000)]:
+            for chunk_size in (7, 4096):
+                chunks = [sample[offset:offset + chunk_size] for offset in range(0, len(sample), chunk_size)]
+                for compression in ("pgp", "none", "zlib"):
+                    encrypted = b''.join(encrypt_stream(OPENPGP_PASSPHRASE, chunks, compression, backend="native"))
+                    for decrypting in ("native", "pgpy"):
+                        decrypted = decrypt_bytes(OPENPGP_PASSPHRASE, encrypted, compression, backend=decrypting)
+                        assert decrypted == sample, \
+                            f"{decrypting} cannot decrypt a {len(sample)} byte message streamed in {chunk_size} " \
+                            f"byte chunks ({compression})"
+    finally:
+        openpgp.STREAM_PARTIAL_LENGTH_POWER = power
+
+
+def check_openpgp_wrong_passphrase(tmp: str) -> None:
+    """Both backends refuse to decrypt a message of either backend with another passphrase."""
+    for backend in ("native", "pgpy"):
+        encrypted = encrypt_bytes(OPENPGP_PASSPHRASE, b'secret', "pgp", backend=backend)
+        for decrypting in ("native", "pgpy"):
+            try:
+                decrypt_bytes("wrong", encrypted, "pgp", backend=decrypting)
+            except Exception:
+                continue
+            raise AssertionError(f"{decrypting} accepted a wrong passphrase for a {backend} message")
+
+
+CHECKS: Dict[str, Callable[[str], None]] = {
+    "cross_chat_edges": check_cross_chat_edges,
+    "openpgp_interop": check_openpgp_interop,
+    "openpgp_partial_lengths": check_openpgp_partial_lengths,
+    "openpgp_streaming": check_openpgp_streaming,
+    "openpgp_wrong_passphrase": check_openpgp_wrong_passphrase,
+}
+
+
+def run(names) -> bool:
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names or CHECKS:
+            try:
+                CHECKS[name](tmp)
+                print(f"{name}: ok")
+            except Exception:
+                ok = False
+                print(f"{name}: FAILED")
+                traceback.print_exc()
+    return ok
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(0 if run(sys.argv[1:]) else 1)
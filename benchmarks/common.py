@@ -0,0 +1,52 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_database(input_path: str, db_path: str, env: Dict[str, str] = None, tree: str = None) -> dict:
+    """
+    Build a refined database in a subprocess with the given setting overrides.
+    If tree is given, the refiner package is imported from that checkout instead.
+    """
+    proc_env = dict(os.environ)
+    proc_env.setdefault("REFINEMENT_ENCRYPTION_KEY", "benchmark")
+    proc_env.update(env or {})
+    cwd = None
+    if tree:
+        cwd = os.path.abspath(tree)
+        # benchmarks.build comes from this checkout if the other tree lacks it
+        proc_env["PYTHONPATH"] = os.pathsep.join([cwd, ROOT_DIR])
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.build", os.path.abspath(input_path), os.path.abspath(db_path)],
+        env=proc_env, cwd=cwd, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def parse_env(pairs: Optional[List[str]]) -> Dict[str, str]:
+    """Setting overrides from KEY=VALUE command line arguments."""
+    env = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        env[key] = value
+    return env
+
+
+def median_seconds(fn: Callable[[], object], repeat: int = 5) -> float:
+    """Median wall time of fn over several runs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def mb_per_second(size: int, seconds: float) -> float:
+    return size / (1024 * 1024) / seconds if seconds else float("inf")
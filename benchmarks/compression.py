@@ -0,0 +1,83 @@
+"""
+Benchmark pre-encryption compression codecs on refined databases.
+
+Reports compression ratio and throughput for every codec and level, plus
+end-to-end encryption throughput with each codec at its default level.
+Pass db.libsql files to measure real refinements, otherwise databases are
+built from generated miner and webapp submissions:
+
+    python -m benchmarks.compression output/db.libsql
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from refiner.utils.compress import CODECS, compress, decompress, zstandard
+from refiner.utils.encrypt import encrypt_file
+from benchmarks.common import build_database, mb_per_second
+from benchmarks.datagen import write_submission
+
+LEVELS = {
+    "none": [None],
+    "zlib": [1, 6, 9],
+    "lzma": [0, 6],
+    "zstd": [1, 3, 10, 19],
+}
+
+
+def benchmark_codecs(db_path: str) -> None:
+    with open(db_path, 'rb') as f:
+        data = f.read()
+    print(f"\n{db_path}: {len(data)} bytes")
+    print(f"{'codec':<8}{'level':>6}{'ratio':>8}{'comp MB/s':>12}{'decomp MB/s':>13}")
+    for codec, levels in LEVELS.items():
+        if codec == "zstd" and zstandard is None:
+            print(f"{codec:<8}  skipped, 'zstandard' is not installed")
+            continue
+        for level in levels:
+            start = time.perf_counter()
+            compressed = compress(data, codec, level)
+            compress_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            decompress(compressed, codec)
+            decompress_seconds = time.perf_counter() - start
+
+            print(f"{codec:<8}{str(level):>6}{len(data) / len(compressed):>8.2f}"
+                  f"{mb_per_second(len(data), compress_seconds):>12.1f}{mb_per_second(len(data), decompress_seconds):>13.1f}")
+
+
+def benchmark_encryption(db_path: str, tmp: str) -> None:
+    size = os.path.getsize(db_path)
+    print(f"{'pipeline':<14}{'encrypted bytes':>16}{'MB/s':>8}")
+    for codec in ["pgp"] + [name for name in CODECS if name != "zstd" or zstandard is not None]:
+        output_path = os.path.join(tmp, f"encrypted.{codec}.pgp")
+        start = time.perf_counter()
+        encrypt_file("benchmark", db_path, output_path, compression=codec)
+        seconds = time.perf_counter() - start
+        print(f"{codec:<14}{os.path.getsize(output_path):>16}{mb_per_second(size, seconds):>8.1f}")
+
+
+def run(db_paths, chats: int, messages: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        if not db_paths:
+            for source in ["telegramMiner", "telegram"]:
+                input_path = write_submission(os.path.join(tmp, f"{source}.json"), source=source,
+                                              chats=chats, messages_per_chat=messages)
+                db_path = os.path.join(tmp, f"{source}.libsql")
+                build_database(input_path, db_path)
+                db_paths.append(db_path)
+
+        for db_path in db_paths:
+            benchmark_codecs(db_path)
+            benchmark_encryption(db_path, tmp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_paths", nargs="*", help="Refined databases to benchmark")
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000, help="Messages per chat for generated databases")
+    args = parser.parse_args()
+    run(args.db_paths, args.chats, args.messages)
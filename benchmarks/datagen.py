@@ -0,0 +1,73 @@
+"""
+Synthetic submission generator for benchmarks.
+
+Messages are resampled from the sample files in `input/`, so generated
+payloads have the same shape and content mix as real exports.
+"""
+import copy
+import json
+import os
+import random
+from typing import Any, Dict
+
+SAMPLES = {
+    "telegramMiner": "miner-fileDto.json",
+    "telegram": "webapp-fileDto.json",
+}
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "input")
+
+
+def load_templates(source: str) -> list:
+    """Load all sample messages for a source."""
+    with open(os.path.join(INPUT_DIR, SAMPLES[source]), 'r') as f:
+        sample = json.load(f)
+    return [msg for chat in sample["chats"] for msg in chat["contents"]]
+
+
+def generate_submission(source: str = "telegramMiner", chats: int = 4, messages_per_chat: int = 1000,
+                        seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate a fileDto payload with the given number of chats and messages.
+
+    Args:
+        source: "telegramMiner" or "telegram"
+        chats: Number of chats
+        messages_per_chat: Number of messages in each chat
+        seed: Random seed, the same arguments always produce the same payload
+
+    Returns:
+        Dictionary in the same format as the input fileDto files
+    """
+    rng = random.Random(seed)
+    templates = load_templates(source)
+    start_date = 1672531200  # 2023-01-01
+
+    payload = {
+        "revision": "01.01",
+        "source": source,
+        "user": str(5000000000 + seed),
+        "submission_token": f"synthetic-{seed}",
+        "chats": [],
+    }
+    for chat_index in range(chats):
+        chat_id = -(900000000 + chat_index)
+        date = start_date
+        contents = []
+        for message_index in range(messages_per_chat):
+            msg = copy.deepcopy(rng.choice(templates))
+            date += rng.randint(1, 3600)
+            msg["id"] = message_index + 1
+            msg["date"] = date
+            if source == "telegram":
+                msg["chat_id"] = chat_id
+            contents.append(msg)
+        payload["chats"].append({"chat_id": chat_id, "contents": contents})
+    return payload
+
+
+def write_submission(path: str, **kwargs) -> str:
+    """Generate a submission and write it to a JSON file."""
+    with open(path, 'w') as f:
+        json.dump(generate_submission(**kwargs), f)
+    return path
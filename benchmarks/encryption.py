@@ -0,0 +1,76 @@
+"""
+Benchmark the OpenPGP encryption backends on refined databases.
+
+Encrypts each database with every backend, with and without OpenPGP
+compression, reports encrypt and decrypt throughput, and checks that each
+message decrypts with the other backend too. Pass db.libsql files to measure
+real refinements, otherwise databases are built from generated submissions:
+
+    python -m benchmarks.encryption output/db.libsql
+"""
+import argparse
+import filecmp
+import os
+import tempfile
+import time
+import warnings
+
+from refiner.utils.encrypt import decrypt_file, encrypt_file
+from benchmarks.common import build_database, mb_per_second
+from benchmarks.datagen import write_submission
+
+BACKENDS = ["native", "pgpy"]
+# "pgp" compresses inside the OpenPGP message, "none" stores the database as is
+COMPRESSIONS = ["pgp", "none"]
+
+
+def benchmark_backends(db_path: str, tmp: str) -> None:
+    size = os.path.getsize(db_path)
+    print(f"\n{db_path}: {size} bytes")
+    print(f"{'backend':<8}{'compression':>12}{'encrypted bytes':>17}{'enc MB/s':>10}{'dec MB/s':>10}  cross-decrypt")
+    for compression in COMPRESSIONS:
+        for backend in BACKENDS:
+            encrypted_path = os.path.join(tmp, f"{backend}.{compression}.pgp")
+            start = time.perf_counter()
+            encrypt_file("benchmark", db_path, encrypted_path, compression=compression, backend=backend)
+            encrypt_seconds = time.perf_counter() - start
+
+            decrypted_path = os.path.join(tmp, f"{backend}.{compression}.decrypted")
+            start = time.perf_counter()
+            decrypt_file("benchmark", encrypted_path, decrypted_path, compression=compression, backend=backend)
+            decrypt_seconds = time.perf_counter() - start
+
+            other = next(name for name in BACKENDS if name != backend)
+            cross_path = os.path.join(tmp, f"{backend}.{compression}.{other}.decrypted")
+            decrypt_file("benchmark", encrypted_path, cross_path, compression=compression, backend=other)
+            matches = filecmp.cmp(db_path, decrypted_path, shallow=False) \
+                and filecmp.cmp(db_path, cross_path, shallow=False)
+
+            print(f"{backend:<8}{compression:>12}{os.path.getsize(encrypted_path):>17}"
+                  f"{mb_per_second(size, encrypt_seconds):>10.1f}{mb_per_second(size, decrypt_seconds):>10.1f}"
+                  f"  {'ok' if matches else 'MISMATCH'} ({other})")
+
+
+def run(db_paths, chats: int, messages: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        if not db_paths:
+            for source in ["telegramMiner", "telegram"]:
+                input_path = write_submission(os.path.join(tmp, f"{source}.json"), source=source,
+                                              chats=chats, messages_per_chat=messages)
+                db_path = os.path.join(tmp, f"{source}.libsql")
+                build_database(input_path, db_path)
+                db_paths.append(db_path)
+
+        for db_path in db_paths:
+            benchmark_backends(db_path, tmp)
+
+
+if __name__ == "__main__":
+    # pgpy's use of deprecated cryptography algorithms is noisy
+    warnings.simplefilter("ignore")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_paths", nargs="*", help="Refined databases to benchmark")
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=2000, help="Messages per chat for generated databases")
+    args = parser.parse_args()
+    run(args.db_paths, args.chats, args.messages)
@@ -0,0 +1,216 @@
+"""
+Golden-output equivalence harness for refiner fast paths.
+
+Builds every input with a reference configuration and a candidate
+configuration, each in its own process, and compares the two databases
+semantically, table by table. Random keys are replaced by the natural keys
+of the rows they point to, timestamps are compared as epoch seconds whatever
+their storage, and fields set from the current time are ignored. The table
+definitions (the get_schema output) must match too unless --allow-schema-change
+is given. Integer keys of the normalized message layout are compared as the
+sender ID, content type and content they stand for. Inputs default to the
+samples in input/ plus generated submissions.
+
+    python -m benchmarks.golden --candidate-env KEY_MODE=integer --allow-schema-change
+    python -m benchmarks.golden --candidate-env MESSAGE_LAYOUT=normalized --allow-schema-change
+    python -m benchmarks.golden --candidate-env BUILD_MESSAGE_EDGES=true --allow-schema-change
+    python -m benchmarks.golden --reference-tree /tmp/main-checkout
+
+Exits with status 1 if any input differs.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.common import build_database, parse_env
+from benchmarks.datagen import INPUT_DIR, write_submission
+
+# Primary key column and natural key columns of each table, in dependency order
+NATURAL_KEYS = {
+    'users': ('UserID', ('Source', 'SourceUserId')),
+    'submissions': ('SubmissionID', ('UserID', 'SubmissionReference')),
+    'submission_chats': ('SubmissionChatID', ('SubmissionID', 'SourceChatID')),
+    'chat_messages': ('MessageID', ('SubmissionChatID', 'SourceMessageID')),
+}
+
+# Key columns, wherever they appear, resolved through the table they identify
+KEY_OWNERS = {key_column: table for table, (key_column, _) in NATURAL_KEYS.items()}
+KEY_OWNERS.update(ReplyToMessageID='chat_messages', OriginMessageID='chat_messages')
+
+# Dimension keys of the normalized message layout: column they replace and table holding its values
+DIMENSION_KEYS = {
+    'SenderKey': ('SenderID', 'senders'),
+    'ContentTypeKey': ('ContentType', 'content_types'),
+}
+DIMENSION_TABLES = {'senders', 'content_types', 'content_placeholders'}
+
+# Set from the current time while refining
+VOLATILE_COLUMNS = {'DateTimeCreated', 'SubmissionDate'}
+
+MAX_EXAMPLES = 3
+
+
+def _schema(conn: sqlite3.Connection) -> Dict[str, str]:
+    return dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    ))
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> Dict[str, str]:
+    return {row[1]: row[2].upper() for row in conn.execute(f'PRAGMA table_info("{table}")')}
+
+
+def _logical_columns(conn: sqlite3.Connection, table: str) -> Dict[str, Tuple[str, str]]:
+    """SQL expression and declared type of each column, with dimension keys replaced by their values."""
+    columns = {}
+    declared = _columns(conn, table)
+    for column, declared_type in declared.items():
+        if column in DIMENSION_KEYS:
+            value_column, dimension = DIMENSION_KEYS[column]
+            columns[value_column] = (
+                f'(SELECT d."{value_column}" FROM "{dimension}" d WHERE d."{column}" = t."{column}")', 'VARCHAR'
+            )
+        elif column == 'PlaceholderKey':
+            continue
+        elif column == 'Content' and 'PlaceholderKey' in declared:
+            columns[column] = ('COALESCE(t."Content", (SELECT p."Content" FROM content_placeholders p '
+                               'WHERE p."PlaceholderKey" = t."PlaceholderKey"))', declared_type)
+        else:
+            columns[column] = (f't."{column}"', declared_type)
+    return columns
+
+
+def _normalize_value(value: Any, declared_type: str) -> Any:
+    """Timestamps as epoch seconds, whether stored as DATETIME strings or integers."""
+    if isinstance(value, str) and declared_type in ('DATETIME', 'TIMESTAMP'):
+        return int(datetime.fromisoformat(value).timestamp())
+    return value
+
+
+class DatabaseView:
+    """Rows of a refined database with keys replaced by natural keys."""
+
+    def __init__(self, db_path: str):
+        self.conn = sqlite3.connect(db_path)
+        self.schema = _schema(self.conn)
+        self.natural: Dict[str, Dict[Any, Tuple]] = {}
+        for table, (key_column, natural_columns) in NATURAL_KEYS.items():
+            if table not in self.schema:
+                continue
+            columns = _columns(self.conn, table)
+            selected = ', '.join(f'"{column}"' for column in (key_column,) + natural_columns)
+            self.natural[table] = {
+                row[0]: tuple(self._resolve(column, _normalize_value(value, columns[column]))
+                              for column, value in zip(natural_columns, row[1:]))
+                for row in self.conn.execute(f'SELECT {selected} FROM "{table}"')
+            }
+
+    def _resolve(self, column: str, value: Any) -> Any:
+        """Replace a key by the natural key path of the row it identifies, e.g. user/chat/message."""
+        owner = KEY_OWNERS.get(column)
+        if owner is None or value is None:
+            return value
+        natural = self.natural.get(owner, {})
+        if value not in natural:
+            return f"<dangling {owner} key {value!r}>"
+        return '/'.join(str(part) for part in natural[value])
+
+    def rows(self, table: str, columns: List[str]) -> Counter:
+        logical = _logical_columns(self.conn, table)
+        selected = ', '.join(logical[column][0] for column in columns)
+        return Counter(
+            tuple(self._resolve(column, _normalize_value(value, logical[column][1]))
+                  for column, value in zip(columns, row))
+            for row in self.conn.execute(f'SELECT {selected} FROM "{table}" t')
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def compare_databases(reference_path: str, candidate_path: str, allow_schema_change: bool = False) -> List[str]:
+    """Return human readable differences between two refined databases (empty if equivalent)."""
+    reference, candidate = DatabaseView(reference_path), DatabaseView(candidate_path)
+    differences = []
+    try:
+        for table in sorted((set(reference.schema) | set(candidate.schema)) - DIMENSION_TABLES):
+            if table not in candidate.schema or table not in reference.schema:
+                where = "candidate" if table not in candidate.schema else "reference"
+                differences.append(f"{table}: missing from {where}")
+                continue
+            if reference.schema[table] != candidate.schema[table] and not allow_schema_change:
+                differences.append(f"{table}: table definition changed")
+
+            reference_columns = _logical_columns(reference.conn, table)
+            candidate_columns = _logical_columns(candidate.conn, table)
+            if set(reference_columns) != set(candidate_columns):
+                differences.append(f"{table}: columns differ "
+                                   f"({sorted(set(reference_columns) ^ set(candidate_columns))})")
+            columns = [column for column in reference_columns
+                       if column in candidate_columns and column not in VOLATILE_COLUMNS]
+
+            expected, actual = reference.rows(table, columns), candidate.rows(table, columns)
+            missing, extra = expected - actual, actual - expected
+            if missing or extra:
+                differences.append(f"{table}: {sum(missing.values())} rows missing, {sum(extra.values())} unexpected "
+                                   f"(of {sum(expected.values())})")
+                for label, rows in (("missing", missing), ("unexpected", extra)):
+                    for row in list(rows)[:MAX_EXAMPLES]:
+                        differences.append(f"    {label}: {dict(zip(columns, row))}"[:400])
+    finally:
+        reference.close()
+        candidate.close()
+    return differences
+
+
+def _inputs(paths: List[str], tmp: str, chats: int, messages: int) -> List[str]:
+    if paths:
+        return paths
+    inputs = sorted(glob.glob(os.path.join(INPUT_DIR, '*.json')))
+    if messages:
+        for source in ["telegramMiner", "telegram"]:
+            inputs.append(write_submission(os.path.join(tmp, f"generated-{source}.json"), source=source,
+                                           chats=chats, messages_per_chat=messages))
+    return inputs
+
+
+def run(args: argparse.Namespace) -> bool:
+    reference_env, candidate_env = parse_env(args.reference_env), parse_env(args.candidate_env)
+    equivalent = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for index, input_path in enumerate(_inputs(args.inputs, tmp, args.chats, args.messages)):
+            reference_db = os.path.join(tmp, f"{index}-reference.libsql")
+            candidate_db = os.path.join(tmp, f"{index}-candidate.libsql")
+            reference = build_database(input_path, reference_db, reference_env, args.reference_tree)
+            candidate = build_database(input_path, candidate_db, candidate_env, args.candidate_tree)
+
+            differences = compare_databases(reference_db, candidate_db, args.allow_schema_change)
+            status = "equivalent" if not differences else "DIFFERENT"
+            print(f"{os.path.basename(input_path)}: {status} "
+                  f"(build {reference['build_seconds']:.2f}s -> {candidate['build_seconds']:.2f}s, "
+                  f"{reference['db_bytes']} -> {candidate['db_bytes']} bytes)")
+            for difference in differences:
+                print(f"  {difference}")
+            equivalent = equivalent and not differences
+    return equivalent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="Input files (defaults to input/*.json and generated submissions)")
+    parser.add_argument("--reference-env", action="append", metavar="KEY=VALUE", help="Setting for the reference build")
+    parser.add_argument("--candidate-env", action="append", metavar="KEY=VALUE", help="Setting for the candidate build")
+    parser.add_argument("--reference-tree", help="Checkout whose refiner package builds the reference")
+    parser.add_argument("--candidate-tree", help="Checkout whose refiner package builds the candidate")
+    parser.add_argument("--allow-schema-change", action="store_true",
+                        help="Only compare data, not table definitions")
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=500,
+                        help="Messages per chat of generated submissions (0 to skip them)")
+    sys.exit(0 if run(parser.parse_args()) else 1)
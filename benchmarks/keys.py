@@ -0,0 +1,62 @@
+"""
+Compare database size and join performance of the KEY_MODE layouts.
+
+    python -m benchmarks.keys --chats 8 --messages 5000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+
+from benchmarks.common import build_database, median_seconds
+from benchmarks.datagen import write_submission
+
+KEY_MODES = ["uuid", "integer", "binary"]
+
+QUERIES = {
+    "messages_per_chat": """
+        SELECT c.SourceChatID, COUNT(*)
+        FROM chat_messages m JOIN submission_chats c ON m.SubmissionChatID = c.SubmissionChatID
+        GROUP BY c.SourceChatID
+    """,
+    "full_join": """
+        SELECT u.SourceUserId, c.SourceChatID, m.SenderID, m.MessageDate
+        FROM users u
+        JOIN submissions s ON s.UserID = u.UserID
+        JOIN submission_chats c ON c.SubmissionID = s.SubmissionID
+        JOIN chat_messages m ON m.SubmissionChatID = c.SubmissionChatID
+    """,
+    "latest_in_chat": """
+        SELECT m.SourceMessageID, m.MessageDate
+        FROM chat_messages m
+        WHERE m.SubmissionChatID = (SELECT SubmissionChatID FROM submission_chats ORDER BY SourceChatID LIMIT 1)
+        ORDER BY m.MessageDate DESC LIMIT 100
+    """,
+}
+
+
+def run(chats: int, messages: int, source: str, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = write_submission(os.path.join(tmp, "input.json"), source=source,
+                                      chats=chats, messages_per_chat=messages)
+        print(f"{'mode':<10}{'db bytes':>12}{'build s':>10}" + "".join(f"{name:>20}" for name in QUERIES))
+        for mode in KEY_MODES:
+            db_path = os.path.join(tmp, f"{mode}.libsql")
+            report = build_database(input_path, db_path, {"KEY_MODE": mode})
+
+            conn = sqlite3.connect(db_path)
+            timings = [median_seconds(lambda q=query: conn.execute(q).fetchall(), repeat) for query in QUERIES.values()]
+            conn.close()
+
+            print(f"{mode:<10}{report['db_bytes']:>12}{report['build_seconds']:>10.2f}"
+                  + "".join(f"{t * 1000:>18.2f}ms" for t in timings))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=5000, help="Messages per chat")
+    parser.add_argument("--source", default="telegramMiner", choices=["telegramMiner", "telegram"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.chats, args.messages, args.source, args.repeat)
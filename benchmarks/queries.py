@@ -0,0 +1,195 @@
+"""
+Query latency of refined databases, for judging schema and index changes.
+
+Runs a catalogue of representative Query Engine queries (date range scans,
+per-sender counts, chat joins, text search, ...) against databases built
+from generated submissions of several sizes, and reports the median latency
+and row count of each, with its EXPLAIN QUERY PLAN:
+
+    python -m benchmarks.queries --sizes 1000,10000,100000
+    python -m benchmarks.queries --env MESSAGE_LAYOUT=normalized --env KEY_MODE=integer
+    python -m benchmarks.queries --db output/db.libsql --plans
+
+Query parameters (the date range, chat, sender and search term) are taken
+from the data of each database, so the same catalogue runs on any layout.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks.common import build_database, median_seconds, parse_env
+from benchmarks.datagen import write_submission
+
+# Column expressions and joins of chat_messages m, by MESSAGE_LAYOUT
+LAYOUTS = {
+    "flat": {
+        "sender": "m.SenderID",
+        "content_type": "m.ContentType",
+        "content": "m.Content",
+        "joins": "",
+    },
+    "normalized": {
+        "sender": "s.SenderID",
+        "content_type": "t.ContentType",
+        "content": "COALESCE(m.Content, p.Content)",
+        "joins": """
+        JOIN senders s ON s.SenderKey = m.SenderKey
+        JOIN content_types t ON t.ContentTypeKey = m.ContentTypeKey
+        LEFT JOIN content_placeholders p ON p.PlaceholderKey = m.PlaceholderKey""",
+    },
+}
+
+# Query templates over the LAYOUTS fields, plus {day} for the calendar day of m.MessageDate
+QUERIES = {
+    "date_range": """
+        SELECT m.MessageID, m.MessageDate, {sender}, {content_type}
+        FROM chat_messages m {joins}
+        WHERE m.MessageDate >= :start AND m.MessageDate < :end
+        ORDER BY m.MessageDate
+    """,
+    "chat_timeline": """
+        SELECT m.SourceMessageID, m.MessageDate, {sender}, {content}
+        FROM chat_messages m {joins}
+        WHERE m.SubmissionChatID = :chat
+        ORDER BY m.MessageDate DESC LIMIT 100
+    """,
+    "messages_per_sender": """
+        SELECT {sender}, COUNT(*) AS messages
+        FROM chat_messages m {joins}
+        GROUP BY {sender}
+        ORDER BY messages DESC
+    """,
+    "sender_history": """
+        SELECT m.MessageID, m.MessageDate
+        FROM chat_messages m {joins}
+        WHERE {sender} = :sender
+        ORDER BY m.MessageDate
+    """,
+    "content_types_per_chat": """
+        SELECT c.SourceChatID, {content_type}, COUNT(*)
+        FROM chat_messages m {joins}
+        JOIN submission_chats c ON c.SubmissionChatID = m.SubmissionChatID
+        GROUP BY c.SourceChatID, {content_type}
+    """,
+    "daily_activity": """
+        SELECT {day} AS day, COUNT(*), COUNT(DISTINCT {sender})
+        FROM chat_messages m {joins}
+        GROUP BY day
+    """,
+    "user_chats": """
+        SELECT u.SourceUserId, c.SourceChatID, c.MessageCount, MAX(m.MessageDate)
+        FROM users u
+        JOIN submissions sub ON sub.UserID = u.UserID
+        JOIN submission_chats c ON c.SubmissionID = sub.SubmissionID
+        JOIN chat_messages m ON m.SubmissionChatID = c.SubmissionChatID
+        GROUP BY u.SourceUserId, c.SourceChatID, c.MessageCount
+    """,
+    "text_search": """
+        SELECT m.MessageID, m.MessageDate, {content}
+        FROM chat_messages m {joins}
+        WHERE {content} LIKE :term
+        ORDER BY m.MessageDate DESC LIMIT 50
+    """,
+}
+
+
+def layout(conn: sqlite3.Connection) -> Dict[str, str]:
+    """LAYOUTS fields of a database, with its {day} expression."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+    fields = dict(LAYOUTS["normalized" if "SenderKey" in columns else "flat"])
+    epoch = conn.execute("SELECT typeof(MessageDate) FROM chat_messages LIMIT 1").fetchone() == ("integer",)
+    fields["day"] = "date(m.MessageDate, 'unixepoch')" if epoch else "date(m.MessageDate)"
+    return fields
+
+
+def parameters(conn: sqlite3.Connection, fields: Dict[str, str]) -> Dict[str, Any]:
+    """Query parameters picked from the data: the middle quarter of dates, the largest chat, the busiest sender."""
+    count = conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0]
+    date_at = "SELECT MessageDate FROM chat_messages ORDER BY MessageDate LIMIT 1 OFFSET ?"
+    sender = conn.execute(
+        f"SELECT {fields['sender']} FROM chat_messages m {fields['joins']} "
+        f"GROUP BY {fields['sender']} ORDER BY COUNT(*) DESC LIMIT 1"
+    ).fetchone()
+    chat = conn.execute("SELECT SubmissionChatID FROM submission_chats ORDER BY MessageCount DESC LIMIT 1").fetchone()
+    text = conn.execute(
+        f"SELECT {fields['content']} FROM chat_messages m {fields['joins']} "
+        f"WHERE {fields['content_type']} = 'text' AND length({fields['content']}) > 20 LIMIT 1"
+    ).fetchone()
+    words = sorted((text[0] if text else "").split(), key=len)
+    return {
+        "start": conn.execute(date_at, (count * 3 // 8,)).fetchone()[0],
+        "end": conn.execute(date_at, (count * 5 // 8,)).fetchone()[0],
+        "chat": chat[0] if chat else None,
+        "sender": sender[0] if sender else None,
+        "term": f"%{words[-1] if words else 'a'}%",
+    }
+
+
+def run_queries(db_path: str, repeat: int) -> List[Dict[str, Any]]:
+    """Median latency, row count and query plan of every catalogue query on a database."""
+    conn = sqlite3.connect(db_path)
+    try:
+        fields = layout(conn)
+        params = parameters(conn, fields)
+        results = []
+        for name, template in QUERIES.items():
+            sql = template.format(**fields)
+            rows = len(conn.execute(sql, params).fetchall())
+            seconds = median_seconds(lambda: conn.execute(sql, params).fetchall(), repeat)
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+            results.append({"query": name, "ms": seconds * 1000, "rows": rows, "plan": plan})
+        return results
+    finally:
+        conn.close()
+
+
+def report(label: str, db_path: str, results: List[Dict[str, Any]], plans: bool) -> None:
+    print(f"{label}: {os.path.getsize(db_path)} bytes")
+    print(f"  {'query':<24}{'ms':>10}{'rows':>10}")
+    for result in results:
+        print(f"  {result['query']:<24}{result['ms']:>10.2f}{result['rows']:>10}")
+        if plans:
+            for step in result["plan"]:
+                print(f"      {step}")
+
+
+def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    runs = []
+    if args.db:
+        for db_path in args.db:
+            runs.append({"database": db_path, "queries": run_queries(db_path, args.repeat)})
+            report(db_path, db_path, runs[-1]["queries"], args.plans)
+        return runs
+
+    env = parse_env(args.env)
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            input_path = write_submission(os.path.join(tmp, f"{size}.json"), source=args.source,
+                                          chats=args.chats, messages_per_chat=max(1, size // args.chats))
+            db_path = os.path.join(tmp, f"{size}.libsql")
+            build = build_database(input_path, db_path, env)
+            runs.append({"messages": size, "env": env, "db_bytes": build["db_bytes"],
+                         "queries": run_queries(db_path, args.repeat)})
+            report(f"{size} messages", db_path, runs[-1]["queries"], args.plans)
+    return runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", action="append", help="Existing refined database to query instead of generating ones")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")],
+                        default=[1000, 10000, 100000], help="Comma separated total message counts")
+    parser.add_argument("--chats", type=int, default=8)
+    parser.add_argument("--source", default="telegramMiner", choices=["telegramMiner", "telegram"])
+    parser.add_argument("--env", action="append", metavar="KEY=VALUE", help="Setting for the builds")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--plans", action="store_true", help="Print the EXPLAIN QUERY PLAN of each query")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,66 +1,81 @@
+import argparse
 import json
 import logging
 import os
 import sys
 import traceback
-import zipfile
-import shutil
 
+from refiner.models.output import Output
 from refiner.refine import Refiner
 from refiner.config import settings
+from refiner.utils.extract import extract_input
+from refiner.utils.profiler import profiled
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 
 
-def run(port=None) -> None:
+def run(port=None, input_dir: str = None, output_dir: str = None) -> Output:
     """Transform all input files into the database."""
-    input_files_exist = os.path.isdir(settings.INPUT_DIR) and bool(os.listdir(settings.INPUT_DIR))
+    input_dir = input_dir or settings.INPUT_DIR
+    output_dir = output_dir or settings.OUTPUT_DIR
+    input_files_exist = os.path.isdir(input_dir) and bool(os.listdir(input_dir))
 
     if not input_files_exist:
-        raise FileNotFoundError(f"No input files found in {settings.INPUT_DIR}")
-    extract_input()
+        raise FileNotFoundError(f"No input files found in {input_dir}")
+    with profiled(output_dir):
+        extract_input(input_dir)
 
-    refiner = Refiner()
-    output = refiner.transform()
-    
-    output_path = os.path.join(settings.OUTPUT_DIR, "output.json")
-    with open(output_path, 'w') as f:
-        json.dump(output.model_dump(), f, indent=2)    
+        refiner = Refiner(input_dir, output_dir)
+        output = refiner.transform()
+        
+        output_path = os.path.join(output_dir, "output.json")
+        with open(output_path, 'w') as f:
+            json.dump(output.model_dump(), f, indent=2)    
     logging.info(f"Data transformation complete: {output}")
+    return output
 
 
-def extract_input() -> None:
-    """
-    If the input directory contains any zip files, extract them
-    If there are files with .zip extension that are actually JSON files, rename them to .json
-    :return:
-    """
-    for input_filename in os.listdir(settings.INPUT_DIR):
-        input_file = os.path.join(settings.INPUT_DIR, input_filename)
-
-        if input_filename.endswith('.zip'):
-            if zipfile.is_zipfile(input_file):
-                with zipfile.ZipFile(input_file, 'r') as zip_ref:
-                    zip_ref.extractall(settings.INPUT_DIR)
-                    logging.info(f"Extracted {input_file} to {settings.INPUT_DIR}")
-            else:
-                # Check if the file with .zip extension is actually a JSON file
-                try:
-                    with open(input_file, 'r') as f:
-                        json.load(f)  # Try to load as JSON
-                    
-                    # If we get here, it's a valid JSON file
-                    new_filename = os.path.splitext(input_file)[0] + '.json'
-                    shutil.copy2(input_file, new_filename)
-                    logging.info(f"File {input_file} is actually a JSON file. Copied to {new_filename}")
-                except json.JSONDecodeError:
-                    logging.info(f"{input_file} is not a zip file nor a valid JSON file")
-                except Exception as e:
-                    logging.error(f"Error processing {input_file}: {str(e)}")
-
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m refiner", description="Refine submissions into encrypted databases")
+    parser.add_argument("--batch", metavar="PATH",
+                        help="Refine every submission directory under PATH, or listed in the manifest file PATH")
+    parser.add_argument("--merge", nargs="+", metavar="PATH",
+                        help="Merge refined databases (db.libsql or db.libsql.pgp files, or directories holding them) "
+                             "into OUTPUT/merged.libsql")
+    parser.add_argument("--output", metavar="DIR", default=None,
+                        help="Root directory for per-submission outputs in batch mode, or of the merged database "
+                             "(defaults to OUTPUT_DIR)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes in batch or merge mode (defaults to BATCH_WORKERS)")
+    parser.add_argument("--estimate", action="store_true",
+                        help="Estimate counts, sizes and wall time from a sample of the input without refining or uploading")
+    args = parser.parse_args()
+
     try:
-        run()
+        if args.estimate:
+            from refiner.estimate import estimate
+            extract_input()
+            report = estimate()
+            os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
+            with open(os.path.join(settings.OUTPUT_DIR, "estimate.json"), 'w') as f:
+                json.dump(report, f, indent=2)
+            print(json.dumps(report["total"], indent=2))
+        elif args.merge:
+            from refiner.merge import merge_databases
+            output_dir = args.output or settings.OUTPUT_DIR
+            os.makedirs(output_dir, exist_ok=True)
+            report = merge_databases(args.merge, os.path.join(output_dir, "merged.libsql"), args.workers)
+            with open(os.path.join(output_dir, "merge-report.json"), 'w') as f:
+                json.dump(report, f, indent=2)
+            if report["failed"]:
+                sys.exit(1)
+        elif args.batch:
+            from refiner.batch import run_batch
+            summary = run_batch(args.batch, args.output or settings.OUTPUT_DIR, args.workers)
+            if summary["failed"]:
+                sys.exit(1)
+        else:
+            run()
     except Exception as e:
         logging.error(f"Error during data transformation: {e}")
         traceback.print_exc()
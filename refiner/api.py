@@ -0,0 +1,141 @@
+"""
+Library API for refining a submission inside another Python process.
+
+Unlike the Refiner, nothing is read from INPUT_DIR or written to OUTPUT_DIR:
+the submission is passed as fileDto bytes or an already parsed dict, the
+database is built in an in-memory SQLite database and encrypted as it is
+streamed, with no temporary files and no IPFS upload.
+
+    from refiner.api import refine
+
+    refinement = refine(request.body)
+    for chunk in refinement.stream():
+        response.write(chunk)
+"""
+import io
+import json
+import logging
+from functools import cached_property
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Union
+
+from refiner.config import settings
+from refiner.models.offchain_schema import OffChainSchema
+from refiner.refine import build_schema, create_transformer
+from refiner.transformer.base_transformer import MEMORY_DB
+from refiner.utils.encrypt import encrypt_stream
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+Submission = Union[bytes, bytearray, memoryview, str, Dict[str, Any]]
+
+
+class Refinement:
+    """
+    A refined submission. The serialized database is kept until it is read,
+    and encrypted as it is read: stream() yields the ASCII armored OpenPGP
+    message while it is being encrypted, and `encrypted` holds the whole
+    message once it is first accessed.
+    """
+
+    def __init__(self, schema: OffChainSchema, database: bytes, encryption_key: str,
+                 diagnostics: Dict[str, Any]):
+        self.schema = schema
+        self.diagnostics = diagnostics
+        self._database = database
+        self._encryption_key = encryption_key
+        self._codec = settings.REFINEMENT_COMPRESSION
+        # Codec applied before encryption, if not left to the PGP layer
+        self.compression: Optional[str] = self._codec if self._codec != "pgp" else None
+
+    @cached_property
+    def encrypted(self) -> bytes:
+        """ASCII armored OpenPGP message of the database."""
+        return b''.join(self.stream())
+
+    def stream(self, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Yield the encrypted database, feeding the encryption chunk_size bytes
+        of the database at a time.
+
+        With ENCRYPTION_BACKEND=native the message is compressed, encrypted
+        and armored incrementally, so only the database and a few chunks are
+        held in memory. pgpy only encrypts whole messages, so with it the
+        message is built in full and yielded as one chunk. Each call encrypts
+        again, with a new session key, until `encrypted` has been accessed,
+        after which its chunks are yielded.
+        """
+        if 'encrypted' in self.__dict__:
+            view = memoryview(self.encrypted)
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset:offset + chunk_size]
+            return
+        view = memoryview(self._database)
+        chunks = (view[offset:offset + chunk_size] for offset in range(0, len(view), chunk_size))
+        yield from encrypt_stream(self._encryption_key, chunks, self._codec)
+
+    def open(self) -> BinaryIO:
+        """The encrypted database as a readable file object."""
+        return io.BytesIO(self.encrypted)
+
+
+def load_submission(data: Submission) -> Dict[str, Any]:
+    """Parse fileDto JSON given as bytes or text; dicts are returned as they are."""
+    if isinstance(data, dict):
+        return data
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def refine(data: Submission, encryption_key: Optional[str] = None, name: str = "input") -> Refinement:
+    """
+    Refine one submission in memory.
+
+    SHARD_BY and CACHE_DIR do not apply: the submission always becomes a
+    single database and every call refines it again.
+
+    Args:
+        data: The fileDto, as JSON bytes or text or an already parsed dict
+        encryption_key: Passphrase to encrypt with (defaults to settings.REFINEMENT_ENCRYPTION_KEY)
+        name: Name of the submission in log messages
+
+    Returns:
+        The schema, the database to encrypt and the diagnostics of the refinement
+    """
+    input_data = load_submission(data)
+    transformer = create_transformer(input_data, MEMORY_DB, name)
+    try:
+        transformer.process(input_data)
+        schema = build_schema(transformer)
+        database = transformer.serialize()
+    finally:
+        transformer.engine.dispose()
+    logging.info(f"Refined {name} in memory into {len(database)} bytes")
+
+    return Refinement(
+        schema=schema,
+        database=database,
+        encryption_key=encryption_key or settings.REFINEMENT_ENCRYPTION_KEY,
+        diagnostics=transformer.diagnostics.summary()
+    )
+
+
+# Test with: python -m refiner.api
+if __name__ == "__main__":
+    import glob
+    import os
+    import sqlite3
+
+    from refiner.utils.encrypt import decrypt_bytes
+
+    logging.basicConfig(level=logging.INFO)
+    for input_file in sorted(glob.glob(os.path.join(settings.INPUT_DIR, '*.json'))):
+        with open(input_file, 'rb') as f:
+            refinement = refine(f.read(), name=os.path.basename(input_file))
+
+        # Decrypt and load the database back into memory
+        conn = sqlite3.connect(":memory:")
+        encrypted = b''.join(refinement.stream())
+        conn.deserialize(decrypt_bytes(settings.REFINEMENT_ENCRYPTION_KEY, encrypted))
+        messages = conn.execute("SELECT count(*) FROM chat_messages").fetchone()[0]
+        print(f"{input_file}: {len(encrypted)} encrypted bytes, {messages} messages")
@@ -0,0 +1,182 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Tuple
+
+from refiner.config import settings
+from refiner.refine import Refiner
+from refiner.transformer.finalize import combine_reports
+from refiner.utils.extract import extract_input
+from refiner.utils.profiler import profiled
+
+
+def discover_submissions(path: str) -> List[Tuple[str, str]]:
+    """
+    Find the submissions to refine in batch mode.
+
+    PATH is either a directory whose subdirectories each hold one submission,
+    or a manifest file listing submission directories (a JSON array, or one
+    path per line). Relative manifest entries are resolved against the
+    manifest's directory.
+
+    :return: List of (name, input_dir) pairs in a stable order
+    """
+    if os.path.isdir(path):
+        return [
+            (name, os.path.join(path, name))
+            for name in sorted(os.listdir(path))
+            if os.path.isdir(os.path.join(path, name))
+        ]
+
+    with open(path, 'r') as f:
+        content = f.read()
+    try:
+        entries = json.loads(content)
+    except json.JSONDecodeError:
+        entries = [line.strip() for line in content.splitlines()
+                   if line.strip() and not line.lstrip().startswith('#')]
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    submissions = []
+    seen = set()
+    for entry in entries:
+        input_dir = os.path.normpath(os.path.join(base_dir, entry))
+        name = os.path.basename(input_dir)
+        # Manifests may list same-named directories from different parents
+        unique_name, suffix = name, 1
+        while unique_name in seen:
+            suffix += 1
+            unique_name = f"{name}-{suffix}"
+        seen.add(unique_name)
+        submissions.append((unique_name, input_dir))
+    return submissions
+
+
+def refine_submission(name: str, input_dir: str, output_dir: str) -> Dict[str, Any]:
+    """
+    Refine a single submission into its own output directory.
+
+    Runs inside a worker process. Errors are caught and reported in the
+    returned status so one bad submission does not stop the batch.
+    """
+    started = time.perf_counter()
+    status = {"name": name, "input_dir": input_dir, "output_dir": output_dir}
+    try:
+        if not os.path.isdir(input_dir) or not os.listdir(input_dir):
+            raise FileNotFoundError(f"No input files found in {input_dir}")
+        os.makedirs(output_dir, exist_ok=True)
+        with profiled(output_dir):
+            extract_input(input_dir)
+
+            output = Refiner(input_dir, output_dir).transform()
+            with open(os.path.join(output_dir, "output.json"), 'w') as f:
+                json.dump(output.model_dump(), f, indent=2)
+
+        status.update(ok=True, refinement_url=output.refinement_url, finalize=output.finalize)
+    except Exception as e:
+        logging.error(f"Error refining submission {name}: {e}")
+        status.update(ok=False, error=f"{type(e).__name__}: {e}", traceback=traceback.format_exc())
+    status["seconds"] = round(time.perf_counter() - started, 3)
+    return status
+
+
+def _init_worker(ndjson_workers: int) -> None:
+    """Share the CPUs between the batch workers: each parses NDJSON with its share unless NDJSON_WORKERS is set."""
+    if not settings.NDJSON_WORKERS:
+        settings.NDJSON_WORKERS = ndjson_workers
+
+
+def _refine_submissions(submissions: List[Tuple[str, str]], output_root: str, workers: int) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the status of every submission as it finishes. At most `workers`
+    submissions are in flight, so a worker that dies (killed for memory, a
+    signal) only fails the submissions the pool was running. The pool is
+    then recreated for the remaining ones.
+    """
+    # One NDJSON pool per CPU in every batch worker would run about CPU^2 processes
+    ndjson_workers = max(1, (os.cpu_count() or 1) // workers)
+    # Forked workers inherit the already imported refiner modules
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    pending = deque(submissions)
+    while pending:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(ndjson_workers,)) as executor:
+            running = {}
+            broken = False
+            while (pending or running) and not broken:
+                while pending and len(running) < workers:
+                    name, input_dir = pending.popleft()
+                    output_dir = os.path.join(output_root, name)
+                    future = executor.submit(refine_submission, name, input_dir, output_dir)
+                    running[future] = (name, input_dir, output_dir, time.perf_counter())
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+                if broken:
+                    # Every submission of a broken pool fails, wait for all of them
+                    done = wait(running).done
+                for future in done:
+                    name, input_dir, output_dir, submitted = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        yield future.result()
+                        continue
+                    logging.error(f"Error refining submission {name}: {type(error).__name__}: {error}")
+                    yield {
+                        "name": name, "input_dir": input_dir, "output_dir": output_dir,
+                        "ok": False, "error": f"{type(error).__name__}: {error}",
+                        "seconds": round(time.perf_counter() - submitted, 3),
+                    }
+        if broken and pending:
+            logging.warning(f"Worker pool broke, restarting it for the {len(pending)} remaining submissions")
+
+
+def run_batch(path: str, output_root: str, workers: int = None) -> Dict[str, Any]:
+    """
+    Refine every submission found at PATH using a pool of worker processes.
+
+    Each submission is written to OUTPUT_ROOT/<name>/ with its own database
+    and output.json. A batch-summary.json report is written to OUTPUT_ROOT.
+
+    :return: The summary report
+    """
+    submissions = discover_submissions(path)
+    if not submissions:
+        raise FileNotFoundError(f"No submissions found in {path}")
+
+    workers = workers or settings.BATCH_WORKERS or os.cpu_count() or 1
+    workers = min(workers, len(submissions))
+    os.makedirs(output_root, exist_ok=True)
+    logging.info(f"Refining {len(submissions)} submissions with {workers} workers")
+
+    started = time.perf_counter()
+    results = []
+    for result in _refine_submissions(submissions, output_root, workers):
+        results.append(result)
+        outcome = "done" if result["ok"] else f"failed ({result['error']})"
+        logging.info(f"[{len(results)}/{len(submissions)}] {result['name']} {outcome} in {result['seconds']}s")
+
+    results.sort(key=lambda result: result["name"])
+    failed = [result["name"] for result in results if not result["ok"]]
+    summary = {
+        "total": len(results),
+        "succeeded": len(results) - len(failed),
+        "failed": len(failed),
+        "failed_submissions": failed,
+        "workers": workers,
+        "seconds": round(time.perf_counter() - started, 3),
+        "finalize": combine_reports(result.get("finalize") for result in results),
+        "submissions": results,
+    }
+    with open(os.path.join(output_root, "batch-summary.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    logging.info(f"Batch complete: {summary['succeeded']}/{summary['total']} succeeded in {summary['seconds']}s")
+    if failed:
+        logging.warning(f"Failed submissions: {', '.join(failed)}")
+    return summary
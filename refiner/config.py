@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
-from typing import Optional
+from datetime import datetime
+from typing import Optional, Literal
 
 class Settings(BaseSettings):
     """Global settings configuration using environment variables"""
@@ -40,6 +41,187 @@ class Settings(BaseSettings):
         description="Dialect of the schema"
     )
 
+    TRANSFORM_BATCH_SIZE: int = Field(
+        default=5000,
+        description="Maximum number of rows a transformer hands to the database writer at once"
+    )
+
+    DEDUP_MESSAGES: Literal["off", "exact", "bloom"] = Field(
+        default="exact",
+        description="Drop repeated messages keyed on (chat_id, SourceMessageID): 'exact' uses a digest set, 'bloom' a fixed-size Bloom filter"
+    )
+
+    DEDUP_EXPECTED_MESSAGES: int = Field(
+        default=10_000_000,
+        description="Number of messages the Bloom filter is sized for"
+    )
+
+    DEDUP_BLOOM_ERROR_RATE: float = Field(
+        default=0.001,
+        description="Probability that the Bloom filter mistakes a unique message for a duplicate at the expected size"
+    )
+
+    FILTER_CHATS: Optional[str] = Field(
+        default=None,
+        description="Comma separated source chat IDs to refine; messages of other chats are skipped unparsed"
+    )
+
+    FILTER_EXCLUDE_CHATS: Optional[str] = Field(
+        default=None,
+        description="Comma separated source chat IDs whose messages are skipped unparsed"
+    )
+
+    FILTER_SINCE: Optional[datetime] = Field(
+        default=None,
+        description="Skip messages dated before this time (ISO date or time, UTC unless an offset is given, or epoch seconds)"
+    )
+
+    FILTER_UNTIL: Optional[datetime] = Field(
+        default=None,
+        description="Skip messages dated at or after this time, like FILTER_SINCE"
+    )
+
+    FILTER_CONTENT_TYPES: Optional[str] = Field(
+        default=None,
+        description="Comma separated ContentType values to keep (e.g. 'text'); messages of other types are skipped unparsed"
+    )
+
+    FILTER_MAX_MESSAGES_PER_CHAT: Optional[int] = Field(
+        default=None,
+        description="Keep at most this many messages of each chat that pass the other filters and are not duplicates, the first ones in input order"
+    )
+
+    DIAGNOSTICS_MAX_EXAMPLES: int = Field(
+        default=5,
+        description="Number of examples kept per diagnostics category"
+    )
+
+    TIMESTAMP_STORAGE: Literal["datetime", "epoch"] = Field(
+        default="datetime",
+        description="How timestamp columns are stored: 'datetime' (ISO strings) or 'epoch' (integer seconds since the Unix epoch)"
+    )
+
+    KEY_MODE: Literal["uuid", "integer", "binary"] = Field(
+        default="uuid",
+        description="Primary key representation: 'uuid' (36-char strings), 'integer' (rowid aliases) or 'binary' (16-byte UUIDs, messages clustered by chat and date)"
+    )
+
+    MESSAGE_LAYOUT: Literal["flat", "normalized"] = Field(
+        default="flat",
+        description="How chat_messages stores senders and content types: 'flat' (strings on every row) or 'normalized' (integer keys into the senders, content_types and content_placeholders tables)"
+    )
+
+    REFINEMENT_COMPRESSION: Literal["pgp", "none", "zlib", "zstd", "lzma"] = Field(
+        default="pgp",
+        description="Compression applied before encryption. 'pgp' lets the OpenPGP layer compress with zlib; any other codec compresses the database before encryption and disables PGP compression"
+    )
+
+    REFINEMENT_COMPRESSION_LEVEL: Optional[int] = Field(
+        default=None,
+        description="Compression level for REFINEMENT_COMPRESSION, defaults to the codec's own default"
+    )
+
+    ENCRYPTION_BACKEND: Literal["native", "pgpy"] = Field(
+        default="pgpy",
+        description="OpenPGP implementation used to encrypt refinements: 'pgpy' (reference) or 'native' (cryptography based)"
+    )
+
+    SHARD_BY: Literal["none", "chat", "month"] = Field(
+        default="none",
+        description="Split the refinement into several databases: 'chat' packs whole chats up to SHARD_MAX_MESSAGES, 'month' creates one database per month"
+    )
+
+    SHARD_MAX_MESSAGES: int = Field(
+        default=100_000,
+        description="Maximum number of messages per shard when sharding by chat"
+    )
+
+    SHARD_WORKERS: int = Field(
+        default=4,
+        description="Number of shards encrypted and uploaded in parallel"
+    )
+
+    BATCH_WORKERS: int = Field(
+        default=0,
+        description="Number of worker processes used by --batch; 0 uses one per CPU"
+    )
+
+    NDJSON_WORKERS: int = Field(
+        default=0,
+        description="Number of worker processes parsing NDJSON submissions; 0 uses one per CPU (in --batch, the CPUs "
+                    "divided by the batch workers), 1 parses in the refining process"
+    )
+
+    NDJSON_CHUNK_BYTES: int = Field(
+        default=8 * 1024 * 1024,
+        description="Size of the chunks of lines NDJSON submissions are parsed in"
+    )
+
+    CHECKPOINT: bool = Field(
+        default=False,
+        description="Commit the database per chat and every CHECKPOINT_MESSAGES messages, recording progress in a sidecar file so an interrupted refinement resumes where it stopped"
+    )
+
+    CHECKPOINT_MESSAGES: int = Field(
+        default=50_000,
+        description="Messages written between checkpoint commits within a chat, or lines of an NDJSON submission"
+    )
+
+    CACHE_DIR: Optional[str] = Field(
+        default=None,
+        description="Directory of the local refinement result cache, disabled when not set"
+    )
+
+    CACHE_MAX_BYTES: int = Field(
+        default=64 * 1024 * 1024,
+        description="Maximum total size of cached results before least recently used entries are evicted"
+    )
+
+    CACHE_MAX_AGE_SECONDS: int = Field(
+        default=7 * 24 * 3600,
+        description="Maximum age of a cached result"
+    )
+
+    BUILD_MESSAGE_EDGES: bool = Field(
+        default=False,
+        description="Write message_replies and message_forwards edge tables for thread reconstruction"
+    )
+
+    BUILD_AGGREGATES: bool = Field(
+        default=False,
+        description="Precompute per-chat daily counts, per-sender counts and content type histograms after loading"
+    )
+
+    FINALIZE_DATABASE: bool = Field(
+        default=True,
+        description="Run ANALYZE and VACUUM on the database after it is built"
+    )
+
+    FINALIZE_PAGE_SIZE: Optional[int] = Field(
+        default=None,
+        description="Page size in bytes (power of two, 512-65536) applied when finalizing, defaults to SQLite's"
+    )
+
+    FINALIZE_AUTO_VACUUM: Optional[Literal["none", "full", "incremental"]] = Field(
+        default=None,
+        description="auto_vacuum mode applied when finalizing, defaults to SQLite's (none)"
+    )
+
+    ESTIMATE_SAMPLE_MESSAGES: int = Field(
+        default=5000,
+        description="Number of messages --estimate transforms before extrapolating to the whole submission"
+    )
+
+    PROFILE: bool = Field(
+        default=False,
+        description="Sample the stacks of the refining process and write them to profile.folded next to output.json (code locations only, never data)"
+    )
+
+    PROFILE_INTERVAL_MS: float = Field(
+        default=10.0,
+        description="Interval between profile samples in milliseconds"
+    )
+
     # Optional, required if using https://pinata.cloud (IPFS pinning service)
     # PINATA_API_KEY: Optional[str] = Field(
     #     default=None,
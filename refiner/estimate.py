@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from refiner.config import settings
+from refiner.models.refined import ChatMessages
+from refiner.refine import InputPart, create_transformer, input_submissions
+from refiner.utils.encrypt import encrypt_file
+from refiner.utils.ndjson import LineDelimitedSubmission, chunk_ranges, open_submission, read_lines
+from refiner.utils.parts import read_chats
+
+
+def _message_lines(submission: LineDelimitedSubmission) -> Iterator[bytes]:
+    """Message lines of an NDJSON submission, read a chunk at a time."""
+    for start, end in chunk_ranges(submission.path, submission.body_offset, settings.NDJSON_CHUNK_BYTES):
+        for _, line in read_lines(submission.path, start, end):
+            yield line
+
+
+def _part_chats(part: InputPart) -> Iterator[Tuple[Dict[str, Any], Iterator[Any]]]:
+    """
+    (chat, messages) for each chat of a fileDto part, see read_chats. Messages
+    are parsed one at a time unless read_header already parsed the whole part.
+    """
+    if part.document is None:
+        return read_chats(part.path)
+    return ((chat, iter(chat['contents'])) for chat in part.document['chats'])
+
+
+def sample_submission(header: Dict[str, Any], parts: List[InputPart], total: int,
+                      max_messages: int) -> Dict[str, Any]:
+    """
+    Take a systematic sample of at most max_messages of the total messages of
+    the parts of a submission (fileDto or NDJSON) as one fileDto, keeping
+    every k-th message across all chats so the mix of chats and content types
+    is preserved. Chats without sampled messages are dropped.
+    """
+    stride = max(1, -(-total // max(1, max_messages)))
+
+    # Fields of the first chat with each chat_id, and its sampled messages
+    chats: Dict[Any, Tuple[Dict[str, Any], List[Any]]] = {}
+    index = 0
+    for part in parts:
+        if part.line_delimited:
+            # Only the sampled lines are parsed
+            for line in _message_lines(open_submission(part.path)):
+                if index % stride == 0:
+                    msg = json.loads(line)
+                    chat_id = msg.pop('chat_id')
+                    chats.setdefault(chat_id, ({'chat_id': chat_id}, []))[1].append(msg)
+                index += 1
+            continue
+        for chat, messages in _part_chats(part):
+            for msg in messages:
+                if index % stride == 0:
+                    chats.setdefault(chat['chat_id'], (chat, []))[1].append(msg)
+                index += 1
+
+    # Chat fields are complete once all the messages of the chat were read
+    return {**{key: value for key, value in header.items() if key != 'chats'},
+            'chats': [{**{key: value for key, value in chat.items() if key != 'contents'}, 'contents': contents}
+                      for chat, contents in chats.values()]}
+
+
+def _database_stats(db_path: str) -> Dict[str, int]:
+    conn = sqlite3.connect(db_path)
+    try:
+        messages, media_bytes = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(LENGTH(ContentData)), 0) FROM {ChatMessages.__tablename__}"
+        ).fetchone()
+    finally:
+        conn.close()
+    return {'messages': messages, 'media_bytes': media_bytes, 'db_bytes': os.path.getsize(db_path)}
+
+
+def estimate_submission(parts: List[InputPart], max_messages: int = None) -> Dict[str, Any]:
+    """
+    Estimate the cost of refining one submission, given its input files as
+    grouped by the refiner, by transforming and encrypting a sample of it in a
+    temporary directory, then scaling the per-message costs to the whole
+    submission. Nothing is uploaded.
+    """
+    max_messages = max_messages or settings.ESTIMATE_SAMPLE_MESSAGES
+    input_filename = ", ".join(part.filename for part in parts)
+
+    # Parts are counted in a first pass and sampled in a second, streaming their messages both times
+    started = time.perf_counter()
+    chat_ids = set()
+    input_messages = 0
+    for part in parts:
+        if part.line_delimited:
+            for line in _message_lines(open_submission(part.path)):
+                chat_ids.add(json.loads(line)['chat_id'])
+                input_messages += 1
+        else:
+            for chat, messages in _part_chats(part):
+                input_messages += sum(1 for _ in messages)
+                chat_ids.add(chat['chat_id'])
+    parse_seconds = time.perf_counter() - started
+
+    sample = sample_submission(parts[0].header, parts, input_messages, max_messages)
+    sample_messages = sum(len(chat['contents']) for chat in sample['chats'])
+    scale = input_messages / sample_messages if sample_messages else 0.0
+
+    with tempfile.TemporaryDirectory(prefix='refiner-estimate-') as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'db.libsql')
+        transformer = create_transformer(sample, db_path, input_filename)
+        # The schema alone takes a few pages whatever the submission size
+        empty_db_bytes = os.path.getsize(db_path)
+
+        started = time.perf_counter()
+        transformer.process(sample)
+        transform_seconds = time.perf_counter() - started
+        stats = _database_stats(db_path)
+
+        started = time.perf_counter()
+        encrypted_path = encrypt_file(settings.REFINEMENT_ENCRYPTION_KEY, db_path)
+        encrypt_seconds = time.perf_counter() - started
+        encrypted_ratio = os.path.getsize(encrypted_path) / stats['db_bytes']
+
+    db_bytes = empty_db_bytes + (stats['db_bytes'] - empty_db_bytes) * scale
+    return {
+        'file': input_filename,
+        'parts': len(parts),
+        'source': parts[0].header.get('source'),
+        'transformer': type(transformer).__name__,
+        'input_bytes': sum(os.path.getsize(part.path) for part in parts),
+        'chats': len(chat_ids),
+        'input_messages': input_messages,
+        'sample_messages': sample_messages,
+        'messages': round(stats['messages'] * scale),
+        'media_bytes': round(stats['media_bytes'] * scale),
+        'db_bytes': round(db_bytes),
+        'encrypted_bytes': round(db_bytes * encrypted_ratio),
+        'seconds': {
+            'parse': round(parse_seconds, 3),
+            'transform': round(transform_seconds * scale, 3),
+            'encrypt': round(encrypt_seconds * scale, 3),
+            'total': round(parse_seconds + (transform_seconds + encrypt_seconds) * scale, 3),
+        },
+    }
+
+
+def estimate(input_dir: str = None, max_messages: int = None) -> Dict[str, Any]:
+    """
+    Estimate message counts, media bytes, database and encrypted sizes and wall
+    time (excluding uploads) of refining every submission in input_dir, with
+    input files grouped into submissions as the refiner groups them.
+    """
+    input_dir = input_dir or settings.INPUT_DIR
+    files: List[Dict[str, Any]] = []
+    for parts in input_submissions(input_dir):
+        files.append(estimate_submission(parts, max_messages))
+        logging.info(f"Estimated {files[-1]['file']}")
+
+    total = {
+        key: sum(entry[key] for entry in files)
+        for key in ('input_bytes', 'chats', 'input_messages', 'messages', 'media_bytes', 'db_bytes', 'encrypted_bytes')
+    }
+    total['seconds'] = round(sum(entry['seconds']['total'] for entry in files), 3)
+    return {'files': files, 'total': total}
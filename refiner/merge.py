@@ -0,0 +1,257 @@
+"""
+Merge many refined databases into one aggregate database, the way the Query
+Engine sees all refinements of a refiner, for local analysis and load tests.
+
+    python -m refiner --merge output/batch --output /tmp/merged
+    python -m refiner.merge merged.libsql a/db.libsql b/db.libsql.pgp ...
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import create_engine
+
+from refiner.config import settings
+from refiner.models.refined import Senders, ContentTypes, ContentPlaceholders
+from refiner.transformer.finalize import finalize_database
+from refiner.utils.encrypt import decrypt_file
+
+# Dimension tables of the normalized layout: integer keys interned per database,
+# remapped on their unique natural column
+DIMENSIONS = {
+    model.__tablename__: (
+        model.__mapper__.primary_key[0].name,
+        next(column.name for column in model.__table__.columns if column.unique)
+    )
+    for model in (Senders, ContentTypes, ContentPlaceholders)
+}
+
+# Integer primary keys that are renumbered after those already merged
+INTEGER_KEY_TABLES = ('users', 'submissions', 'submission_chats', 'chat_messages')
+
+
+class MergeInput(NamedTuple):
+    path: str  # As given, possibly encrypted
+    db_path: str  # Plaintext database
+    digest: str
+
+
+def discover_databases(paths: List[str]) -> List[str]:
+    """
+    Refined databases at the given paths. Directories, such as a batch output
+    root, are searched recursively for db*.libsql files, or their .pgp
+    encryptions when the plaintext is not there.
+    """
+    databases = []
+    for path in paths:
+        if not os.path.isdir(path):
+            databases.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.startswith('db'):
+                    continue
+                if name.endswith('.libsql') or (name.endswith('.libsql.pgp') and name[:-4] not in files):
+                    databases.append(os.path.join(root, name))
+    return databases
+
+
+def _compression(path: str) -> Optional[str]:
+    """Codec an encrypted database was compressed with, from the output.json next to it if any."""
+    output_path = os.path.join(os.path.dirname(path), 'output.json')
+    if os.path.exists(output_path):
+        with open(output_path, 'r') as f:
+            return json.load(f).get('compression') or "pgp"
+    return None
+
+
+def prepare_input(index: int, path: str, tmp_dir: str, encryption_key: str) -> MergeInput:
+    """Decrypt an input if needed and digest it. Runs in a worker process."""
+    db_path = path
+    if path.endswith('.pgp'):
+        db_path = decrypt_file(encryption_key, path, os.path.join(tmp_dir, f"{index:06d}.libsql"),
+                               compression=_compression(path))
+    with open(db_path, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+    return MergeInput(path, db_path, digest)
+
+
+def _tables(conn: sqlite3.Connection, schema: str) -> Dict[str, str]:
+    """CREATE TABLE statements by table name, in creation order (parents before children)."""
+    return dict(conn.execute(
+        f"SELECT name, sql FROM {schema}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+    ).fetchall())
+
+
+def _column_expressions(conn: sqlite3.Connection, table: str, offsets: Dict[str, int]) -> Dict[str, str]:
+    """SELECT expression over src.<table> t for every column, translating keys into the merged database."""
+    expressions = {row[1]: f't."{row[1]}"' for row in conn.execute(f'PRAGMA src.table_info("{table}")')}
+    owners = {column: table for column in expressions
+              if table in offsets and column == _primary_key(conn, table)}
+    for row in conn.execute(f'PRAGMA src.foreign_key_list("{table}")'):
+        owners[row[3]] = row[2]
+    for column, owner in owners.items():
+        if owner in DIMENSIONS:
+            expressions[column] = f'(SELECT new FROM temp."map_{owner}" WHERE old = t."{column}")'
+        elif offsets.get(owner):
+            expressions[column] = f't."{column}" + {offsets[owner]}'
+    return expressions
+
+
+def _primary_key(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    keys = [row[1] for row in conn.execute(f'PRAGMA src.table_info("{table}")') if row[5] == 1]
+    return keys[0] if keys else None
+
+
+def _merge_one(conn: sqlite3.Connection, tables: List[str], integer_keys: bool) -> Dict[str, int]:
+    """Copy the attached database src into main, returning the rows copied per table."""
+    offsets = {}
+    if integer_keys:
+        for table in INTEGER_KEY_TABLES:
+            key = _primary_key(conn, table)
+            offsets[table] = conn.execute(f'SELECT COALESCE(MAX("{key}"), 0) FROM main."{table}"').fetchone()[0]
+
+    rows = {}
+    for table in tables:
+        if table in DIMENSIONS:
+            key, natural = DIMENSIONS[table]
+            before = conn.total_changes
+            conn.execute(f'INSERT OR IGNORE INTO main."{table}" ("{natural}") '
+                         f'SELECT "{natural}" FROM src."{table}" ORDER BY "{key}"')
+            rows[table] = conn.total_changes - before
+            conn.execute(f'DROP TABLE IF EXISTS temp."map_{table}"')
+            conn.execute(f'CREATE TEMP TABLE "map_{table}" (old INTEGER PRIMARY KEY, new INTEGER)')
+            conn.execute(f'INSERT INTO temp."map_{table}" SELECT s."{key}", m."{key}" '
+                         f'FROM src."{table}" s JOIN main."{table}" m ON m."{natural}" = s."{natural}"')
+            continue
+        expressions = _column_expressions(conn, table, offsets)
+        columns = ", ".join(f'"{column}"' for column in expressions)
+        before = conn.total_changes
+        conn.execute(f'INSERT INTO main."{table}" ({columns}) SELECT {", ".join(expressions.values())} FROM src."{table}" t')
+        rows[table] = conn.total_changes - before
+    return rows
+
+
+def merge_databases(paths: List[str], output_path: str, workers: int = None,
+                    encryption_key: str = None) -> Dict[str, Any]:
+    """
+    Merge refined databases into a new database at output_path.
+
+    Inputs are decrypted (.pgp) and digested in parallel, then copied one
+    after another with ATTACH and INSERT ... SELECT per table. Integer keys
+    are renumbered after the keys of the inputs merged before them, and
+    dimension keys of the normalized layout are remapped through their
+    natural values; UUID and binary keys are kept as they are. An input
+    identical to one already merged, or whose submission is already in the
+    merged database, is skipped. Indexes are created once all rows are in.
+
+    Returns:
+        Report of the merged, skipped and failed inputs and the rows per table
+    """
+    databases = discover_databases(paths)
+    if not databases:
+        raise FileNotFoundError(f"No refined databases found in {', '.join(paths)}")
+    workers = min(workers or settings.BATCH_WORKERS or os.cpu_count() or 1, len(databases))
+    encryption_key = encryption_key or settings.REFINEMENT_ENCRYPTION_KEY
+    if os.path.exists(output_path):
+        os.remove(output_path)
+        logging.info(f"Deleted existing database at {output_path}")
+
+    started = time.perf_counter()
+    report: Dict[str, Any] = {"merged": [], "skipped": [], "failed": [], "rows": {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(prepare_input, index, path, tmp_dir, encryption_key)
+                       for index, path in enumerate(databases)]
+            inputs = []
+            for path, future in zip(databases, futures):
+                try:
+                    inputs.append(future.result())
+                except Exception as e:
+                    logging.error(f"Could not read {path}: {e}")
+                    report["failed"].append({"path": path, "error": f"{type(e).__name__}: {e}"})
+        logging.info(f"Prepared {len(inputs)} databases with {workers} workers in {time.perf_counter() - started:.2f}s")
+
+        conn = sqlite3.connect(output_path, isolation_level=None)
+        # The merged database is rebuilt from scratch if the process dies
+        conn.execute("PRAGMA journal_mode = MEMORY")
+        conn.execute("PRAGMA synchronous = OFF")
+        indexes: List[str] = []
+        schema: Optional[Dict[str, str]] = None
+        digests = set()
+        try:
+            for merge_input in inputs:
+                if merge_input.digest in digests:
+                    report["skipped"].append({"path": merge_input.path, "reason": "duplicate database"})
+                    continue
+                conn.execute("ATTACH DATABASE ? AS src", (merge_input.db_path,))
+                try:
+                    tables = _tables(conn, "src")
+                    if schema is None:
+                        # Tables of the first input, indexes only once the rows are in
+                        schema = tables
+                        for sql in tables.values():
+                            conn.execute(sql)
+                        indexes = [sql for (sql,) in conn.execute(
+                            "SELECT sql FROM src.sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+                        )]
+                    elif tables != schema:
+                        raise ValueError("schema differs from the first database (another KEY_MODE, layout or version?)")
+
+                    integer_keys = conn.execute("SELECT typeof(SubmissionID) FROM src.submissions").fetchone() == ("integer",)
+                    # Integer keys restart at 1 in every database, other keys identify the submission
+                    if not integer_keys and conn.execute("SELECT 1 FROM main.submissions WHERE SubmissionID IN "
+                                                         "(SELECT SubmissionID FROM src.submissions) LIMIT 1").fetchone():
+                        report["skipped"].append({"path": merge_input.path, "reason": "submission already merged"})
+                        continue
+
+                    conn.execute("BEGIN")
+                    try:
+                        rows = _merge_one(conn, list(tables), integer_keys)
+                        conn.execute("COMMIT")
+                    except Exception:
+                        conn.execute("ROLLBACK")
+                        raise
+                    for table, count in rows.items():
+                        report["rows"][table] = report["rows"].get(table, 0) + count
+                    report["merged"].append(merge_input.path)
+                    digests.add(merge_input.digest)
+                except Exception as e:
+                    logging.error(f"Could not merge {merge_input.path}: {e}")
+                    report["failed"].append({"path": merge_input.path, "error": f"{type(e).__name__}: {e}"})
+                finally:
+                    conn.execute("DETACH DATABASE src")
+
+            start = time.perf_counter()
+            for sql in indexes:
+                conn.execute(sql)
+            report["index_seconds"] = round(time.perf_counter() - start, 3)
+        finally:
+            conn.close()
+
+    if settings.FINALIZE_DATABASE:
+        engine = create_engine(f'sqlite:///{output_path}')
+        report["finalize"] = finalize_database(engine, settings.FINALIZE_PAGE_SIZE, settings.FINALIZE_AUTO_VACUUM)
+        engine.dispose()
+    report["db_bytes"] = os.path.getsize(output_path)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    logging.info(f"Merged {len(report['merged'])} of {len(databases)} databases into {output_path} "
+                 f"({report['db_bytes']} bytes) in {report['seconds']}s")
+    return report
+
+
+# Run with: python -m refiner.merge merged.libsql db.libsql [db.libsql.pgp | directory ...]
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    print(json.dumps(merge_databases(sys.argv[2:], sys.argv[1]), indent=2))
@@ -1,8 +1,22 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 
 from refiner.models.offchain_schema import OffChainSchema
 
+class ShardManifest(BaseModel):
+    index: int
+    refinement_url: str
+    cid: str
+    chat_ids: List[str]
+    first_message_date: Optional[int] = None  # Unix epoch seconds
+    last_message_date: Optional[int] = None  # Unix epoch seconds
+    message_count: int
+    finalize: Optional[Dict[str, Any]] = None  # Report of finalize_database for the shard
+
 class Output(BaseModel):
     refinement_url: Optional[str] = None
-    schema: Optional[OffChainSchema] = None
\ No newline at end of file
+    schema: Optional[OffChainSchema] = None
+    compression: Optional[str] = None  # Codec applied before encryption, if not left to the PGP layer
+    shards: Optional[List[ShardManifest]] = None
+    diagnostics: Optional[Dict[str, Any]] = None
+    finalize: Optional[Dict[str, Any]] = None  # Report of finalize_database, combined across shards
\ No newline at end of file
@@ -1,29 +1,48 @@
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Float, ForeignKey, DateTime, Boolean, Text, LargeBinary
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, DateTime, Boolean, Text, LargeBinary, PrimaryKeyConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from refiner.config import settings
+
 # Base model for SQLAlchemy
 Base = declarative_base()
 
+# Column type for timestamps: ISO strings by default, integer epoch seconds in "epoch" mode
+Timestamp = Integer if settings.TIMESTAMP_STORAGE == "epoch" else DateTime
+
+# Column type for primary and foreign keys, see settings.KEY_MODE
+if settings.KEY_MODE == "integer":
+    Key = Integer  # INTEGER PRIMARY KEY columns alias the SQLite rowid
+elif settings.KEY_MODE == "binary":
+    Key = LargeBinary(16)
+else:
+    Key = String
+
+CLUSTERED_MESSAGES = settings.KEY_MODE == "binary"
+
+# In the normalized layout messages reference senders, content types and placeholder
+# contents by integer key instead of repeating the strings on every row
+NORMALIZED_MESSAGES = settings.MESSAGE_LAYOUT == "normalized"
+
 # Define database models - the schema is generated using these
 class Users(Base):
     __tablename__ = 'users'
     
-    UserID = Column(String, primary_key=True)
+    UserID = Column(Key, primary_key=True)
     Source = Column(String, nullable=False)  # Telegram/WhatsApp
     SourceUserId = Column(String, nullable=False)
     Status = Column(String, nullable=False, default="active")  # active/deleted
-    DateTimeCreated = Column(DateTime, nullable=False)
+    DateTimeCreated = Column(Timestamp, nullable=False)
     
     submissions = relationship("Submissions", back_populates="user", cascade="all, delete-orphan")
 
 class Submissions(Base):
     __tablename__ = 'submissions'
     
-    SubmissionID = Column(String, primary_key=True)
-    UserID = Column(String, ForeignKey('users.UserID'), nullable=False)
-    SubmissionDate = Column(DateTime, nullable=False)
+    SubmissionID = Column(Key, primary_key=True)
+    UserID = Column(Key, ForeignKey('users.UserID'), nullable=False)
+    SubmissionDate = Column(Timestamp, nullable=False)
     SubmissionReference = Column(String, nullable=False)  # FileID
     
     user = relationship("Users", back_populates="submissions")
@@ -32,11 +51,11 @@ class Submissions(Base):
 class SubmissionChats(Base):
     __tablename__ = 'submission_chats'
     
-    SubmissionChatID = Column(String, primary_key=True)
-    SubmissionID = Column(String, ForeignKey('submissions.SubmissionID'), nullable=False)
+    SubmissionChatID = Column(Key, primary_key=True)
+    SubmissionID = Column(Key, ForeignKey('submissions.SubmissionID'), nullable=False)
     SourceChatID = Column(String, nullable=False)
-    FirstMessageDate = Column(DateTime, nullable=False)
-    LastMessageDate = Column(DateTime, nullable=False)
+    FirstMessageDate = Column(Timestamp, nullable=False)
+    LastMessageDate = Column(Timestamp, nullable=False)
     ParticipantCount = Column(Integer, nullable=True)
     MessageCount = Column(Integer, nullable=False, default=0)
     
@@ -45,14 +64,127 @@ class SubmissionChats(Base):
 
 class ChatMessages(Base):
     __tablename__ = 'chat_messages'
+    # In binary key mode messages are stored WITHOUT ROWID, clustered by chat and date
+    __table_args__ = (
+        PrimaryKeyConstraint('SubmissionChatID', 'MessageDate', 'MessageID'),
+        {'sqlite_with_rowid': False},
+    ) if CLUSTERED_MESSAGES else ()
     
-    MessageID = Column(String, primary_key=True)
-    SubmissionChatID = Column(String, ForeignKey('submission_chats.SubmissionChatID'), nullable=False)
+    MessageID = Column(Key, primary_key=not CLUSTERED_MESSAGES, unique=CLUSTERED_MESSAGES)
+    SubmissionChatID = Column(Key, ForeignKey('submission_chats.SubmissionChatID'), nullable=False)
     SourceMessageID = Column(String, nullable=False)
-    SenderID = Column(String, nullable=False)  # AuthorId
-    MessageDate = Column(DateTime, nullable=False)
-    ContentType = Column(String, nullable=False)  # text/image/video/audio
+    if NORMALIZED_MESSAGES:
+        SenderKey = Column(Integer, ForeignKey('senders.SenderKey'), nullable=False)
+    else:
+        SenderID = Column(String, nullable=False)  # AuthorId
+    MessageDate = Column(Timestamp, nullable=False)
+    if NORMALIZED_MESSAGES:
+        ContentTypeKey = Column(Integer, ForeignKey('content_types.ContentTypeKey'), nullable=False)
+        # Set instead of Content when the content is generated from the message type
+        PlaceholderKey = Column(Integer, ForeignKey('content_placeholders.PlaceholderKey'), nullable=True)
+    else:
+        ContentType = Column(String, nullable=False)  # text/image/video/audio
     Content = Column(Text, nullable=True)  # text content
     ContentData = Column(LargeBinary, nullable=True)  # media data
     
     chat = relationship("SubmissionChats", back_populates="messages")
+
+
+# Dimension tables of the normalized message layout, filled while transforming
+class Senders(Base):
+    __tablename__ = 'senders'
+    __table_args__ = {'info': {'feature': 'dimensions'}}
+
+    SenderKey = Column(Integer, primary_key=True)
+    SenderID = Column(String, nullable=False, unique=True)  # masked like ChatMessages.SenderID
+
+class ContentTypes(Base):
+    __tablename__ = 'content_types'
+    __table_args__ = {'info': {'feature': 'dimensions'}}
+
+    ContentTypeKey = Column(Integer, primary_key=True)
+    ContentType = Column(String, nullable=False, unique=True)
+
+class ContentPlaceholders(Base):
+    __tablename__ = 'content_placeholders'
+    __table_args__ = {'info': {'feature': 'dimensions'}}
+
+    PlaceholderKey = Column(Integer, primary_key=True)
+    Content = Column(Text, nullable=False, unique=True)  # e.g. "Service message: MessageActionChatAddUser"
+
+
+# Edge tables linking messages to the message they reply to or were forwarded from,
+# written when BUILD_MESSAGE_EDGES is enabled. Source IDs are always kept; the refined
+# key of the target is filled in after loading when the target is part of the submission
+class MessageReplies(Base):
+    __tablename__ = 'message_replies'
+    __table_args__ = (
+        Index('ix_message_replies_target', 'ReplyToMessageID'),
+        {'info': {'feature': 'edges'}},
+    )
+
+    MessageID = Column(Key, ForeignKey('chat_messages.MessageID'), primary_key=True)
+    SubmissionChatID = Column(Key, ForeignKey('submission_chats.SubmissionChatID'), nullable=False)
+    ReplyToSourceChatID = Column(String, nullable=False)
+    ReplyToSourceMessageID = Column(String, nullable=False)
+    ReplyToMessageID = Column(Key, ForeignKey('chat_messages.MessageID'), nullable=True)
+
+class MessageForwards(Base):
+    __tablename__ = 'message_forwards'
+    __table_args__ = (
+        Index('ix_message_forwards_target', 'OriginMessageID'),
+        Index('ix_message_forwards_origin', 'OriginSourceChatID', 'OriginSourceMessageID'),
+        {'info': {'feature': 'edges'}},
+    )
+
+    MessageID = Column(Key, ForeignKey('chat_messages.MessageID'), primary_key=True)
+    SubmissionChatID = Column(Key, ForeignKey('submission_chats.SubmissionChatID'), nullable=False)
+    OriginType = Column(String, nullable=False)  # user/chat/channel/hidden_user
+    OriginSenderID = Column(String, nullable=True)  # masked like ChatMessages.SenderID
+    OriginSourceChatID = Column(String, nullable=True)
+    OriginSourceMessageID = Column(String, nullable=True)
+    OriginDate = Column(Timestamp, nullable=True)
+    OriginMessageID = Column(Key, ForeignKey('chat_messages.MessageID'), nullable=True)
+
+# Aggregate tables, precomputed from chat_messages when BUILD_AGGREGATES is enabled
+class ChatDailyMessageCounts(Base):
+    __tablename__ = 'chat_daily_message_counts'
+    __table_args__ = {'info': {'feature': 'aggregates'}}
+
+    SubmissionChatID = Column(Key, ForeignKey('submission_chats.SubmissionChatID'), primary_key=True)
+    Day = Column(String, primary_key=True)  # YYYY-MM-DD
+    MessageCount = Column(Integer, nullable=False)
+
+class SenderMessageCounts(Base):
+    __tablename__ = 'sender_message_counts'
+    __table_args__ = {'info': {'feature': 'aggregates'}}
+
+    SubmissionChatID = Column(Key, ForeignKey('submission_chats.SubmissionChatID'), primary_key=True)
+    if NORMALIZED_MESSAGES:
+        SenderKey = Column(Integer, ForeignKey('senders.SenderKey'), primary_key=True)
+    else:
+        SenderID = Column(String, primary_key=True)
+    MessageCount = Column(Integer, nullable=False)
+    FirstMessageDate = Column(Timestamp, nullable=False)
+    LastMessageDate = Column(Timestamp, nullable=False)
+
+class ChatContentTypeCounts(Base):
+    __tablename__ = 'chat_content_type_counts'
+    __table_args__ = {'info': {'feature': 'aggregates'}}
+
+    SubmissionChatID = Column(Key, ForeignKey('submission_chats.SubmissionChatID'), primary_key=True)
+    if NORMALIZED_MESSAGES:
+        ContentTypeKey = Column(Integer, ForeignKey('content_types.ContentTypeKey'), primary_key=True)
+    else:
+        ContentType = Column(String, primary_key=True)
+    MessageCount = Column(Integer, nullable=False)
+
+
+def enabled_tables():
+    """Tables of the refined database, without those of optional features that are turned off."""
+    features = {
+        'aggregates': settings.BUILD_AGGREGATES,
+        'edges': settings.BUILD_MESSAGE_EDGES,
+        'dimensions': NORMALIZED_MESSAGES,
+    }
+    return [table for table in Base.metadata.sorted_tables if features.get(table.info.get('feature'), True)]
@@ -1,5 +1,5 @@
 from typing import Optional, List, Dict, Any, Union
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError, field_validator
 
 
 class Profile(BaseModel):
@@ -236,6 +236,34 @@ class MessageContent(BaseModel):
     has_spoiler: Optional[bool] = None
     is_secret: Optional[bool] = None
 
+class ReplyTo(BaseModel):
+    """Model for the message a message replies to"""
+    type: str = Field(..., alias="@type")
+    chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+
+class ForwardOrigin(BaseModel):
+    """Model for the original sender of a forwarded message"""
+    type: str = Field(..., alias="@type")
+    sender_user_id: Optional[int] = None
+    sender_chat_id: Optional[int] = None
+    sender_name: Optional[str] = None
+    chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+
+class ForwardSource(BaseModel):
+    """Model for the chat a message was last forwarded from"""
+    type: str = Field(..., alias="@type")
+    chat_id: Optional[int] = None
+    message_id: Optional[int] = None
+
+class WebappForwardInfo(BaseModel):
+    """Model for forward information"""
+    type: str = Field(..., alias="@type")
+    origin: ForwardOrigin
+    date: Optional[int] = None
+    source: Optional[ForwardSource] = None
+
 class InteractionInfo(BaseModel):
     """Model for message interaction information"""
     type: str = Field(..., alias="@type")
@@ -259,8 +287,19 @@ class WebappMessageData(BaseModel):
     is_topic_message: Optional[bool] = None
     contains_unread_mention: Optional[bool] = None
     interaction_info: Optional[InteractionInfo] = None
+    reply_to: Optional[ReplyTo] = None
+    forward_info: Optional[WebappForwardInfo] = None
     content: MessageContent
 
+    @field_validator('reply_to', 'forward_info', mode='wrap')
+    @classmethod
+    def drop_malformed_edge(cls, value: Any, handler) -> Any:
+        """A malformed reply or forward block drops the edge, not the message."""
+        try:
+            return handler(value)
+        except ValidationError:
+            return None
+
 class WebappChatData(BaseModel):
     """Model for chat data"""
     chat_id: int
@@ -1,73 +1,323 @@
+import hashlib
 import json
 import logging
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Type, Union
 
 from refiner.models.offchain_schema import OffChainSchema
-from refiner.models.output import Output
+from refiner.models.output import Output, ShardManifest
+from refiner.transformer.base_transformer import DataTransformer
+from refiner.transformer.filters import MessageFilter
+from refiner.transformer.finalize import combine_reports
 from refiner.transformer.miner_transformer import MinerTransformer
 from refiner.transformer.webapp_transformer import WebappTransformer
 from refiner.config import settings
+from refiner.utils.cache import ResultCache, fingerprint
+from refiner.utils.checkpoint import Checkpoint
+from refiner.utils.diagnostics import Diagnostics
 from refiner.utils.encrypt import encrypt_file
 from refiner.utils.ipfs import upload_file_to_ipfs, upload_json_to_ipfs
+from refiner.utils.keys import KeyGenerator
+from refiner.utils.ndjson import LineDelimitedSubmission, is_line_delimited, open_submission
+from refiner.utils.parts import SubmissionParts, assemble_parts, part_key, read_header
+from refiner.utils.shard import settle_chat_statistics, split_submission, written_coverage
+
+
+# Settings that do not change the refined data, excluded from cache keys
+UNCACHED_SETTINGS = {
+    'INPUT_DIR', 'OUTPUT_DIR', 'REFINEMENT_ENCRYPTION_KEY', 'PINATA_API_JWT',
+    'CACHE_DIR', 'CACHE_MAX_BYTES', 'CACHE_MAX_AGE_SECONDS', 'ENCRYPTION_BACKEND',
+    'CHECKPOINT', 'CHECKPOINT_MESSAGES', 'NDJSON_WORKERS', 'NDJSON_CHUNK_BYTES',
+    'PROFILE', 'PROFILE_INTERVAL_MS',
+}
+
+# Shard databases and the files derived from them (.pgp, .checkpoint)
+SHARD_FILE_PATTERN = re.compile(r'^db-(\d+)\.libsql')
+
+# Transformers by the source field of the input data
+TRANSFORMERS = {
+    'telegram': WebappTransformer,
+    'telegramMiner': MinerTransformer,
+}
+
+
+def select_transformer(source: Optional[str], input_filename: str = "input") -> Type[DataTransformer]:
+    """Determine which transformer to use based on the source field of the input data."""
+    if source is not None:
+        if source in TRANSFORMERS:
+            transformer_cls = TRANSFORMERS[source]
+            logging.info(f"Using {transformer_cls.__name__} for {input_filename}")
+            return transformer_cls
+        logging.warning(f"Unknown source '{source}' in {input_filename}, defaulting to MinerTransformer")
+        return MinerTransformer
+    logging.warning(f"No source field found in {input_filename}, defaulting to MinerTransformer")
+    return MinerTransformer
+
+
+class InputPart(NamedTuple):
+    """An input file, one part of a submission."""
+    filename: str
+    path: str
+    line_delimited: bool
+    header: Dict[str, Any]  # Submission fields, see read_header
+    document: Optional[Dict[str, Any]] = None  # The fileDto, if read_header had to parse it whole
+
+
+def create_transformer(input_data: Union[dict, LineDelimitedSubmission, SubmissionParts], db_path: str,
+                       input_filename: str = "input", checkpoint: Optional[Checkpoint] = None,
+                       keys: Optional[KeyGenerator] = None) -> DataTransformer:
+    """
+    Create the transformer for the input data, a fileDto, an NDJSON submission
+    or the parts of a submission. The shards of a submission share keys.
+    """
+    if isinstance(input_data, (LineDelimitedSubmission, SubmissionParts)):
+        input_data = input_data.header
+    return select_transformer(input_data.get('source'), input_filename)(db_path, checkpoint, keys)
+
+
+def build_schema(transformer: DataTransformer) -> OffChainSchema:
+    """The off-chain schema describing the database built by transformer."""
+    return OffChainSchema(
+        name=settings.SCHEMA_NAME,
+        version=settings.SCHEMA_VERSION,
+        description=settings.SCHEMA_DESCRIPTION,
+        dialect=settings.SCHEMA_DIALECT,
+        schema=transformer.get_schema()
+    )
+
+
+def input_submissions(input_dir: str) -> List[List[InputPart]]:
+    """
+    Input files of input_dir grouped into submissions. Files with the same
+    source, user and submission_token are parts of one submission, in filename order.
+    """
+    submissions = {}
+    for input_filename in sorted(os.listdir(input_dir)):
+        input_file = os.path.join(input_dir, input_filename)
+        line_delimited = is_line_delimited(input_file)
+        if not line_delimited and os.path.splitext(input_file)[1].lower() != '.json':
+            continue
+        header, document = read_header(input_file)
+        submissions.setdefault(part_key(header), []).append(
+            InputPart(input_filename, input_file, line_delimited, header, document))
+    return list(submissions.values())
+
 
 class Refiner:
-    def __init__(self):
-        self.db_path = os.path.join(settings.OUTPUT_DIR, 'db.libsql')
+    def __init__(self, input_dir: str = None, output_dir: str = None):
+        self.input_dir = input_dir or settings.INPUT_DIR
+        self.output_dir = output_dir or settings.OUTPUT_DIR
+        self.db_path = os.path.join(self.output_dir, 'db.libsql')
+        self.cache = None
+        if settings.CACHE_DIR:
+            self.cache = ResultCache(settings.CACHE_DIR, settings.CACHE_MAX_BYTES, settings.CACHE_MAX_AGE_SECONDS)
 
     def transform(self) -> Output:
         """Transform all input files into the database."""
         logging.info("Starting data transformation")
         output = Output()
 
-        # Iterate through files and transform data
-        for input_filename in os.listdir(settings.INPUT_DIR):
-            input_file = os.path.join(settings.INPUT_DIR, input_filename)
-            if os.path.splitext(input_file)[1].lower() == '.json':
-                with open(input_file, 'r') as f:
-                    input_data = json.load(f)
-                    
-                    # Determine which transformer to use based on source field
-                    transformer = None
-                    if 'source' in input_data:
-                        if input_data['source'] == 'telegram':
-                            logging.info(f"Using WebappTransformer for {input_filename}")
-                            transformer = WebappTransformer(self.db_path)
-                        elif input_data['source'] == 'telegramMiner':
-                            logging.info(f"Using MinerTransformer for {input_filename}")
-                            transformer = MinerTransformer(self.db_path)
-                        else:
-                            logging.warning(f"Unknown source '{input_data['source']}' in {input_filename}, defaulting to MinerTransformer")
-                            transformer = MinerTransformer(self.db_path)
-                    else:
-                        logging.warning(f"No source field found in {input_filename}, defaulting to MinerTransformer")
-                        transformer = MinerTransformer(self.db_path)
-                    
-                    # Process the data
-                    transformer.process(input_data)
-                    logging.info(f"Transformed {input_filename}")
-                    
-                    # Create a schema based on the SQLAlchemy schema
-                    schema = OffChainSchema(
-                        name=settings.SCHEMA_NAME,
-                        version=settings.SCHEMA_VERSION,
-                        description=settings.SCHEMA_DESCRIPTION,
-                        dialect=settings.SCHEMA_DIALECT,
-                        schema=transformer.get_schema()
-                    )
-                    output.schema = schema
-                        
-                    # Upload the schema to IPFS
-                    schema_file = os.path.join(settings.OUTPUT_DIR, 'schema.json')
-                    with open(schema_file, 'w') as f:
-                        json.dump(schema.model_dump(), f, indent=4)
-                        schema_ipfs_hash = upload_json_to_ipfs(schema.model_dump())
-                        logging.info(f"Schema uploaded to IPFS with hash: {schema_ipfs_hash}")
-                    
-                    # Encrypt and upload the database to IPFS
-                    encrypted_path = encrypt_file(settings.REFINEMENT_ENCRYPTION_KEY, self.db_path)
-                    ipfs_hash = upload_file_to_ipfs(encrypted_path)
-                    output.refinement_url = f"{settings.IPFS_GATEWAY_URL}/{ipfs_hash}"
+        # Iterate through submissions and transform data
+        for parts in input_submissions(self.input_dir):
+            input_filename = ", ".join(part.filename for part in parts)
+            line_delimited = parts[0].line_delimited
+            # NDJSON submissions are streamed rather than read into memory
+            raw = None
+            if len(parts) == 1 and not line_delimited and parts[0].document is None:
+                with open(parts[0].path, 'rb') as f:
+                    raw = f.read()
+
+            cache_key = None
+            if self.cache or settings.CHECKPOINT:
+                if raw is not None:
+                    digest = hashlib.sha256(raw).hexdigest()
+                else:
+                    digests = []
+                    for part in parts:
+                        with open(part.path, 'rb') as f:
+                            digests.append(hashlib.file_digest(f, 'sha256').hexdigest())
+                    digest = digests[0] if len(digests) == 1 else hashlib.sha256(" ".join(digests).encode()).hexdigest()
+                cache_key = self._cache_key(digest, parts[0].header.get('source'))
+            if self.cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logging.info(f"Using cached refinement for {input_filename}")
+                    output = Output.model_validate(cached)
+                    self._write_schema(output.schema)
                     continue
 
+            if len(parts) > 1:
+                self._refine_parts(parts, input_filename, output, cache_key)
+            elif line_delimited:
+                if settings.SHARD_BY != "none":
+                    logging.warning(f"SHARD_BY does not apply to NDJSON submissions, refining {input_filename} into one database")
+                self._refine(open_submission(parts[0].path), input_filename, output, cache_key)
+            else:
+                input_data = parts[0].document if raw is None else json.loads(raw)
+                if settings.SHARD_BY != "none":
+                    self._refine_shards(input_data, input_filename, output, cache_key)
+                else:
+                    self._refine(input_data, input_filename, output, cache_key)
+
+            if self.cache:
+                self.cache.put(cache_key, output.model_dump())
+
         logging.info("Data transformation completed successfully")
-        return output
\ No newline at end of file
+        return output
+
+    def _refine_parts(self, parts: List[InputPart], input_filename: str, output: Output, input_key: str = None) -> None:
+        """
+        Refine the parts of a submission into one database. Parts are loaded
+        one at a time, except to be sharded, which needs the assembled submission.
+        """
+        logging.info(f"Assembling {len(parts)} parts of one submission: {input_filename}")
+        if settings.SHARD_BY != "none":
+            if not any(part.line_delimited for part in parts):
+                self._refine_shards(assemble_parts(map(self._load_part, parts)), input_filename, output, input_key)
+                return
+            logging.warning(f"SHARD_BY does not apply to NDJSON submissions, refining {input_filename} into one database")
+        if settings.CHECKPOINT:
+            logging.warning(f"CHECKPOINT does not apply to multi-part submissions, refining {input_filename} from scratch")
+        self._refine(SubmissionParts(parts[0].header, map(self._load_part, parts)), input_filename, output)
+
+    def _load_part(self, part: InputPart) -> Union[dict, LineDelimitedSubmission]:
+        if part.line_delimited:
+            return open_submission(part.path)
+        if part.document is not None:
+            return part.document
+        with open(part.path, 'rb') as f:
+            return json.load(f)
+
+    def _checkpoint(self, db_path: str, input_key: Optional[str]) -> Optional[Checkpoint]:
+        """Checkpoint of the database refined from the input with the given key, if checkpointing."""
+        return Checkpoint(db_path, input_key) if settings.CHECKPOINT and input_key is not None else None
+
+    def _refine(self, input_data: Union[dict, LineDelimitedSubmission, SubmissionParts], input_filename: str, output: Output,
+                input_key: str = None) -> None:
+        """Refine one submission into a single database."""
+        checkpoint = self._checkpoint(self.db_path, input_key)
+        transformer = create_transformer(input_data, self.db_path, input_filename, checkpoint)
+
+        # Process the data
+        transformer.process(input_data)
+        logging.info(f"Transformed {input_filename}")
+        output.diagnostics = transformer.diagnostics.summary()
+        output.finalize = transformer.finalize_report
+
+        output.schema = self._publish_schema(transformer)
+
+        # Encrypt and upload the database to IPFS
+        ipfs_hash = self._encrypt_and_upload(self.db_path)
+        output.refinement_url = f"{settings.IPFS_GATEWAY_URL}/{ipfs_hash}"
+        if settings.REFINEMENT_COMPRESSION != "pgp":
+            output.compression = settings.REFINEMENT_COMPRESSION
+        if checkpoint:
+            checkpoint.clear()
+
+    def _refine_shards(self, input_data: dict, input_filename: str, output: Output, input_key: str = None) -> None:
+        """
+        Refine one submission into several databases with the same schema,
+        then encrypt and upload them in parallel.
+        """
+        diagnostics = Diagnostics()
+        # Filter before splitting, so shard manifests only cover the messages kept
+        transformer_cls = TRANSFORMERS.get(input_data.get('source'), MinerTransformer)
+        message_filter = MessageFilter.from_settings(transformer_cls.mapping)
+        input_data = message_filter.cap_submission(message_filter.apply(input_data, diagnostics), diagnostics)
+        shards = split_submission(input_data, settings.SHARD_BY, settings.SHARD_MAX_MESSAGES)
+        logging.info(f"Splitting {input_filename} into {len(shards)} shards by {settings.SHARD_BY}")
+        self._remove_stale_shards(len(shards))
+
+        db_paths = []
+        checkpoints = []
+        transformers = []
+        # The user, submission and chats have the same keys in every shard
+        keys = KeyGenerator()
+        for index, shard in enumerate(shards):
+            db_path = os.path.join(self.output_dir, f'db-{index:04d}.libsql')
+            checkpoint = self._checkpoint(db_path, f"{input_key}/{index}")
+            transformer = create_transformer(shard.data, db_path, f"{input_filename} (shard {index})", checkpoint, keys)
+            transformer.process(shard.data)
+            diagnostics.merge(transformer.diagnostics)
+            db_paths.append(db_path)
+            checkpoints.append(checkpoint)
+            transformers.append(transformer)
+        settle_chat_statistics(transformer.engine for transformer in transformers)
+        # Coverage of the rows written, after deduplication, rather than of the split input
+        for index, transformer in enumerate(transformers):
+            shards[index] = shards[index]._replace(**written_coverage(transformer.engine))
+        logging.info(f"Transformed {input_filename}")
+        output.diagnostics = diagnostics.summary()
+        output.finalize = combine_reports(transformer.finalize_report for transformer in transformers)
+
+        output.schema = self._publish_schema(transformer)
+
+        with ThreadPoolExecutor(max_workers=settings.SHARD_WORKERS) as executor:
+            ipfs_hashes = list(executor.map(self._encrypt_and_upload, db_paths))
+
+        output.shards = [
+            ShardManifest(
+                index=index,
+                refinement_url=f"{settings.IPFS_GATEWAY_URL}/{ipfs_hash}",
+                cid=ipfs_hash,
+                chat_ids=shard.chat_ids,
+                first_message_date=shard.first_message_date,
+                last_message_date=shard.last_message_date,
+                message_count=shard.message_count,
+                finalize=transformer.finalize_report
+            )
+            for index, (shard, ipfs_hash, transformer) in enumerate(zip(shards, ipfs_hashes, transformers))
+        ]
+        # Consumers that do not read the manifest get the first shard
+        output.refinement_url = output.shards[0].refinement_url
+        if settings.REFINEMENT_COMPRESSION != "pgp":
+            output.compression = settings.REFINEMENT_COMPRESSION
+        for checkpoint in checkpoints:
+            if checkpoint:
+                checkpoint.clear()
+
+    def _remove_stale_shards(self, count: int) -> None:
+        """Delete the shard files of an earlier run beyond the first count shards, which are rewritten."""
+        for filename in os.listdir(self.output_dir):
+            match = SHARD_FILE_PATTERN.match(filename)
+            if match and int(match.group(1)) >= count:
+                os.remove(os.path.join(self.output_dir, filename))
+                logging.info(f"Deleted stale shard file {filename}")
+
+    def _publish_schema(self, transformer: DataTransformer) -> OffChainSchema:
+        """Create a schema based on the SQLAlchemy schema, save it and upload it to IPFS."""
+        schema = build_schema(transformer)
+
+        # Upload the schema to IPFS
+        self._write_schema(schema)
+        schema_ipfs_hash = upload_json_to_ipfs(schema.model_dump())
+        logging.info(f"Schema uploaded to IPFS with hash: {schema_ipfs_hash}")
+
+        return schema
+
+    def _write_schema(self, schema: OffChainSchema) -> None:
+        schema_file = os.path.join(self.output_dir, 'schema.json')
+        with open(schema_file, 'w') as f:
+            json.dump(schema.model_dump(), f, indent=4)
+
+    def _cache_key(self, digest: str, source: Optional[str]) -> str:
+        """
+        Cache key of an input file: digest of its bytes, the schema and transformer
+        versions, a fingerprint of the encryption key and the settings that shape the output.
+        """
+        transformer_cls = TRANSFORMERS.get(source, MinerTransformer)
+        output_settings = settings.model_dump(exclude=UNCACHED_SETTINGS)
+        return ResultCache.make_key(
+            digest,
+            settings.SCHEMA_VERSION,
+            f"{transformer_cls.__name__}/{transformer_cls.version}",
+            fingerprint(settings.REFINEMENT_ENCRYPTION_KEY),
+            json.dumps(output_settings, sort_keys=True, default=str),
+        )
+
+    def _encrypt_and_upload(self, db_path: str) -> str:
+        """Encrypt a database and upload it to IPFS, returning its hash."""
+        encrypted_path = encrypt_file(settings.REFINEMENT_ENCRYPTION_KEY, db_path)
+        return upload_file_to_ipfs(encrypted_path)
@@ -0,0 +1,55 @@
+import logging
+import time
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.engine import Engine
+
+from refiner.models.refined import (
+    ChatMessages, ChatDailyMessageCounts, SenderMessageCounts, ChatContentTypeCounts, NORMALIZED_MESSAGES
+)
+from refiner.utils.date import EPOCH_TIMESTAMPS
+
+# Sender and content type columns of chat_messages and the aggregates, see settings.MESSAGE_LAYOUT
+SENDER_COLUMN = 'SenderKey' if NORMALIZED_MESSAGES else 'SenderID'
+CONTENT_TYPE_COLUMN = 'ContentTypeKey' if NORMALIZED_MESSAGES else 'ContentType'
+
+
+def _day(column):
+    """SQL expression for the YYYY-MM-DD day of a timestamp column."""
+    return func.date(column, 'unixepoch') if EPOCH_TIMESTAMPS else func.date(column)
+
+
+def build_aggregates(engine: Engine) -> None:
+    """
+    Rebuild the aggregate tables from chat_messages with set-based
+    INSERT ... SELECT ... GROUP BY statements in one transaction.
+    """
+    start = time.perf_counter()
+    day = _day(ChatMessages.MessageDate)
+    sender = getattr(ChatMessages, SENDER_COLUMN)
+    content_type = getattr(ChatMessages, CONTENT_TYPE_COLUMN)
+    statements = [
+        insert(ChatDailyMessageCounts).from_select(
+            ['SubmissionChatID', 'Day', 'MessageCount'],
+            select(ChatMessages.SubmissionChatID, day, func.count())
+            .group_by(ChatMessages.SubmissionChatID, day)
+        ),
+        insert(SenderMessageCounts).from_select(
+            ['SubmissionChatID', SENDER_COLUMN, 'MessageCount', 'FirstMessageDate', 'LastMessageDate'],
+            select(ChatMessages.SubmissionChatID, sender, func.count(),
+                   func.min(ChatMessages.MessageDate), func.max(ChatMessages.MessageDate))
+            .group_by(ChatMessages.SubmissionChatID, sender)
+        ),
+        insert(ChatContentTypeCounts).from_select(
+            ['SubmissionChatID', CONTENT_TYPE_COLUMN, 'MessageCount'],
+            select(ChatMessages.SubmissionChatID, content_type, func.count())
+            .group_by(ChatMessages.SubmissionChatID, content_type)
+        ),
+    ]
+
+    with engine.begin() as connection:
+        for model in (ChatDailyMessageCounts, SenderMessageCounts, ChatContentTypeCounts):
+            connection.execute(delete(model))
+        for statement in statements:
+            connection.execute(statement)
+    logging.info(f"Built aggregate tables in {time.perf_counter() - start:.2f}s")
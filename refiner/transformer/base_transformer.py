@@ -1,35 +1,113 @@
-from typing import Dict, Any, List
-from sqlalchemy import create_engine
+from typing import Dict, Any, List, Iterable, Iterator, NamedTuple, Optional
+from sqlalchemy import create_engine, select, text
 from sqlalchemy.orm import sessionmaker
-from refiner.models.refined import Base
-import sqlite3
+from sqlalchemy.pool import StaticPool
+from refiner.config import settings
+from refiner.models.refined import Base, Users, Submissions, SubmissionChats, ChatMessages, enabled_tables
+from refiner.transformer.aggregates import build_aggregates
+from refiner.transformer.dimensions import MessageDimensions
+from refiner.transformer.edges import resolve_message_edges
+from refiner.transformer.finalize import finalize_database
+from refiner.utils.checkpoint import Checkpoint
+from refiner.utils.dedup import MessageDeduplicator
+from refiner.utils.diagnostics import Diagnostics
+from refiner.utils.keys import KeyGenerator
 import os
 import logging
 
+# db_path of a transformer building its database in memory, see serialize
+MEMORY_DB = ":memory:"
+
+
+class Progress(NamedTuple):
+    """
+    Marker a transformer yields between models when checkpointing: the models
+    before it cover the first `chats` chats of the submission and the first
+    `messages` messages of the next chat. The database is committed there.
+    Line-delimited submissions are not split by chat: `chats` is 0 and
+    `messages` counts the message lines read.
+    """
+    chats: int
+    messages: int
+
+
 class DataTransformer:
     """
     Base class for transforming JSON data into SQLAlchemy models.
-    Users should extend this class and override the transform method
-    to customize the transformation process for their specific data.
+    Users should extend this class and override either the transform method,
+    returning all models at once, or the transform_batches method, yielding
+    bounded batches of models, to customize the transformation process for
+    their specific data.
     """
     
-    def __init__(self, db_path: str):
-        """Initialize the transformer with a database path."""
+    # Bump whenever the produced data changes, so cached results are invalidated
+    version = "0"
+    
+    def __init__(self, db_path: str, checkpoint: Optional[Checkpoint] = None, keys: Optional[KeyGenerator] = None):
+        """
+        Initialize the transformer with a database path, or MEMORY_DB to build it in memory.
+        With a checkpoint, progress is committed and recorded as the database is
+        written, and an existing database is resumed from the recorded state.
+        The shards of a submission share one KeyGenerator through keys.
+        """
         self.db_path = db_path
+        self.checkpoint = checkpoint
+        # Progress to continue from, None when starting from scratch
+        self.resume: Optional[Progress] = None
+        self.keys = keys or KeyGenerator()
+        self.deduplicator = MessageDeduplicator()
+        self.dimensions = MessageDimensions()
+        self.diagnostics = Diagnostics()
+        self.finalize_report = None
+        self._progress = None
         self._initialize_database()
     
     def _initialize_database(self) -> None:
         """
         Initialize or recreate the database and its tables.
         """
-        if os.path.exists(self.db_path):
-            os.remove(self.db_path)
-            logging.info(f"Deleted existing database at {self.db_path}")
-        
-        self.engine = create_engine(f'sqlite:///{self.db_path}')
-        Base.metadata.create_all(self.engine)
+        if self.db_path == MEMORY_DB:
+            # A single shared connection, the database lives as long as it does
+            self.engine = create_engine('sqlite://', poolclass=StaticPool,
+                                        connect_args={'check_same_thread': False})
+        elif not (self.checkpoint and os.path.exists(self.db_path) and self._resume_database()):
+            if os.path.exists(self.db_path):
+                os.remove(self.db_path)
+                logging.info(f"Deleted existing database at {self.db_path}")
+            if self.checkpoint:
+                self.checkpoint.clear()
+            self.engine = create_engine(f'sqlite:///{self.db_path}')
+        Base.metadata.create_all(self.engine, tables=enabled_tables())
         self.Session = sessionmaker(bind=self.engine)
     
+    def _resume_database(self) -> bool:
+        """Open the database of an interrupted run, if its checkpoint tells how far it got."""
+        self.engine = create_engine(f'sqlite:///{self.db_path}')
+        with self.engine.connect() as connection:
+            if self.checkpoint.complete:
+                self._resume_keys(connection)
+                logging.info(f"Database {self.db_path} already complete")
+                return True
+            progress = self.checkpoint.progress(connection.exec_driver_sql("PRAGMA user_version").scalar())
+            if progress is None:
+                self.engine.dispose()
+                return False
+            self.resume = Progress(*progress)
+            self._resume_keys(connection)
+        logging.info(f"Resuming {self.db_path} after {self.resume.chats} chats and {self.resume.messages} messages")
+        return True
+
+    def _resume_keys(self, connection) -> None:
+        """Generate keys after those of an existing database, keeping the keys of its user, submission and chats."""
+        self.keys.resume(connection, [Users, Submissions, SubmissionChats, ChatMessages])
+        for (user_id,) in connection.execute(select(Users.UserID)):
+            self.keys.adopt(Users, None, user_id)
+        for (submission_id,) in connection.execute(select(Submissions.SubmissionID)):
+            self.keys.adopt(Submissions, None, submission_id)
+        for chat_id, source_chat_id in connection.execute(
+                select(SubmissionChats.SubmissionChatID, SubmissionChats.SourceChatID)):
+            self.keys.adopt(SubmissionChats, source_chat_id, chat_id)
+    
     def transform(self, data: Dict[str, Any]) -> List[Base]:
         """
         Transform JSON data into SQLAlchemy model instances.
@@ -40,19 +118,71 @@ class DataTransformer:
         Returns:
             List of SQLAlchemy model instances to be saved to the database
         """
-        raise NotImplementedError("Subclasses must implement transform method")
+        if type(self).transform_batches is DataTransformer.transform_batches:
+            raise NotImplementedError("Subclasses must implement transform or transform_batches method")
+        return [model for batch in self.transform_batches(data) for model in batch]
     
-    def get_schema(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def transform_batches(self, data: Dict[str, Any]) -> Iterator[List[Base]]:
+        """
+        Transform JSON data into batches of SQLAlchemy model instances.
+        Each batch is written and released before the next one is requested,
+        so memory is bounded by the batch size rather than the submission size.
+        The default implementation yields the result of transform as one batch.
         
+        Args:
+            data: Dictionary containing the JSON data
+            
+        Returns:
+            Iterator over lists of SQLAlchemy model instances
+        """
+        yield self.transform(data)
+    
+    def batched(self, models: Iterable[Base], batch_size: int = None) -> Iterator[List[Base]]:
+        """
+        Group a stream of model instances into lists of at most batch_size.
+        A Progress marker ends the current batch, and process commits after it.
+        """
+        batch_size = batch_size or settings.TRANSFORM_BATCH_SIZE
+        batch = []
+        for model in models:
+            if type(model) is Progress:
+                self._progress = model
+                yield batch
+                batch = []
+                continue
+            batch.append(model)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    def unique_messages(self, chat_id: int, messages: List[Any]) -> List[Any]:
+        """Drop messages of a chat already ingested, keyed on (chat_id, message id)."""
+        unique = [msg for msg in messages if self.deduplicator.add(chat_id, msg.id)]
+        if len(unique) < len(messages):
+            self.diagnostics.record("duplicate_messages", f"chat {chat_id}", count=len(messages) - len(unique))
+        return unique
+    
+    def finish_load(self) -> None:
+        """
+        Called once all batches are committed, before edges and aggregates are
+        built, for work that needs every row of the submission to be loaded.
+        """
+    
+    def get_schema(self):
         # Get all table definitions in order
         schema = []
-        for table in cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' ORDER BY name"):
-            schema.append(table[0] + ";")
+        with self.engine.connect() as connection:
+            for table in connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"):
+                schema.append(table[0] + ";")
         
-        conn.close()
         return "\n\n".join(schema)
+    
+    def serialize(self) -> bytes:
+        """Return the database as the bytes of an SQLite file, also for in-memory databases."""
+        with self.engine.connect() as connection:
+            return connection.connection.driver_connection.serialize()
 
     def process(self, data: Dict[str, Any]) -> None:
         """
@@ -60,17 +190,44 @@ class DataTransformer:
         If the database already exists, it will be deleted and recreated.
         
         Args:
-            data: Dictionary containing the JSON data
+            data: Dictionary containing the JSON data, or the LineDelimitedSubmission
+                of an NDJSON file for transformers that read one
         """
+        if self.checkpoint and self.checkpoint.complete:
+            # Built by an earlier run that stopped before publishing it
+            self.diagnostics = Diagnostics.from_summary(self.checkpoint.diagnostics)
+            self.finalize_report = self.checkpoint.finalize_report
+            return
+        
         session = self.Session()
         try:
-            # Transform data into model instances
-            models = self.transform(data)
-            for model in models:
-                session.add(model)
+            # Transform data into model instances, writing each batch as it is produced
+            for models in self.transform_batches(data):
+                session.add_all(models)
+                session.flush()
+                session.expunge_all()
+                if self._progress is not None:
+                    # The commit number is written with the data it covers
+                    sequence = self.checkpoint.prepare(*self._progress)
+                    session.execute(text(f"PRAGMA user_version = {sequence}"))
+                    session.commit()
+                    self._progress = None
             session.commit()
+            self.finish_load()
+            self.diagnostics.log_summary()
+            if settings.BUILD_MESSAGE_EDGES:
+                resolve_message_edges(self.engine)
+            if settings.BUILD_AGGREGATES:
+                build_aggregates(self.engine)
         except Exception as e:
             session.rollback()
             raise e
         finally:
-            session.close()
\ No newline at end of file
+            session.close()
+
+        if settings.FINALIZE_DATABASE:
+            self.finalize_report = finalize_database(
+                self.engine, settings.FINALIZE_PAGE_SIZE, settings.FINALIZE_AUTO_VACUUM
+            )
+        if self.checkpoint:
+            self.checkpoint.finish(self.diagnostics.summary(), self.finalize_report)
\ No newline at end of file
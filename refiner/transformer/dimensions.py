@@ -0,0 +1,47 @@
+from typing import Any, Dict, List, Optional
+
+from refiner.models.refined import Base, Senders, ContentTypes, ContentPlaceholders
+
+# Key and value column of each dimension table
+DIMENSION_COLUMNS = {
+    Senders: ('SenderKey', 'SenderID'),
+    ContentTypes: ('ContentTypeKey', 'ContentType'),
+    ContentPlaceholders: ('PlaceholderKey', 'Content'),
+}
+
+
+class MessageDimensions:
+    """
+    Interns the sender IDs, content types and placeholder contents of the
+    normalized message layout into integer keys with in-memory dictionaries.
+    Rows for values seen for the first time collect in pending, and must be
+    written no later than the messages referencing them.
+    """
+
+    def __init__(self):
+        self._keys: Dict[type, Dict[Any, int]] = {model: {} for model in DIMENSION_COLUMNS}
+        self.pending: List[Base] = []
+
+    def key(self, model: type, value: Any) -> int:
+        """Return the key of value in the given dimension, adding a row if it is new."""
+        keys = self._keys[model]
+        key = keys.get(value)
+        if key is None:
+            key = keys[value] = len(keys) + 1
+            key_column, value_column = DIMENSION_COLUMNS[model]
+            self.pending.append(model(**{key_column: key, value_column: value}))
+        return key
+
+    def message_columns(self, sender_id: str, content_type: str, content: Optional[str],
+                        placeholder: bool) -> Dict[str, Any]:
+        """ChatMessages column values for a message's sender, content type and content."""
+        columns = {
+            'SenderKey': self.key(Senders, sender_id),
+            'ContentTypeKey': self.key(ContentTypes, content_type),
+            'PlaceholderKey': None,
+            'Content': content,
+        }
+        if placeholder and content is not None:
+            columns['PlaceholderKey'] = self.key(ContentPlaceholders, content)
+            columns['Content'] = None
+        return columns
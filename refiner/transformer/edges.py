@@ -0,0 +1,59 @@
+import logging
+import time
+
+from sqlalchemy import and_, select, update
+from sqlalchemy.engine import Engine
+
+from refiner.models.refined import ChatMessages, SubmissionChats, MessageReplies, MessageForwards
+
+# Temporary index used to look messages up by their source IDs while resolving edges
+SOURCE_INDEX = 'ix_tmp_chat_messages_source'
+
+
+def _message_key(source_chat_id, source_message_id):
+    """
+    Correlated subquery for the refined key of a message identified by source IDs.
+    The chat key is looked up on its own so that, without ANALYZE statistics, the
+    planner still searches chat_messages by both columns of SOURCE_INDEX instead
+    of scanning it for every edge.
+    """
+    chat_key = (
+        select(SubmissionChats.SubmissionChatID)
+        .where(SubmissionChats.SourceChatID == source_chat_id)
+        .limit(1)
+        .scalar_subquery()
+        .correlate_except(SubmissionChats)
+    )
+    return (
+        select(ChatMessages.MessageID)
+        .where(and_(ChatMessages.SubmissionChatID == chat_key,
+                    ChatMessages.SourceMessageID == source_message_id))
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def resolve_message_edges(engine: Engine) -> None:
+    """
+    Fill in ReplyToMessageID and OriginMessageID of the edge tables with the
+    refined keys of target messages that are part of the database, with
+    set-based UPDATE statements in one transaction. Edges to messages outside
+    the submission keep only their source IDs.
+    """
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS {SOURCE_INDEX} ON {ChatMessages.__tablename__} (SubmissionChatID, SourceMessageID)"
+        )
+        replies = connection.execute(
+            update(MessageReplies).values(
+                ReplyToMessageID=_message_key(MessageReplies.ReplyToSourceChatID, MessageReplies.ReplyToSourceMessageID)
+            )
+        ).rowcount
+        forwards = connection.execute(
+            update(MessageForwards)
+            .where(MessageForwards.OriginSourceChatID.is_not(None), MessageForwards.OriginSourceMessageID.is_not(None))
+            .values(OriginMessageID=_message_key(MessageForwards.OriginSourceChatID, MessageForwards.OriginSourceMessageID))
+        ).rowcount
+        connection.exec_driver_sql(f"DROP INDEX {SOURCE_INDEX}")
+    logging.info(f"Resolved {replies} reply and {forwards} forward edges in {time.perf_counter() - start:.2f}s")
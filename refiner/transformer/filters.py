@@ -0,0 +1,174 @@
+"""
+Selection of the chats and messages of a submission to refine, from the
+FILTER_* settings.
+
+Filters only read raw JSON: chat IDs, the message date and the fields a
+SourceMapping dispatches on to find the content type. They run before
+pydantic validation, so excluded chats and messages are never validated,
+decoded or written, and chat statistics cover only what is kept. The
+maximum number of messages per chat is the exception: it counts messages
+that are not duplicates, so it applies after deduplication.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from refiner.config import settings
+
+
+def _ids(value: Optional[str]) -> Optional[Set[str]]:
+    """Set of the comma separated values of a setting, None if it is not set."""
+    if not value:
+        return None
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+def _epoch(value: Optional[datetime]) -> Optional[float]:
+    """Epoch seconds of a datetime setting, naive values being UTC."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class MessageFilter:
+    """
+    Chat allow and deny lists, a [since, until) date window, kept content
+    types and a maximum number of messages per chat. Values left None do not
+    filter.
+    """
+
+    def __init__(self, mapping, chats: Optional[Set[str]] = None, exclude_chats: Optional[Set[str]] = None,
+                 since: Optional[float] = None, until: Optional[float] = None,
+                 content_types: Optional[Set[str]] = None, max_per_chat: Optional[int] = None):
+        # CompiledMapping of the source, for the date and content type of raw messages
+        self.mapping = mapping
+        self.chats = chats
+        self.exclude_chats = exclude_chats
+        self.since = since
+        self.until = until
+        self.content_types = content_types
+        self.max_per_chat = max_per_chat
+        self.filters_messages = since is not None or until is not None or content_types is not None
+        self.enabled = (self.filters_messages or chats is not None or exclude_chats is not None
+                        or max_per_chat is not None)
+        # Kept messages per chat and chats skipped so far, across the parts of a submission
+        self.kept_messages: Dict[str, int] = {}
+        self.skipped_chats: Set[str] = set()
+
+    @classmethod
+    def from_settings(cls, mapping) -> "MessageFilter":
+        return cls(
+            mapping,
+            chats=_ids(settings.FILTER_CHATS),
+            exclude_chats=_ids(settings.FILTER_EXCLUDE_CHATS),
+            since=_epoch(settings.FILTER_SINCE),
+            until=_epoch(settings.FILTER_UNTIL),
+            content_types=_ids(settings.FILTER_CONTENT_TYPES),
+            max_per_chat=settings.FILTER_MAX_MESSAGES_PER_CHAT,
+        )
+
+    def chat(self, chat_id: Any) -> bool:
+        """Whether the messages of a chat are kept."""
+        chat_id = str(chat_id)
+        if self.chats is not None and chat_id not in self.chats:
+            return False
+        return self.exclude_chats is None or chat_id not in self.exclude_chats
+
+    def message(self, raw: Dict[str, Any]) -> bool:
+        """Whether a raw message is in the date window and of a kept content type."""
+        if self.since is not None or self.until is not None:
+            date = self.mapping.date(raw)
+            if date is None:
+                return False
+            if self.since is not None and date < self.since:
+                return False
+            if self.until is not None and date >= self.until:
+                return False
+        return self.content_types is None or self.mapping.content_type(raw) in self.content_types
+
+    def skip_chat(self, chat_id: Any, diagnostics) -> None:
+        """Record a chat excluded by the chat filters, once per chat."""
+        chat_id = str(chat_id)
+        if chat_id not in self.skipped_chats:
+            self.skipped_chats.add(chat_id)
+            diagnostics.record("filtered_chats", f"chat {chat_id}")
+
+    def limit(self, chat_id: Any, count: int) -> int:
+        """How many of count more messages of a chat are kept under max_per_chat, counting them."""
+        if self.max_per_chat is None:
+            return count
+        chat_id = str(chat_id)
+        kept = self.kept_messages.get(chat_id, 0)
+        count = max(0, min(count, self.max_per_chat - kept))
+        self.kept_messages[chat_id] = kept + count
+        return count
+
+    def cap(self, chat_id: Any, messages: List[Any], diagnostics) -> List[Any]:
+        """
+        The first of the deduplicated messages of a chat under max_per_chat,
+        counting them, recording the rest in diagnostics. Messages kept by
+        earlier calls count, for the parts of a submission.
+        """
+        if self.max_per_chat is None:
+            return messages
+        kept = messages[:self.limit(chat_id, len(messages))]
+        if len(kept) < len(messages):
+            diagnostics.record("filtered_messages", f"chat {chat_id}", count=len(messages) - len(kept))
+        return kept
+
+    def cap_submission(self, data: Dict[str, Any], diagnostics) -> Dict[str, Any]:
+        """
+        A shallow copy of a raw fileDto capped under max_per_chat as a whole,
+        for submissions split into shards that are refined apart. Only the
+        first message with each ID counts, as deduplication keeps it, and
+        repeats are left for deduplication.
+        """
+        if self.max_per_chat is None:
+            return data
+        seen: Set[Any] = set()
+        chats = []
+        for chat in data.get('chats') or []:
+            chat_id = chat.get('chat_id')
+            contents = chat.get('contents') or []
+            kept = []
+            for msg in contents:
+                key = (str(chat_id), str(self.mapping.message_id(msg)))
+                if key in seen:
+                    kept.append(msg)
+                    continue
+                seen.add(key)
+                if self.limit(chat_id, 1):
+                    kept.append(msg)
+            if len(kept) < len(contents):
+                diagnostics.record("filtered_messages", f"chat {chat_id}", count=len(contents) - len(kept))
+                if not kept:
+                    continue
+            chats.append({**chat, 'contents': kept})
+        return {**data, 'chats': chats}
+
+    def apply(self, data: Dict[str, Any], diagnostics) -> Dict[str, Any]:
+        """
+        A shallow copy of a raw fileDto with only the chats and messages that
+        pass the chat, date and content type filters, recording what was
+        dropped in diagnostics. Chats left without messages are dropped.
+        max_per_chat is applied by cap, after deduplication.
+        """
+        if not self.enabled:
+            return data
+        chats = []
+        for chat in data.get('chats') or []:
+            chat_id = chat.get('chat_id')
+            contents = chat.get('contents') or []
+            if not self.chat(chat_id):
+                self.skip_chat(chat_id, diagnostics)
+                if contents:
+                    diagnostics.record("filtered_messages", f"chat {chat_id}", count=len(contents))
+                continue
+            kept = [msg for msg in contents if self.message(msg)] if self.filters_messages else contents
+            if len(kept) < len(contents):
+                diagnostics.record("filtered_messages", f"chat {chat_id}", count=len(contents) - len(kept))
+                if not kept:
+                    continue
+            chats.append({**chat, 'contents': kept})
+        return {**data, 'chats': chats}
@@ -0,0 +1,73 @@
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy.engine import Connection, Engine
+
+
+def _database_bytes(connection: Connection) -> int:
+    """Size of the database file, also for in-memory databases."""
+    page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+    return page_count * connection.exec_driver_sql("PRAGMA page_size").scalar()
+
+
+def finalize_database(engine: Engine, page_size: Optional[int] = None,
+                      auto_vacuum: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Prepare a fully written database for its consumers: ANALYZE collects
+    sqlite_stat1 statistics for the query planner and VACUUM rebuilds the
+    file without free pages, applying page_size and auto_vacuum if given.
+
+    Returns:
+        Report of the file size and page counts before and after, and the
+        time taken by each step
+    """
+    report: Dict[str, Any] = {}
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        report['bytes_before'] = _database_bytes(connection)
+        report['free_pages_before'] = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+        # Both only take effect when the file is rebuilt by VACUUM
+        if page_size:
+            connection.exec_driver_sql(f"PRAGMA page_size = {int(page_size)}")
+        if auto_vacuum:
+            connection.exec_driver_sql(f"PRAGMA auto_vacuum = {auto_vacuum.upper()}")
+
+        start = time.perf_counter()
+        connection.exec_driver_sql("ANALYZE")
+        report['analyze_seconds'] = round(time.perf_counter() - start, 3)
+
+        start = time.perf_counter()
+        connection.exec_driver_sql("VACUUM")
+        report['vacuum_seconds'] = round(time.perf_counter() - start, 3)
+
+        report['page_size'] = connection.exec_driver_sql("PRAGMA page_size").scalar()
+        report['free_pages_after'] = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        report['bytes_after'] = _database_bytes(connection)
+
+    logging.info(
+        f"Finalized database: {report['bytes_before']} -> {report['bytes_after']} bytes, "
+        f"{report['free_pages_before']} free pages reclaimed, "
+        f"ANALYZE {report['analyze_seconds']:.2f}s, VACUUM {report['vacuum_seconds']:.2f}s"
+    )
+    return report
+
+
+def combine_reports(reports: Iterable[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Totals of the finalize reports of several databases, such as the shards
+    of a submission or the submissions of a batch, skipping databases that
+    were not finalized. None if none was.
+    """
+    reports = [report for report in reports if report]
+    if not reports:
+        return None
+    combined: Dict[str, Any] = {'databases': sum(report.get('databases', 1) for report in reports)}
+    for key, value in reports[0].items():
+        # Page sizes are per database, not additive
+        if key in combined or key == 'page_size':
+            continue
+        total = sum(report[key] for report in reports)
+        combined[key] = round(total, 3) if isinstance(value, float) else total
+    return combined
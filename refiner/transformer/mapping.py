@@ -0,0 +1,759 @@
+"""
+Declarative field mappings from source formats to refined models.
+
+A SourceMapping describes, as data, how a validated source message becomes a
+ChatMessages row: which attributes identify its sender and date, and which
+ContentRule applies to it, selected by the values at the mapping's dispatch
+paths (e.g. ``className``, ``content.type``). compile_mapping turns the spec
+into getter functions and a dispatch table once, so per-message work is a
+dict lookup plus the attribute reads of the matched rule.
+
+Value specs used throughout a mapping are one of:
+
+- a dotted attribute path, e.g. ``"content.caption.text"`` (None if any step is
+  missing); steps into plain dicts (fields typed ``Any``) look up keys instead
+- Const(value)
+- Format(template, paths), rendered with str.format, or None if any path is None
+- NonEmpty(spec), treating falsy values such as ``""`` as None
+- Lookup(path, table), translating the value at path through a dict
+- a tuple of value specs, evaluating to the first one that is not None
+"""
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Type, Union
+from functools import partial
+from itertools import islice
+import base64
+import json
+import logging
+
+from pydantic import BaseModel
+from sqlalchemy import select, update
+
+from refiner.config import settings
+from refiner.models.refined import (
+    Base, Users, Submissions, SubmissionChats, ChatMessages, MessageReplies, MessageForwards, NORMALIZED_MESSAGES
+)
+from refiner.transformer.base_transformer import DataTransformer, Progress
+from refiner.transformer.filters import MessageFilter
+from refiner.utils.checkpoint import Checkpoint
+from refiner.utils.date import to_db_timestamp, db_now
+from refiner.utils.diagnostics import DiagnosticEvents
+from refiner.utils.keys import KeyGenerator
+from refiner.utils.ndjson import LineDelimitedSubmission, map_chunks, read_lines
+from refiner.utils.parts import SubmissionParts
+from refiner.utils.pii import mask_pii
+
+# Rule key component matching any value that is not None
+ANY = "*"
+
+
+class Const(NamedTuple):
+    """A constant value."""
+    value: Any
+
+
+class Format(NamedTuple):
+    """A str.format template over the values at paths."""
+    template: str
+    paths: Tuple[str, ...]
+
+
+class NonEmpty(NamedTuple):
+    """A value spec whose falsy values are treated as None."""
+    spec: Any
+
+
+class Lookup(NamedTuple):
+    """The value at path translated through table, None if it is not in the table."""
+    path: str
+    table: Dict[Any, Any]
+
+
+ValueSpec = Union[str, Const, Format, NonEmpty, Lookup, Tuple[Any, ...], None]
+
+
+class ContentRule(NamedTuple):
+    """How to extract ContentType, Content and ContentData for one kind of message."""
+    content_type: str
+    content: ValueSpec = None
+    # Path to base64 encoded media (e.g. a minithumbnail) stored as ContentData
+    data: Optional[str] = None
+    # Diagnostics category prefix for data extraction: "<name>_extracted" / "<name>_error"
+    data_name: Optional[str] = None
+    # Diagnostics category recorded for every message matching the rule
+    diagnostic: Optional[str] = None
+    diagnostic_example: ValueSpec = None
+    diagnostic_level: int = logging.INFO
+
+
+class ReplyRule(NamedTuple):
+    """Where a message records the message it replies to."""
+    message: ValueSpec
+    # Chat of the replied-to message, defaults to the message's own chat
+    chat: ValueSpec = None
+
+
+class ForwardRule(NamedTuple):
+    """Where a message records the origin it was forwarded from."""
+    # Path that is only set on forwarded messages
+    present: str
+    origin_type: ValueSpec
+    sender: ValueSpec = None
+    chat: ValueSpec = None
+    message: ValueSpec = None
+    date: ValueSpec = None
+
+
+class SourceMapping(NamedTuple):
+    """Declarative description of a source format."""
+    name: str
+    # Paths whose values form the key used to look up rules
+    dispatch: Tuple[str, ...]
+    # Rules keyed by tuples of dispatch values. Keys may be shorter than dispatch
+    # (matching any remaining values) or use ANY for any value that is not None
+    rules: Dict[Tuple[Any, ...], ContentRule]
+    default: ContentRule
+    sender: ValueSpec
+    date: str = "date"
+    message_id: str = "id"
+    # Evaluated against the validated submission rather than a message
+    user_source: ValueSpec = "source"
+    # Diagnostics category recorded for messages without ContentData
+    missing_data_diagnostic: Optional[str] = None
+    reply: Optional[ReplyRule] = None
+    forward: Optional[ForwardRule] = None
+    # Dispatch paths in the raw JSON message, where aliases make them differ from the model's
+    raw_dispatch: Optional[Tuple[str, ...]] = None
+
+
+def compile_path(path: str) -> Callable[[Any], Any]:
+    """Compile a dotted attribute path into a getter returning None for missing steps."""
+    names = tuple(path.split('.'))
+    if len(names) == 1:
+        name = names[0]
+        return lambda obj: obj.get(name) if type(obj) is dict else getattr(obj, name, None)
+
+    def get(obj: Any) -> Any:
+        for name in names:
+            obj = obj.get(name) if type(obj) is dict else getattr(obj, name, None)
+            if obj is None:
+                return None
+        return obj
+    return get
+
+
+def compile_value(spec: ValueSpec) -> Callable[[Any], Any]:
+    """Compile a value spec into a function of the object it is evaluated against."""
+    if spec is None:
+        return lambda obj: None
+    if isinstance(spec, str):
+        return compile_path(spec)
+    if isinstance(spec, Const):
+        value = spec.value
+        return lambda obj: value
+    if isinstance(spec, Format):
+        getters = [compile_path(path) for path in spec.paths]
+        template = spec.template
+
+        def render(obj: Any) -> Optional[str]:
+            values = [get(obj) for get in getters]
+            if any(value is None for value in values):
+                return None
+            return template.format(*values)
+        return render
+    if isinstance(spec, NonEmpty):
+        get = compile_value(spec.spec)
+        return lambda obj: get(obj) or None
+    if isinstance(spec, Lookup):
+        get, table = compile_path(spec.path), spec.table
+        return lambda obj: table.get(get(obj))
+    if isinstance(spec, tuple):
+        alternatives = [compile_value(alternative) for alternative in spec]
+
+        def coalesce(obj: Any) -> Any:
+            for alternative in alternatives:
+                value = alternative(obj)
+                if value is not None:
+                    return value
+            return None
+        return coalesce
+    raise TypeError(f"Unsupported value spec: {spec!r}")
+
+
+def is_placeholder(spec: ValueSpec) -> bool:
+    """Whether a content spec only generates text from the message type (Const and Format)."""
+    if isinstance(spec, (Const, Format)):
+        return True
+    if isinstance(spec, tuple) and not isinstance(spec, (NonEmpty, Lookup)):
+        return bool(spec) and all(is_placeholder(alternative) for alternative in spec)
+    return False
+
+
+def _rule_candidates(key: Tuple[Any, ...]) -> Iterator[Tuple[Any, ...]]:
+    """Rule keys that may match a dispatch key, most specific first."""
+    yield key
+    for i in range(len(key) - 1, -1, -1):
+        if key[i] is not None:
+            yield key[:i] + (ANY,)
+        yield key[:i]
+
+
+class CompiledMapping:
+    """A SourceMapping compiled into getters and a memoized dispatch table."""
+
+    def __init__(self, mapping: SourceMapping):
+        self.name = mapping.name
+        self.sender_id = compile_value(mapping.sender)
+        self.date = compile_path(mapping.date)
+        self.message_id = compile_path(mapping.message_id)
+        self.user_source = compile_value(mapping.user_source)
+
+        getters = [compile_path(path) for path in mapping.dispatch]
+        if len(getters) == 1:
+            get = getters[0]
+            self._key = lambda msg: (get(msg),)
+        else:
+            self._key = lambda msg: tuple(get(msg) for get in getters)
+
+        self._rules = {key: self._compile_rule(rule, mapping.missing_data_diagnostic)
+                       for key, rule in mapping.rules.items()}
+        self._default = self._compile_rule(mapping.default, mapping.missing_data_diagnostic)
+        # Dispatch keys seen so far, resolved to their rule
+        self._dispatch: Dict[Tuple[Any, ...], Callable] = {}
+
+        raw_getters = [compile_path(path) for path in mapping.raw_dispatch or mapping.dispatch]
+        self._raw_key = lambda msg: tuple(get(msg) for get in raw_getters)
+        self._content_types = {key: rule.content_type for key, rule in mapping.rules.items()}
+        self._default_content_type = mapping.default.content_type
+        # Raw dispatch keys seen so far, resolved to their rule's content type
+        self._raw_dispatch: Dict[Tuple[Any, ...], str] = {}
+
+        self._reply = None
+        if mapping.reply:
+            self._reply = (compile_value(mapping.reply.message), compile_value(mapping.reply.chat))
+        self._forward = None
+        if mapping.forward:
+            rule = mapping.forward
+            self._forward = (compile_path(rule.present), compile_value(rule.origin_type), compile_value(rule.sender),
+                             compile_value(rule.chat), compile_value(rule.message), compile_value(rule.date))
+
+    def _compile_rule(self, rule: ContentRule, missing_data_diagnostic: Optional[str]) -> Callable:
+        """Compile a rule into a function returning (content_type, content, content_data, placeholder)."""
+        content_type = rule.content_type
+        get_content = compile_value(rule.content)
+        placeholder = is_placeholder(rule.content)
+        get_data = compile_path(rule.data) if rule.data else None
+        extracted, failed = f"{rule.data_name}_extracted", f"{rule.data_name}_error"
+        diagnostic, diagnostic_level = rule.diagnostic, rule.diagnostic_level
+        get_example = compile_value(rule.diagnostic_example)
+        message_id = self.message_id
+
+        def extract(msg: Any, diagnostics) -> Tuple[str, Any, Optional[bytes], bool]:
+            content_data = None
+            if get_data is not None:
+                encoded = get_data(msg)
+                if encoded is not None:
+                    try:
+                        content_data = base64.b64decode(encoded)
+                        diagnostics.record(extracted, message_id(msg))
+                    except Exception as e:
+                        diagnostics.record(failed, f"message {message_id(msg)}: {type(e).__name__}", logging.ERROR)
+            if diagnostic:
+                diagnostics.record(diagnostic, get_example(msg), diagnostic_level)
+            if content_data is None and missing_data_diagnostic:
+                diagnostics.record(missing_data_diagnostic, message_id(msg))
+            return content_type, get_content(msg), content_data, placeholder
+        return extract
+
+    def _resolve(self, key: Tuple[Any, ...]) -> Callable:
+        for candidate in _rule_candidates(key):
+            if candidate in self._rules:
+                return self._rules[candidate]
+        return self._default
+
+    def extract(self, msg: Any, diagnostics) -> Tuple[str, Any, Optional[bytes], bool]:
+        """
+        Return (content_type, content, content_data, placeholder) for a message,
+        placeholder telling whether the content was generated from the message type.
+        """
+        key = self._key(msg)
+        extract = self._dispatch.get(key)
+        if extract is None:
+            extract = self._dispatch[key] = self._resolve(key)
+        return extract(msg, diagnostics)
+
+    def content_type(self, raw: Dict[str, Any]) -> str:
+        """ContentType of a raw JSON message, without validating or extracting it."""
+        key = self._raw_key(raw)
+        content_type = self._raw_dispatch.get(key)
+        if content_type is None:
+            content_type = next((self._content_types[candidate] for candidate in _rule_candidates(key)
+                                 if candidate in self._content_types), self._default_content_type)
+            self._raw_dispatch[key] = content_type
+        return content_type
+
+    def sender(self, msg: Any) -> Optional[str]:
+        """Return the source sender ID of a message, or None if unknown."""
+        sender_id = self.sender_id(msg)
+        return None if sender_id is None else str(sender_id)
+
+    def reply(self, msg: Any, chat_source_id: str) -> Optional[Tuple[str, str]]:
+        """Return (source chat ID, source message ID) of the message replied to, if any."""
+        if self._reply is None:
+            return None
+        get_message, get_chat = self._reply
+        message_id = get_message(msg)
+        if message_id is None:
+            return None
+        chat_id = get_chat(msg)
+        return (chat_source_id if chat_id is None else str(chat_id)), str(message_id)
+
+    def forward(self, msg: Any) -> Optional[Tuple[str, Optional[str], Optional[str], Optional[str], Any]]:
+        """Return (origin type, sender ID, source chat ID, source message ID, date) of a forwarded message."""
+        if self._forward is None:
+            return None
+        present, origin_type, sender, chat, message, date = self._forward
+        if present(msg) is None:
+            return None
+        sender_id, chat_id, message_id = sender(msg), chat(msg), message(msg)
+        return (
+            origin_type(msg) or "unknown",
+            None if sender_id is None else str(sender_id),
+            None if chat_id is None else str(chat_id),
+            None if message_id is None else str(message_id),
+            date(msg),
+        )
+
+
+def compile_mapping(mapping: SourceMapping) -> CompiledMapping:
+    """Compile a SourceMapping for use by a MappedTransformer."""
+    return CompiledMapping(mapping)
+
+
+class MessageRow(NamedTuple):
+    """A message line of an NDJSON submission, reduced to what is written for it."""
+    chat_id: Any
+    message_id: Any
+    date: Any
+    sender: Optional[str]
+    # (content_type, content, content_data, placeholder), see CompiledMapping.extract
+    content: Tuple[str, Any, Optional[bytes], bool]
+    reply: Optional[Tuple[str, str]]
+    forward: Optional[Tuple[str, Optional[str], Optional[str], Optional[str], Any]]
+    # Diagnostics of the extraction, recorded only if the message is kept
+    events: DiagnosticEvents
+
+
+class ChunkRows(NamedTuple):
+    """Result of extract_rows for one chunk of an NDJSON submission."""
+    rows: List[MessageRow]
+    # Diagnostics of the lines dropped by the filters
+    events: DiagnosticEvents
+    # Chats whose lines were dropped by the chat filters
+    excluded_chats: Set[Any]
+
+
+def extract_rows(transformer_cls: Type["MappedTransformer"], edges: bool,
+                 path: str, start: int, end: int) -> ChunkRows:
+    """
+    Parse, filter, validate and map the message lines of one chunk of an
+    NDJSON submission. Runs in worker processes, see map_chunks: rows are
+    much cheaper to send back than the parsed messages. FILTER_MAX_MESSAGES_PER_CHAT
+    spans chunks and is applied by the consumer.
+    """
+    mapping, message_model = transformer_cls.mapping, transformer_cls.message_model
+    message_filter = MessageFilter.from_settings(mapping)
+    chunk = ChunkRows([], DiagnosticEvents(), set())
+    for offset, line in read_lines(path, start, end):
+        try:
+            data = json.loads(line)
+            chat_id = data['chat_id']
+            # Filtered lines are never validated
+            if not message_filter.chat(chat_id):
+                chunk.excluded_chats.add(chat_id)
+                chunk.events.record("filtered_messages", f"chat {chat_id}")
+                continue
+            if message_filter.filters_messages and not message_filter.message(data):
+                chunk.events.record("filtered_messages", f"chat {chat_id}")
+                continue
+            msg = message_model.model_validate(data)
+        except Exception as e:
+            raise ValueError(f"Invalid {mapping.name} message at byte {offset} of {path}: {e}") from e
+        events = DiagnosticEvents()
+        chunk.rows.append(MessageRow(
+            chat_id=chat_id,
+            message_id=mapping.message_id(msg),
+            date=mapping.date(msg),
+            sender=mapping.sender(msg),
+            content=mapping.extract(msg, events),
+            reply=mapping.reply(msg, str(chat_id)) if edges else None,
+            forward=mapping.forward(msg) if edges else None,
+            events=events
+        ))
+    return chunk
+
+
+class ChatStats:
+    """SubmissionChats statistics of a chat, accumulated one message at a time."""
+
+    def __init__(self):
+        self.count = 0
+        self.first_date = None
+        self.last_date = None
+        self.senders = set()
+
+    def add(self, date: Any, sender_id: Optional[str]) -> None:
+        self.count += 1
+        if date is not None:
+            if self.first_date is None or date < self.first_date:
+                self.first_date = date
+            if self.last_date is None or date > self.last_date:
+                self.last_date = date
+        if sender_id is not None:
+            self.senders.add(sender_id)
+
+    def columns(self) -> Dict[str, Any]:
+        return {
+            'FirstMessageDate': to_db_timestamp(self.first_date) if self.first_date is not None else db_now(),
+            'LastMessageDate': to_db_timestamp(self.last_date) if self.last_date is not None else db_now(),
+            'ParticipantCount': len(self.senders),
+            'MessageCount': self.count,
+        }
+
+
+class MappedTransformer(DataTransformer):
+    """
+    Transformer driven by a SourceMapping.
+
+    Subclasses set source_model to the pydantic model of the submission
+    (with ``user`` and ``chats[].chat_id/contents`` fields), message_model
+    to that of its messages and mapping to the compiled SourceMapping of
+    its messages.
+    """
+
+    source_model: Type[BaseModel] = None
+    message_model: Type[BaseModel] = None
+    mapping: CompiledMapping = None
+
+    def __init__(self, db_path: str, checkpoint: Optional[Checkpoint] = None, keys: Optional[KeyGenerator] = None):
+        # Chats written so far by source chat ID, as (key, ChatStats), across the parts of a submission
+        self._chats: Dict[str, Tuple[Any, ChatStats]] = {}
+        # Chats whose row was written before all their messages were read, see finish_load
+        self._unsettled_chats: Set[str] = set()
+        self._submission_id = None
+        self.message_filter = MessageFilter.from_settings(self.mapping)
+        super().__init__(db_path, checkpoint, keys)
+
+    def transform_batches(self, data: Union[Dict[str, Any], LineDelimitedSubmission]) -> Iterator[List[Base]]:
+        """
+        Transform raw source data into batches of SQLAlchemy model instances.
+
+        Args:
+            data: Dictionary containing the source data, an NDJSON submission,
+                or the SubmissionParts of a submission split across files
+
+        Returns:
+            Iterator over lists of SQLAlchemy model instances
+        """
+        if isinstance(data, SubmissionParts):
+            return self.batched(self._iter_part_models(data))
+        if isinstance(data, LineDelimitedSubmission):
+            return self.batched(self._iter_line_models(data))
+        return self.batched(self._iter_models(data))
+
+    def _iter_part_models(self, submission: SubmissionParts) -> Iterator[Base]:
+        """
+        Yield model instances for every part of a submission in turn. The
+        user and submission are written with the first part, and a chat
+        continued by a later part gets its messages added to its row and
+        statistics, see finish_load.
+        """
+        for part in submission.parts:
+            if isinstance(part, LineDelimitedSubmission):
+                yield from self._iter_line_models(part)
+            else:
+                yield from self._iter_models(part)
+
+    def _iter_models(self, data: Dict[str, Any]) -> Iterator[Base]:
+        """
+        Yield model instances for the submission one at a time. When
+        checkpointing, Progress markers follow every chat and every
+        CHECKPOINT_MESSAGES messages, and a resumed run skips what the
+        interrupted one wrote.
+        """
+        mapping = self.mapping
+        edges = settings.BUILD_MESSAGE_EDGES
+        dimensions = self.dimensions if NORMALIZED_MESSAGES else None
+        resume = self.resume
+        checkpoint_every = settings.CHECKPOINT_MESSAGES if self.checkpoint else 0
+
+        # Drop filtered chats and messages, then validate the rest with Pydantic
+        data = self.message_filter.apply(data, self.diagnostics)
+        try:
+            submission_data = self.source_model.model_validate(data)
+        except Exception as e:
+            logging.error(f"Error validating {mapping.name} data: {e}")
+            raise
+
+        yield from self._submission_rows(submission_data, submission_data.user)
+        submission_id = self._submission_id
+
+        # Process each chat
+        for chat_index, chat_data in enumerate(submission_data.chats):
+            # Drop duplicate messages, then those past max_per_chat, before calculating chat statistics
+            unique = self.unique_messages(chat_data.chat_id, chat_data.contents)
+            contents = self.message_filter.cap(chat_data.chat_id, unique, self.diagnostics)
+            if unique and not contents and str(chat_data.chat_id) not in self._chats:
+                # Like a chat the other filters leave empty
+                continue
+
+            senders = [mapping.sender(msg) for msg in contents]
+            chat_source_id = str(chat_data.chat_id)
+            if resume is not None and chat_index < resume.chats:
+                self._replay(contents, senders)
+                continue
+
+            messages = zip(contents, senders)
+            written = resume.messages if resume is not None and chat_index == resume.chats else 0
+            if written:
+                chat_id = self._resumed_row(
+                    select(SubmissionChats.SubmissionChatID)
+                    .where(SubmissionChats.SubmissionID == submission_id, SubmissionChats.SourceChatID == chat_source_id)
+                )[0]
+                self._replay(contents[:written], senders[:written])
+                messages = islice(messages, written, None)
+            elif chat_source_id in self._chats:
+                # Continued from an earlier part
+                chat_id, stats = self._chats[chat_source_id]
+                for msg, sender_id in zip(contents, senders):
+                    stats.add(mapping.date(msg), sender_id)
+                self._unsettled_chats.add(chat_source_id)
+            else:
+                stats = ChatStats()
+                for msg, sender_id in zip(contents, senders):
+                    stats.add(mapping.date(msg), sender_id)
+
+                # Create SubmissionChat record
+                chat_id = self.keys.key(SubmissionChats, chat_source_id)
+                yield SubmissionChats(
+                    SubmissionChatID=chat_id,
+                    SubmissionID=submission_id,
+                    SourceChatID=chat_source_id,
+                    **stats.columns()
+                )
+                self._chats[chat_source_id] = (chat_id, stats)
+
+            # Process each message in the chat
+            for position, (msg_content, sender_id) in enumerate(messages, written + 1):
+                columns = self._message_columns(msg_content, sender_id)
+                # New dimension rows are written no later than their first message
+                if dimensions is not None and dimensions.pending:
+                    yield from dimensions.pending
+                    dimensions.pending.clear()
+                message_id = self.keys.new(ChatMessages)
+                yield ChatMessages(
+                    MessageID=message_id,
+                    SubmissionChatID=chat_id,
+                    SourceMessageID=str(mapping.message_id(msg_content)),
+                    MessageDate=to_db_timestamp(mapping.date(msg_content)),
+                    **columns
+                )
+
+                if edges:
+                    yield from self._edges(
+                        message_id, chat_id, mapping.reply(msg_content, chat_source_id), mapping.forward(msg_content)
+                    )
+                if checkpoint_every and position % checkpoint_every == 0 and position < len(contents):
+                    yield Progress(chat_index, position)
+
+            if checkpoint_every:
+                yield Progress(chat_index + 1, 0)
+
+    def _iter_line_models(self, submission: LineDelimitedSubmission) -> Iterator[Base]:
+        """
+        Yield model instances for an NDJSON submission as its lines are read.
+        A chat is written with its first message and its statistics are set
+        by finish_load. When checkpointing, Progress markers follow every
+        CHECKPOINT_MESSAGES lines, and a resumed run reads again the lines
+        the interrupted one wrote without writing them.
+        """
+        edges = settings.BUILD_MESSAGE_EDGES
+        dimensions = self.dimensions if NORMALIZED_MESSAGES else None
+        checkpoint_every = settings.CHECKPOINT_MESSAGES if self.checkpoint else 0
+        written_lines = self.resume.messages if self.resume is not None else 0
+        written_chats = {}
+
+        yield from self._submission_rows(submission.header, submission.header['user'])
+        submission_id = self._submission_id
+        if self.resume is not None:
+            with self.engine.connect() as connection:
+                written_chats = dict(connection.execute(
+                    select(SubmissionChats.SourceChatID, SubmissionChats.SubmissionChatID)
+                    .where(SubmissionChats.SubmissionID == submission_id)
+                ).all())
+
+        chunks = map_chunks(submission, partial(extract_rows, type(self), edges),
+                            settings.NDJSON_WORKERS, settings.NDJSON_CHUNK_BYTES)
+        message_filter = self.message_filter
+        max_per_chat = message_filter.max_per_chat
+        unsettled_chats = self._unsettled_chats
+        lines = 0
+        for chunk in chunks:
+            chunk.events.replay(self.diagnostics)
+            for chat_id in chunk.excluded_chats:
+                message_filter.skip_chat(chat_id, self.diagnostics)
+            for row in chunk.rows:
+                lines += 1
+                written = lines <= written_lines
+                if not self.deduplicator.add(row.chat_id, row.message_id):
+                    self.diagnostics.record("duplicate_messages", f"chat {row.chat_id}")
+                elif max_per_chat is not None and not message_filter.limit(row.chat_id, 1):
+                    self.diagnostics.record("filtered_messages", f"chat {row.chat_id}")
+                else:
+                    chat_source_id = str(row.chat_id)
+                    chat = self._chats.get(chat_source_id)
+                    if chat is None:
+                        if chat_source_id in written_chats:
+                            chat = (written_chats[chat_source_id], ChatStats())
+                        else:
+                            # Statistics are not known until the last line, see finish_load
+                            chat = (self.keys.key(SubmissionChats, chat_source_id), ChatStats())
+                            yield SubmissionChats(
+                                SubmissionChatID=chat[0],
+                                SubmissionID=submission_id,
+                                SourceChatID=chat_source_id,
+                                **chat[1].columns()
+                            )
+                        self._chats[chat_source_id] = chat
+                    chat_id, stats = chat
+                    stats.add(row.date, row.sender)
+                    unsettled_chats.add(chat_source_id)
+
+                    row.events.replay(self.diagnostics)
+                    columns = self._content_columns(row.sender, *row.content)
+                    if written:
+                        self.dimensions.pending.clear()
+                    else:
+                        if dimensions is not None and dimensions.pending:
+                            yield from dimensions.pending
+                            dimensions.pending.clear()
+                        message_id = self.keys.new(ChatMessages)
+                        yield ChatMessages(
+                            MessageID=message_id,
+                            SubmissionChatID=chat_id,
+                            SourceMessageID=str(row.message_id),
+                            MessageDate=to_db_timestamp(row.date),
+                            **columns
+                        )
+                        if edges:
+                            yield from self._edges(message_id, chat_id, row.reply, row.forward)
+
+                if checkpoint_every and not written and lines % checkpoint_every == 0:
+                    yield Progress(0, lines)
+
+    def finish_load(self) -> None:
+        """
+        Set the statistics of the chats written before all their messages
+        were read, those of NDJSON submissions and those spanning parts.
+        """
+        if not self._unsettled_chats:
+            return
+        with self.engine.begin() as connection:
+            for chat_source_id in self._unsettled_chats:
+                chat_id, stats = self._chats[chat_source_id]
+                connection.execute(
+                    update(SubmissionChats)
+                    .where(SubmissionChats.SubmissionChatID == chat_id)
+                    .values(**stats.columns())
+                )
+
+    def _submission_rows(self, submission_data: Any, user: Any) -> Iterator[Base]:
+        """
+        Yield the Users and Submissions rows with the first part of a
+        submission, setting _submission_id, or find the submission of an
+        interrupted run.
+        """
+        if self._submission_id is not None:
+            return
+        if self.resume is not None:
+            self._submission_id = self._resumed_row(select(Submissions.SubmissionID))[0]
+            return
+        user, submission = self._submission_models(submission_data, user)
+        self._submission_id = submission.SubmissionID
+        yield user
+        yield submission
+
+    def _submission_models(self, submission_data: Any, user: Any) -> Tuple[Users, Submissions]:
+        """Users and Submissions rows of a new submission."""
+        user_id = self.keys.key(Users)
+        submission_id = self.keys.key(Submissions)
+        return (
+            Users(
+                UserID=user_id,
+                Source=self.mapping.user_source(submission_data),
+                SourceUserId=mask_pii(str(user)),
+                Status="active",
+                DateTimeCreated=db_now()
+            ),
+            Submissions(
+                SubmissionID=submission_id,
+                UserID=user_id,
+                SubmissionDate=db_now(),
+                SubmissionReference="" #TODO
+            )
+        )
+
+    def _message_columns(self, msg: Any, sender_id: Optional[str]) -> Dict[str, Any]:
+        """ChatMessages sender and content column values of a message, for the configured layout."""
+        return self._content_columns(sender_id, *self.mapping.extract(msg, self.diagnostics))
+
+    def _content_columns(self, sender_id: Optional[str], content_type: str, content: Any,
+                         content_data: Optional[bytes], placeholder: bool) -> Dict[str, Any]:
+        """ChatMessages sender and content column values of extracted message content."""
+        sender = mask_pii(sender_id or "unknown")
+        if NORMALIZED_MESSAGES:
+            columns = self.dimensions.message_columns(sender, content_type, content, placeholder)
+        else:
+            columns = {'SenderID': sender, 'ContentType': content_type, 'Content': content}
+        columns['ContentData'] = None if content_type == "text" else content_data
+        return columns
+
+    def _replay(self, contents: List[Any], senders: List[Optional[str]]) -> None:
+        """
+        Repeat the in-memory effects of messages an interrupted run already
+        wrote, its diagnostics and dimension keys, without writing them again.
+        """
+        for msg, sender_id in zip(contents, senders):
+            self._message_columns(msg, sender_id)
+        self.dimensions.pending.clear()
+
+    def _resumed_row(self, statement) -> Tuple:
+        """First row of a query against the database of the interrupted run."""
+        with self.engine.connect() as connection:
+            return connection.execute(statement).first()
+
+    def _edges(self, message_id: Any, chat_id: Any, reply: Optional[Tuple[str, str]],
+               forward: Optional[Tuple]) -> Iterator[Base]:
+        """
+        Yield the reply and forward edges of a message, as returned by
+        CompiledMapping.reply and forward. Keys of the target messages are
+        resolved after loading, see resolve_message_edges.
+        """
+        if reply is not None:
+            yield MessageReplies(
+                MessageID=message_id,
+                SubmissionChatID=chat_id,
+                ReplyToSourceChatID=reply[0],
+                ReplyToSourceMessageID=reply[1]
+            )
+
+        if forward is not None:
+            origin_type, sender_id, source_chat_id, source_message_id, date = forward
+            yield MessageForwards(
+                MessageID=message_id,
+                SubmissionChatID=chat_id,
+                OriginType=origin_type,
+                OriginSenderID=mask_pii(sender_id) if sender_id else None,
+                OriginSourceChatID=source_chat_id,
+                OriginSourceMessageID=source_message_id,
+                OriginDate=to_db_timestamp(date) if date else None
+            )
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+
+def fingerprint(secret: str) -> str:
+    """One-way fingerprint of a secret, safe to use in cache keys."""
+    return hashlib.sha256(f"refiner-cache:{secret}".encode()).hexdigest()[:32]
+
+
+class ResultCache:
+    """
+    Local cache of refinement results stored as one JSON file per key.
+    Entries older than max_age_seconds are evicted, then the least recently
+    used entries until the cache fits in max_bytes.
+
+    Each file holds the value with its creation time, which the age limit is
+    measured from. The file's mtime is bumped on every hit and only orders
+    entries by last use.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, max_age_seconds: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: str) -> str:
+        """Combine key parts (input digest, versions, fingerprints) into one cache key."""
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value for key, or None on a miss or an expired entry."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        # Entries written before creation times were stored have no reliable age
+        created = entry.get('created') if isinstance(entry, dict) else None
+        if not isinstance(created, (int, float)) or time.time() - created > self.max_age_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        return entry.get('value')
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """Store a value and evict entries beyond the age and size limits."""
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'created': time.time(), 'value': value}, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove expired entries, then the least recently used ones until under
+        max_bytes. An entry unused for max_age_seconds was created before that
+        and has expired; one still in use expires when get reads its creation
+        time, so the files need not be read here.
+        """
+        now = time.time()
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            logging.info(f"Evicted cached result {os.path.basename(path)}")
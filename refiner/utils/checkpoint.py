@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+
+class Checkpoint:
+    """
+    Progress of a refinement, kept in a sidecar file next to its database so
+    that a restarted run can continue where the previous one stopped.
+
+    Every checkpoint commit is numbered, and the number is stored in the
+    database itself (PRAGMA user_version) as part of the committed
+    transaction. Before committing, the sidecar records the progress of the
+    new commit next to that of the previous one, so whichever of the two the
+    database ends up with, its progress is known. Progress is the number of
+    chats fully written and of messages written from the next chat.
+
+    A sidecar with a different fingerprint (another input, transformer or
+    settings) is ignored and the refinement starts over.
+    """
+
+    def __init__(self, db_path: str, fingerprint: str):
+        self.path = f"{db_path}.checkpoint"
+        self.fingerprint = fingerprint
+        self.state = self._load() or {}
+        self.sequence = 0
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if state.get('fingerprint') != self.fingerprint:
+            logging.info(f"Ignoring checkpoint {self.path} of a different input or configuration")
+            return None
+        return state
+
+    def _save(self, **state: Any) -> None:
+        self.state = {'fingerprint': self.fingerprint, **state}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    @property
+    def complete(self) -> bool:
+        """Whether the database was fully built by an earlier run."""
+        return bool(self.state.get('complete'))
+
+    @property
+    def diagnostics(self) -> Dict[str, Any]:
+        """Diagnostics summary of the run that completed the database."""
+        return self.state.get('diagnostics', {})
+
+    @property
+    def finalize_report(self) -> Optional[Dict[str, Any]]:
+        """Report of finalize_database in the run that completed the database, if it finalized it."""
+        return self.state.get('finalize')
+
+    def progress(self, sequence: int) -> Optional[Tuple[int, int]]:
+        """(chats, messages) written as of the commit numbered sequence, None if unknown."""
+        recorded = self.state.get('progress', {}).get(str(sequence))
+        if not sequence or recorded is None:
+            return None
+        self.sequence = sequence
+        return recorded[0], recorded[1]
+
+    def prepare(self, chats: int, messages: int) -> int:
+        """Record the progress of the next commit before making it, returning its number."""
+        progress = self.state.get('progress', {})
+        sequence = self.sequence + 1
+        recorded = {str(sequence): [chats, messages]}
+        if str(self.sequence) in progress:
+            recorded[str(self.sequence)] = progress[str(self.sequence)]
+        self._save(progress=recorded)
+        self.sequence = sequence
+        return sequence
+
+    def finish(self, diagnostics: Dict[str, Any], finalize_report: Optional[Dict[str, Any]] = None) -> None:
+        """Record that the database is complete, keeping its diagnostics and finalize report until it is published."""
+        self._save(complete=True, diagnostics=diagnostics, finalize=finalize_report)
+
+    def clear(self) -> None:
+        """Forget the progress, once the refinement has been published."""
+        self.state = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,70 @@
+import lzma
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple, Optional
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency, only needed for the zstd codec
+    zstandard = None
+
+
+class Codec(NamedTuple):
+    compress: Callable[[bytes, Optional[int]], bytes]
+    decompress: Callable[[bytes], bytes]
+    default_level: Optional[int]
+    # Incremental compressor with compress() and flush(), None when the codec copies the data
+    compressor: Optional[Callable[[Optional[int]], Any]] = None
+
+
+def _zstd_compress(data: bytes, level: Optional[int]) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    # Frames written incrementally do not record their content size in the header
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+CODECS: Dict[str, Codec] = {
+    "none": Codec(lambda data, level: data, lambda data: data, None),
+    "zlib": Codec(lambda data, level: zlib.compress(data, level), zlib.decompress, 6,
+                  lambda level: zlib.compressobj(level)),
+    "lzma": Codec(lambda data, level: lzma.compress(data, preset=level), lzma.decompress, 6,
+                  lambda level: lzma.LZMACompressor(preset=level)),
+    "zstd": Codec(_zstd_compress, _zstd_decompress, 3,
+                  lambda level: zstandard.ZstdCompressor(level=level).compressobj()),
+}
+
+
+def get_codec(name: str) -> Codec:
+    """Look up a compression codec by name."""
+    if name not in CODECS:
+        raise ValueError(f"Unknown compression codec '{name}', expected one of {sorted(CODECS)}")
+    if name == "zstd" and zstandard is None:
+        raise ImportError("The zstd codec requires the 'zstandard' package")
+    return CODECS[name]
+
+
+def compress(data: bytes, codec: str, level: Optional[int] = None) -> bytes:
+    """Compress data with the given codec, using the codec's default level if none is given."""
+    selected = get_codec(codec)
+    return selected.compress(data, selected.default_level if level is None else level)
+
+
+def compress_chunks(chunks: Iterable[bytes], codec: str, level: Optional[int] = None) -> Iterator[bytes]:
+    """Compress a sequence of chunks as one stream, yielding the output as the codec produces it."""
+    selected = get_codec(codec)
+    if selected.compressor is None:
+        yield from chunks
+        return
+    compressor = selected.compressor(selected.default_level if level is None else level)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    """Decompress data produced by compress() with the same codec."""
+    return get_codec(codec).decompress(data)
@@ -1,8 +1,27 @@
+import time
 from datetime import datetime
 
+from refiner.config import settings
+
+EPOCH_TIMESTAMPS = settings.TIMESTAMP_STORAGE == "epoch"
+
 
 def parse_timestamp(timestamp):
     """Parse a timestamp to a datetime object."""
     if isinstance(timestamp, int):
         return datetime.fromtimestamp(timestamp / 1000.0)
-    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
\ No newline at end of file
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def to_db_timestamp(timestamp: int):
+    """Convert epoch seconds to the value stored in timestamp columns."""
+    if EPOCH_TIMESTAMPS:
+        return timestamp
+    return datetime.fromtimestamp(timestamp)
+
+
+def db_now():
+    """Current time as the value stored in timestamp columns."""
+    if EPOCH_TIMESTAMPS:
+        return int(time.time())
+    return datetime.now()
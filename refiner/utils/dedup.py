@@ -0,0 +1,65 @@
+import hashlib
+import math
+
+from refiner.config import settings
+
+
+def _digest(chat_id, message_id) -> bytes:
+    return hashlib.blake2b(f"{chat_id}:{message_id}".encode(), digest_size=16).digest()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over byte strings using double hashing."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, digest: bytes) -> bool:
+        """Add a 16-byte digest, returning False if it was (probably) present already."""
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        added = False
+        for i in range(self.hash_count):
+            bit = (h1 + i * h2) % self.size
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                added = True
+        return added
+
+
+class MessageDeduplicator:
+    """
+    Remembers which (chat_id, SourceMessageID) pairs have been ingested.
+
+    The "exact" strategy keeps a set of 64-bit digests. The "bloom" strategy
+    keeps a Bloom filter of about 2 bytes per expected message; it never keeps
+    a duplicate, but drops a unique message with probability
+    DEDUP_BLOOM_ERROR_RATE, so it suits submissions too large for the set.
+    """
+
+    def __init__(self, strategy: str = None, capacity: int = None, error_rate: float = None):
+        self.strategy = strategy or settings.DEDUP_MESSAGES
+        self.duplicates = 0
+        if self.strategy == "bloom":
+            self._bloom = BloomFilter(capacity or settings.DEDUP_EXPECTED_MESSAGES,
+                                      error_rate or settings.DEDUP_BLOOM_ERROR_RATE)
+        else:
+            self._seen = set()
+
+    def add(self, chat_id, message_id) -> bool:
+        """Record a message, returning False if it was seen before."""
+        if self.strategy == "off":
+            return True
+        digest = _digest(chat_id, message_id)
+        if self.strategy == "bloom":
+            added = self._bloom.add(digest)
+        else:
+            key = int.from_bytes(digest[:8], "little")
+            added = key not in self._seen
+            self._seen.add(key)
+        if not added:
+            self.duplicates += 1
+        return added
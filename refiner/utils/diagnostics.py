@@ -0,0 +1,81 @@
+import logging
+from collections import Counter
+from typing import Any, Dict, List
+
+from refiner.config import settings
+
+
+class Diagnostics:
+    """
+    Collects per-message events from transformer hot loops. Each category is
+    counted and keeps its first few examples, and a summary is logged once
+    per run instead of a line per message. Examples must identify where an
+    event happened (message ids, type names), never message content.
+    """
+
+    def __init__(self, max_examples: int = None):
+        self.max_examples = settings.DIAGNOSTICS_MAX_EXAMPLES if max_examples is None else max_examples
+        self.counts: Counter = Counter()
+        self.levels: Dict[str, int] = {}
+        self.examples: Dict[str, List[Any]] = {}
+
+    def record(self, category: str, example: Any = None, level: int = logging.INFO, count: int = 1) -> None:
+        """Count an event, keeping a new example if the category has room for more."""
+        self.counts[category] += count
+        if category not in self.levels:
+            self.levels[category] = level
+            self.examples[category] = []
+        examples = self.examples[category]
+        if example is not None and len(examples) < self.max_examples and example not in examples:
+            examples.append(example)
+
+    @classmethod
+    def from_summary(cls, summary: Dict[str, Dict[str, Any]]) -> "Diagnostics":
+        """Rebuild a collector from the output of summary()."""
+        diagnostics = cls()
+        for category, entry in summary.items():
+            diagnostics.counts[category] = entry["count"]
+            diagnostics.levels[category] = logging.getLevelName(entry["level"])
+            diagnostics.examples[category] = list(entry["examples"])
+        return diagnostics
+
+    def merge(self, other: "Diagnostics") -> None:
+        """Add the events of another collector to this one."""
+        for category, count in other.counts.items():
+            self.counts[category] += count
+            self.levels.setdefault(category, other.levels[category])
+            examples = self.examples.setdefault(category, [])
+            examples.extend(other.examples[category][:self.max_examples - len(examples)])
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Counts and examples per category, most frequent first."""
+        return {
+            category: {
+                "level": logging.getLevelName(self.levels[category]),
+                "count": count,
+                "examples": self.examples[category],
+            }
+            for category, count in self.counts.most_common()
+        }
+
+    def log_summary(self) -> None:
+        """Log one line per category."""
+        for category, count in self.counts.most_common():
+            examples = self.examples[category]
+            suffix = f", e.g. {', '.join(map(str, examples))}" if examples else ""
+            logging.log(self.levels[category], f"{category}: {count}{suffix}")
+
+
+class DiagnosticEvents(list):
+    """
+    Events recorded with the same call as Diagnostics.record but kept in
+    order, to be replayed into a Diagnostics later, e.g. by the process that
+    receives them from a worker.
+    """
+
+    def record(self, category: str, example: Any = None, level: int = logging.INFO, count: int = 1) -> None:
+        self.append((category, example, level, count))
+
+    def replay(self, diagnostics: Diagnostics) -> None:
+        for event in self:
+            diagnostics.record(*event)
@@ -1,16 +1,117 @@
 import pgpy
 from pgpy.constants import CompressionAlgorithm, HashAlgorithm
 import os
+from typing import Iterable, Iterator, Optional
 from refiner.config import settings
+from refiner.utils import openpgp
+from refiner.utils.compress import compress, compress_chunks, decompress
 
 
-def encrypt_file(encryption_key: str, file_path: str, output_path: str = None) -> str:
+def encrypt_bytes(encryption_key: str, data: bytes, compression: Optional[str] = None,
+                  compression_level: Optional[int] = None, backend: Optional[str] = None) -> bytes:
+    """Symmetrically encrypts data with an encryption key.
+
+    Args:
+        encryption_key: The passphrase to encrypt with
+        data: The plaintext
+        compression: Codec applied before encryption (defaults to settings.REFINEMENT_COMPRESSION).
+            "pgp" leaves compression to the OpenPGP layer
+        compression_level: Codec level (defaults to settings.REFINEMENT_COMPRESSION_LEVEL)
+        backend: OpenPGP implementation, "native" or "pgpy" (defaults to settings.ENCRYPTION_BACKEND)
+
+    Returns:
+        The ASCII armored OpenPGP message
+    """
+    compression = compression or settings.REFINEMENT_COMPRESSION
+    if compression_level is None:
+        compression_level = settings.REFINEMENT_COMPRESSION_LEVEL
+    backend = backend or settings.ENCRYPTION_BACKEND
+    
+    if compression != "pgp":
+        data = compress(data, compression, compression_level)
+    
+    if backend == "native":
+        pgp_compression = openpgp.COMPRESSION_ZLIB if compression == "pgp" else openpgp.COMPRESSION_UNCOMPRESSED
+        return openpgp.encrypt(data, encryption_key, compression=pgp_compression)
+    
+    pgp_compression = CompressionAlgorithm.ZLIB if compression == "pgp" else CompressionAlgorithm.Uncompressed
+    # Binary literal, as the native backend writes: pgpy would store text-decodable data as text
+    message = pgpy.PGPMessage.new(bytes(data), compression=pgp_compression, format='b')
+    encrypted_message = message.encrypt(
+        passphrase=encryption_key, hash=HashAlgorithm.SHA512
+    )
+    return str(encrypted_message).encode()
+
+
+def encrypt_stream(encryption_key: str, chunks: Iterable[bytes], compression: Optional[str] = None,
+                   compression_level: Optional[int] = None, backend: Optional[str] = None) -> Iterator[bytes]:
+    """Symmetrically encrypts a sequence of chunks, yielding the message as it is encrypted.
+
+    The native backend compresses and encrypts each chunk as it arrives, so
+    neither the whole plaintext nor the whole message need to be in memory.
+    pgpy only encrypts whole messages: with it the chunks are joined and the
+    message is yielded once encrypt_bytes returns.
+
+    Args:
+        encryption_key: The passphrase to encrypt with
+        chunks: The plaintext
+        compression, compression_level, backend: See encrypt_bytes
+
+    Returns:
+        The chunks of the ASCII armored OpenPGP message, which decrypt_bytes decrypts
+    """
+    compression = compression or settings.REFINEMENT_COMPRESSION
+    if compression_level is None:
+        compression_level = settings.REFINEMENT_COMPRESSION_LEVEL
+    backend = backend or settings.ENCRYPTION_BACKEND
+
+    if backend != "native":
+        yield encrypt_bytes(encryption_key, b''.join(chunks), compression, compression_level, backend)
+        return
+
+    if compression != "pgp":
+        chunks = compress_chunks(chunks, compression, compression_level)
+    pgp_compression = openpgp.COMPRESSION_ZLIB if compression == "pgp" else openpgp.COMPRESSION_UNCOMPRESSED
+    yield from openpgp.encrypt_stream(chunks, encryption_key, compression=pgp_compression)
+
+
+def decrypt_bytes(encryption_key: str, encrypted_data: bytes, compression: Optional[str] = None,
+                  backend: Optional[str] = None) -> bytes:
+    """Symmetrically decrypts data encrypted by encrypt_bytes.
+
+    Args:
+        encryption_key: The passphrase to decrypt with
+        encrypted_data: The OpenPGP message
+        compression: Codec the data was compressed with before encryption
+            (defaults to settings.REFINEMENT_COMPRESSION)
+        backend: OpenPGP implementation, "native" or "pgpy" (defaults to settings.ENCRYPTION_BACKEND)
+
+    Returns:
+        The plaintext
+    """
+    if (backend or settings.ENCRYPTION_BACKEND) == "native":
+        buffer = openpgp.decrypt(encrypted_data, encryption_key)
+    else:
+        message = pgpy.PGPMessage.from_blob(encrypted_data)
+        decrypted_message = message.decrypt(encryption_key).message
+        # Text literals of messages written without format='b' are returned as str
+        buffer = decrypted_message.encode('utf-8') if isinstance(decrypted_message, str) else bytes(decrypted_message)
+    compression = compression or settings.REFINEMENT_COMPRESSION
+    if compression != "pgp":
+        buffer = decompress(buffer, compression)
+    return buffer
+
+
+def encrypt_file(encryption_key: str, file_path: str, output_path: str = None,
+                 compression: Optional[str] = None, compression_level: Optional[int] = None,
+                 backend: Optional[str] = None) -> str:
     """Symmetrically encrypts a file with an encryption key.
 
     Args:
         encryption_key: The passphrase to encrypt with
         file_path: Path to the file to encrypt
         output_path: Optional path to save encrypted file (defaults to file_path + .pgp)
+        compression, compression_level, backend: See encrypt_bytes
 
     Returns:
         Path to encrypted file
@@ -21,24 +122,23 @@ def encrypt_file(encryption_key: str, file_path: str, output_path: str = None) -
     with open(file_path, 'rb') as f:
         buffer = f.read()
     
-    message = pgpy.PGPMessage.new(buffer, compression=CompressionAlgorithm.ZLIB)
-    encrypted_message = message.encrypt(
-        passphrase=encryption_key, hash=HashAlgorithm.SHA512
-    )
+    encrypted = encrypt_bytes(encryption_key, buffer, compression, compression_level, backend)
     
     with open(output_path, 'wb') as f:
-        f.write(str(encrypted_message).encode())
+        f.write(encrypted)
     
     return output_path
 
 
-def decrypt_file(encryption_key: str, file_path: str, output_path: str = None) -> str:
+def decrypt_file(encryption_key: str, file_path: str, output_path: str = None,
+                 compression: Optional[str] = None, backend: Optional[str] = None) -> str:
     """Symmetrically decrypts a file with an encryption key.
 
     Args:
         encryption_key: The passphrase to decrypt with
         file_path: Path to the encrypted file
         output_path: Optional path to save decrypted file (defaults to file_path without .pgp)
+        compression, backend: See decrypt_bytes
 
     Returns:
         Path to decrypted file
@@ -52,11 +152,10 @@ def decrypt_file(encryption_key: str, file_path: str, output_path: str = None) -
     with open(file_path, 'rb') as f:
         encrypted_data = f.read()
     
-    message = pgpy.PGPMessage.from_blob(encrypted_data)
-    decrypted_message = message.decrypt(encryption_key)
+    buffer = decrypt_bytes(encryption_key, encrypted_data, compression, backend)
     
     with open(output_path, 'wb') as f:
-        f.write(decrypted_message.message)
+        f.write(buffer)
     
     return output_path
 
@@ -0,0 +1,39 @@
+import json
+import logging
+import os
+import shutil
+import zipfile
+
+from refiner.config import settings
+
+
+def extract_input(input_dir: str = None) -> None:
+    """
+    If the input directory contains any zip files, extract them
+    If there are files with .zip extension that are actually JSON files, rename them to .json
+    :param input_dir: Directory to extract (defaults to settings.INPUT_DIR)
+    :return:
+    """
+    input_dir = input_dir or settings.INPUT_DIR
+    for input_filename in os.listdir(input_dir):
+        input_file = os.path.join(input_dir, input_filename)
+
+        if input_filename.endswith('.zip'):
+            if zipfile.is_zipfile(input_file):
+                with zipfile.ZipFile(input_file, 'r') as zip_ref:
+                    zip_ref.extractall(input_dir)
+                    logging.info(f"Extracted {input_file} to {input_dir}")
+            else:
+                # Check if the file with .zip extension is actually a JSON file
+                try:
+                    with open(input_file, 'r') as f:
+                        json.load(f)  # Try to load as JSON
+                    
+                    # If we get here, it's a valid JSON file
+                    new_filename = os.path.splitext(input_file)[0] + '.json'
+                    shutil.copy2(input_file, new_filename)
+                    logging.info(f"File {input_file} is actually a JSON file. Copied to {new_filename}")
+                except json.JSONDecodeError:
+                    logging.info(f"{input_file} is not a zip file nor a valid JSON file")
+                except Exception as e:
+                    logging.error(f"Error processing {input_file}: {str(e)}")
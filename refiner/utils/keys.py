@@ -0,0 +1,57 @@
+import itertools
+import uuid
+
+from sqlalchemy import func, select
+
+from refiner.config import settings
+
+
+class KeyGenerator:
+    """
+    Generates primary keys in the representation selected by settings.KEY_MODE:
+    36-char UUID strings, 16-byte binary UUIDs or per-table integer sequences.
+
+    One generator can be shared by the databases a submission is split into,
+    so that rows named by key (its user, its submission, a chat) have the
+    same key in every database and integer keys do not repeat across them.
+    """
+
+    def __init__(self, mode: str = None):
+        self.mode = mode or settings.KEY_MODE
+        self._sequences = {}
+        # (table, name) -> key, see key
+        self._named = {}
+
+    def new(self, model) -> object:
+        """Return a new key for the given model class."""
+        if self.mode == "integer":
+            table = model.__tablename__
+            if table not in self._sequences:
+                self._sequences[table] = itertools.count(1)
+            return next(self._sequences[table])
+        if self.mode == "binary":
+            return uuid.uuid4().bytes
+        return str(uuid.uuid4())
+
+    def key(self, model, name=None) -> object:
+        """Return the key of the row of the given model class named name, the same key on every call."""
+        named = (model.__tablename__, name)
+        if named not in self._named:
+            self._named[named] = self.new(model)
+        return self._named[named]
+
+    def adopt(self, model, name, key) -> None:
+        """Name a key read from an existing database, unless the name already has a key."""
+        self._named.setdefault((model.__tablename__, name), key)
+
+    def resume(self, connection, models) -> None:
+        """Continue the integer sequences of models after the largest keys already in the database."""
+        if self.mode != "integer":
+            return
+        for model in models:
+            key_column = model.__mapper__.primary_key[0]
+            last = connection.execute(select(func.max(key_column))).scalar() or 0
+            # A shared generator may already be past the keys of this database
+            current = self._sequences.get(model.__tablename__)
+            start = max(last + 1, next(current)) if current is not None else last + 1
+            self._sequences[model.__tablename__] = itertools.count(start)
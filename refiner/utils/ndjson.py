@@ -0,0 +1,133 @@
+"""
+Line-delimited (NDJSON) submissions.
+
+The first line is a header with the submission fields of a fileDto, and
+every following line is one message in the source's message format, tagged
+with the chat_id of its chat:
+
+    {"revision": "01.01", "source": "telegram", "user": "123", "submission_token": "abc"}
+    {"chat_id": -1001, "id": 1, "date": 1700000000, ...}
+    {"chat_id": -1002, "id": 7, "date": 1700000005, ...}
+
+Messages of different chats may be interleaved. The body is split into
+chunks of whole lines that are processed by a pool of worker processes and
+consumed in file order, with a bounded number of chunks in flight, so memory
+does not grow with the size of the file.
+"""
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Tuple, TypeVar
+
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+HEADER_FIELDS = ('revision', 'source', 'user', 'submission_token')
+
+T = TypeVar('T')
+
+
+class LineDelimitedSubmission(NamedTuple):
+    path: str
+    header: Dict[str, Any]
+    body_offset: int  # Byte offset of the first message line
+
+
+def is_line_delimited(path: str) -> bool:
+    """Whether a file is an NDJSON submission, by its extension."""
+    return os.path.splitext(path)[1].lower() in NDJSON_EXTENSIONS
+
+
+def open_submission(path: str) -> LineDelimitedSubmission:
+    """Read the header line of an NDJSON submission."""
+    with open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        body_offset = f.tell()
+    if not isinstance(header, dict):
+        raise ValueError(f"{path}: the first line must be a JSON object with {', '.join(HEADER_FIELDS)}")
+    missing = [field for field in HEADER_FIELDS if field not in header]
+    if missing:
+        raise ValueError(f"{path}: header line is missing {', '.join(missing)}")
+    return LineDelimitedSubmission(path, header, body_offset)
+
+
+def chunk_ranges(path: str, start: int, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """Split the file from start into (start, end) byte ranges of about chunk_bytes, ending at line ends."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_lines(path: str, start: int, end: int) -> Iterator[Tuple[int, bytes]]:
+    """Yield (byte offset, line) of the non-blank lines between start and end."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    offset = start
+    for line in data.splitlines(keepends=True):
+        if line.strip():
+            yield offset, line
+        offset += len(line)
+
+
+def map_chunks(submission: LineDelimitedSubmission, function: Callable[[str, int, int], T],
+               workers: int, chunk_bytes: int) -> Iterator[T]:
+    """
+    Call function(path, start, end) on every chunk of the submission's body and
+    yield the results in file order. With more than one worker the calls run in
+    worker processes, at most two chunks per worker ahead of the consumer, so
+    function must be picklable (a module level function or a partial of one).
+    """
+    ranges = chunk_ranges(submission.path, submission.body_offset, chunk_bytes)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(ranges) == 1:
+        for start, end in ranges:
+            yield function(submission.path, start, end)
+        return
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        chunks = iter(ranges)
+        for start, end in chunks:
+            pending.append(executor.submit(function, submission.path, start, end))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for start, end in chunks:
+                pending.append(executor.submit(function, submission.path, start, end))
+                break
+            yield result
+
+
+def write_submission_lines(data: Dict[str, Any], path: str) -> str:
+    """Write a fileDto as an NDJSON submission, chat by chat."""
+    with open(path, 'w') as f:
+        f.write(json.dumps({field: data[field] for field in HEADER_FIELDS}) + '\n')
+        for chat in data['chats']:
+            for message in chat['contents']:
+                f.write(json.dumps({'chat_id': chat['chat_id'], **message}) + '\n')
+    return path
+
+
+# Convert a fileDto with: python -m refiner.utils.ndjson input.json output.ndjson
+if __name__ == "__main__":
+    import sys
+
+    with open(sys.argv[1], 'r') as f:
+        file_dto = json.load(f)
+    write_submission_lines(file_dto, sys.argv[2])
+    submission = open_submission(sys.argv[2])
+    lines = sum(1 for start, end in chunk_ranges(sys.argv[2], submission.body_offset, 1 << 16)
+                for _ in read_lines(sys.argv[2], start, end))
+    print(f"Wrote {lines} message lines of {submission.header['source']} to {sys.argv[2]}")
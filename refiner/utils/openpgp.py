@@ -0,0 +1,510 @@
+"""
+Native OpenPGP (RFC 4880) symmetric encryption.
+
+Produces the same message structure as pgpy's PGPMessage.encrypt(passphrase):
+a version 4 symmetric-key encrypted session key packet (iterated and salted
+SHA512 S2K, AES256) followed by a symmetrically encrypted integrity protected
+data packet (with modification detection code) holding an optionally ZLIB
+compressed literal data packet, ASCII armored. encrypt_stream writes the same
+message from a sequence of chunks as they are encrypted, with partial body
+lengths since the length is not known up front. The bulk work is done by the
+`cryptography` package, hashlib and zlib instead of pure Python, so messages
+are interchangeable with pgpy and GnuPG while encrypting much faster.
+"""
+import base64
+import hashlib
+import os
+import re
+import time
+import zlib
+from itertools import chain
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+try:
+    from cryptography.hazmat.decrepit.ciphers.modes import CFB
+except ImportError:
+    from cryptography.hazmat.primitives.ciphers.modes import CFB
+
+# Packet tags
+TAG_SKESK = 3
+TAG_COMPRESSED = 8
+TAG_LITERAL = 11
+TAG_SEIPD = 18
+TAG_MDC = 19
+
+# Algorithm identifiers
+CIPHER_AES256 = 9
+HASH_SHA512 = 10
+S2K_ITERATED_SALTED = 3
+COMPRESSION_UNCOMPRESSED = 0
+COMPRESSION_ZIP = 1
+COMPRESSION_ZLIB = 2
+
+# Coded S2K count byte; 255 hashes 65011712 bytes, as pgpy does
+S2K_COUNT = 255
+
+AES256_KEY_SIZE = 32
+AES_BLOCK_SIZE = 16
+
+ARMOR_LINE_LENGTH = 64
+# Binary bytes per armor line
+ARMOR_LINE_BYTES = ARMOR_LINE_LENGTH // 4 * 3
+ARMOR_BEGIN = b'-----BEGIN PGP MESSAGE-----'
+ARMOR_END = b'-----END PGP MESSAGE-----'
+ARMOR_HEADERS_END = re.compile(rb'\r?\n\r?\n')
+
+# Packet bodies from 4 GiB on are written in partial body lengths of 1 GiB
+DEFINITE_LENGTH_LIMIT = 1 << 32
+PARTIAL_LENGTH_POWER = 30
+# Streamed packets are written in partial body lengths of 1 MiB
+STREAM_PARTIAL_LENGTH_POWER = 20
+
+CRC24_INIT = 0xB704CE
+CRC24_POLY = 0x1864CFB
+
+
+class OpenPGPError(ValueError):
+    """Raised when a message cannot be parsed or decrypted."""
+
+
+def _crc24_table() -> List[int]:
+    table = []
+    for i in range(256):
+        crc = i << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= CRC24_POLY
+        table.append(crc & 0xFFFFFF)
+    return table
+
+
+CRC24_TABLE = _crc24_table()
+# Byte planes of the table, for bytes.translate
+CRC24_PLANES = tuple(bytes((entry >> shift) & 0xFF for entry in CRC24_TABLE) for shift in (16, 8, 0))
+
+
+def _crc24_mulmod(a: int, b: int) -> int:
+    """Multiply two polynomials over GF(2) modulo the CRC24 polynomial."""
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0x1000000:
+            a ^= CRC24_POLY
+    return result
+
+
+def _crc24_shift(crc: int, length: int) -> int:
+    """Register value after feeding length zero bytes to a CRC24 register holding crc."""
+    power, base, exponent = 1, 2, 8 * length
+    while exponent:
+        if exponent & 1:
+            power = _crc24_mulmod(power, base)
+        base = _crc24_mulmod(base, base)
+        exponent >>= 1
+    return _crc24_mulmod(crc, power)
+
+
+def _crc24_update(crc: int, data: bytes) -> int:
+    table = CRC24_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ byte]
+    return crc
+
+
+def _crc24_lanes(data: bytes, lanes: int) -> int:
+    """
+    Zero-initialized CRC24 of data, whose length is a multiple of lanes.
+
+    The data is cut into `lanes` chunks whose registers are advanced together,
+    one column of bytes at a time, with each register byte held in a plane of
+    big integers and the table lookup done by bytes.translate. The chunk CRCs
+    are then combined, as CRC(A || B) = CRC(A) * x^(8 * len(B)) + CRC(B).
+    """
+    length = len(data) // lanes
+    high_plane, mid_plane, low_plane = CRC24_PLANES
+    high = mid = low = 0
+    for column in range(length):
+        index = (high ^ int.from_bytes(data[column::length], 'big')).to_bytes(lanes, 'big')
+        high = mid ^ int.from_bytes(index.translate(high_plane), 'big')
+        mid = low ^ int.from_bytes(index.translate(mid_plane), 'big')
+        low = int.from_bytes(index.translate(low_plane), 'big')
+
+    # Multiplication by x^(8 * length) is linear, so tabulate it per register byte
+    shift = _crc24_shift(1, length)
+    by_byte = [[_crc24_mulmod(value << (8 * position), shift) for value in range(256)] for position in range(3)]
+    shift_low, shift_mid, shift_high = by_byte
+
+    crc = 0
+    for crc_high, crc_mid, crc_low in zip(high.to_bytes(lanes, 'big'), mid.to_bytes(lanes, 'big'),
+                                          low.to_bytes(lanes, 'big')):
+        crc = (shift_low[crc & 0xFF] ^ shift_mid[(crc >> 8) & 0xFF] ^ shift_high[crc >> 16]) \
+            ^ (crc_high << 16 | crc_mid << 8 | crc_low)
+    return crc
+
+
+def crc24(data: bytes, lanes: int = 1 << 14, crc: int = CRC24_INIT) -> int:
+    """
+    OpenPGP ASCII armor checksum (RFC 4880 section 6.1). Pass the checksum of
+    the preceding data as crc to continue it over data.
+    """
+    data = bytes(data)
+    lanes = min(lanes, len(data) // 256)
+    if lanes < 16:
+        return _crc24_update(crc, data)
+
+    # A preloaded register is equivalent to a zero one plus the init value shifted past the data
+    head = len(data) % lanes
+    body_crc = _crc24_lanes(data[head:] if head else data, lanes)
+    head_crc = _crc24_update(0, data[:head])
+    return (_crc24_shift(head_crc, len(data) - head) ^ body_crc ^ _crc24_shift(crc, len(data))) & 0xFFFFFF
+
+
+def _length_header(length: int) -> bytes:
+    """New format definite body length."""
+    if length < 192:
+        return bytes([length])
+    if length < 8384:
+        length -= 192
+        return bytes([(length >> 8) + 192, length & 0xFF])
+    return b'\xff' + length.to_bytes(4, 'big')
+
+
+def _packet_header(tag: int, length: int) -> bytes:
+    """New format packet header with a definite length."""
+    return bytes([0xC0 | tag]) + _length_header(length)
+
+
+def _packet(tag: int, body: List[bytes]) -> List[bytes]:
+    """
+    Header and body chunks of a new format packet. Bodies too long for a
+    definite length are cut into partial body lengths of PARTIAL_LENGTH_POWER
+    (RFC 4880 section 4.2.2.4), the last chunk having a definite length.
+    """
+    length = sum(len(part) for part in body)
+    if length < DEFINITE_LENGTH_LIMIT:
+        return [_packet_header(tag, length), *body]
+    chunk_size = 1 << PARTIAL_LENGTH_POWER
+    chunks = [bytes([0xC0 | tag])]
+    remaining, chunk_left = length, 0
+    for part in body:
+        view = memoryview(part)
+        while view:
+            if not chunk_left:
+                if remaining > chunk_size:
+                    chunks.append(bytes([224 + PARTIAL_LENGTH_POWER]))
+                    chunk_left = chunk_size
+                else:
+                    chunks.append(_length_header(remaining))
+                    chunk_left = remaining
+            taken = min(chunk_left, len(view))
+            chunks.append(view[:taken])
+            view = view[taken:]
+            chunk_left -= taken
+            remaining -= taken
+    return chunks
+
+
+def _partial_packet(tag: int, body: Iterable[bytes], power: Optional[int] = None) -> Iterator[bytes]:
+    """
+    A new format packet whose body is yielded in partial body lengths of
+    `power` (STREAM_PARTIAL_LENGTH_POWER by default) as the chunks of body
+    arrive, the rest having a definite length once body is exhausted.
+    """
+    chunk_size = 1 << (STREAM_PARTIAL_LENGTH_POWER if power is None else power)
+    partial_header = bytes([224 + chunk_size.bit_length() - 1])
+    yield bytes([0xC0 | tag])
+    pending = bytearray()
+    for part in body:
+        pending += part
+        # Keep at least a byte back, so the definite length that ends the packet is not empty
+        if len(pending) > chunk_size:
+            view = memoryview(pending)
+            offset = 0
+            while len(pending) - offset > chunk_size:
+                yield partial_header + view[offset:offset + chunk_size]
+                offset += chunk_size
+            view.release()
+            del pending[:offset]
+    yield _length_header(len(pending)) + pending
+
+
+def _s2k_count(coded: int) -> int:
+    return (16 + (coded & 15)) << ((coded >> 4) + 6)
+
+
+def _s2k_key(passphrase: bytes, salt: bytes, coded_count: int, hash_name: str, key_size: int) -> bytes:
+    """Iterated and salted S2K (RFC 4880 section 3.7.1.3)."""
+    material = salt + passphrase
+    count = max(_s2k_count(coded_count), len(material))
+    key = b''
+    preload = 0
+    while len(key) < key_size:
+        digest = hashlib.new(hash_name)
+        digest.update(b'\x00' * preload)
+        repeats, remainder = divmod(count, len(material))
+        # Hash in large blocks rather than one copy of the material at a time
+        block_repeats = max(1, (1 << 20) // len(material))
+        block = material * block_repeats
+        for _ in range(repeats // block_repeats):
+            digest.update(block)
+        digest.update(material * (repeats % block_repeats))
+        digest.update(material[:remainder])
+        key += digest.digest()
+        preload += 1
+    return key[:key_size]
+
+
+def _cfb(key: bytes, decrypt: bool = False):
+    """AES CFB with a zero IV, as used by SKESK and SEIPD packets."""
+    cipher = Cipher(algorithms.AES(key), CFB(b'\x00' * AES_BLOCK_SIZE))
+    return cipher.decryptor() if decrypt else cipher.encryptor()
+
+
+def _literal_packet(data: bytes, mtime: int) -> List[bytes]:
+    # Binary format, no filename, modification time
+    return _packet(TAG_LITERAL, [b'b\x00' + mtime.to_bytes(4, 'big'), data])
+
+
+def _session_key_packet(passphrase: str) -> Tuple[bytes, bytes]:
+    """A random session key and the session key packet that encrypts it with the passphrase."""
+    salt = os.urandom(8)
+    s2k_key = _s2k_key(passphrase.encode('utf-8'), salt, S2K_COUNT, 'sha512', AES256_KEY_SIZE)
+    session_key = os.urandom(AES256_KEY_SIZE)
+    encryptor = _cfb(s2k_key)
+    encrypted_session_key = encryptor.update(bytes([CIPHER_AES256]) + session_key) + encryptor.finalize()
+    skesk_body = bytes([4, CIPHER_AES256, S2K_ITERATED_SALTED, HASH_SHA512]) + salt + bytes([S2K_COUNT]) \
+        + encrypted_session_key
+    return session_key, _packet_header(TAG_SKESK, len(skesk_body)) + skesk_body
+
+
+def _encrypted_data(session_key: bytes, parts: Iterable[bytes]) -> Iterator[bytes]:
+    """Body of the SEIPD packet holding parts, encrypted as they arrive."""
+    # Random prefix with its last two bytes repeated, the data, then the MDC packet over all of it
+    prefix = os.urandom(AES_BLOCK_SIZE)
+    prefix += prefix[-2:]
+    mdc_header = bytes([0xC0 | TAG_MDC, 20])
+    mdc = hashlib.sha1(prefix)
+    encryptor = _cfb(session_key)
+    yield b'\x01' + encryptor.update(prefix)
+    for part in parts:
+        mdc.update(part)
+        yield encryptor.update(part)
+    mdc.update(mdc_header)
+    yield encryptor.update(mdc_header + mdc.digest()) + encryptor.finalize()
+
+
+def encrypt(data: bytes, passphrase: str, compression: int = COMPRESSION_ZLIB, armor: bool = True) -> bytes:
+    """
+    Symmetrically encrypt data into an OpenPGP message.
+
+    Args:
+        data: Plaintext, stored as a binary literal data packet
+        passphrase: The passphrase to encrypt with
+        compression: COMPRESSION_ZLIB or COMPRESSION_UNCOMPRESSED
+        armor: Return an ASCII armored message rather than binary packets
+
+    Returns:
+        The encrypted message
+    """
+    literal = _literal_packet(data, int(time.time()))
+    if compression == COMPRESSION_ZLIB:
+        compressor = zlib.compressobj()
+        compressed = [compressor.compress(chunk) for chunk in literal]
+        compressed.append(compressor.flush())
+        parts = _packet(TAG_COMPRESSED, [bytes([COMPRESSION_ZLIB]), *compressed])
+    elif compression == COMPRESSION_UNCOMPRESSED:
+        parts = literal
+    else:
+        raise OpenPGPError(f"Unsupported compression algorithm {compression}")
+
+    session_key, skesk = _session_key_packet(passphrase)
+    message = b''.join([skesk, *_packet(TAG_SEIPD, list(_encrypted_data(session_key, parts)))])
+    return armor_message(message) if armor else message
+
+
+def encrypt_stream(chunks: Iterable[bytes], passphrase: str, compression: int = COMPRESSION_ZLIB,
+                   armor: bool = True) -> Iterator[bytes]:
+    """
+    Symmetrically encrypt a sequence of chunks into an OpenPGP message,
+    yielding the message as it is encrypted rather than once it is complete.
+
+    The literal, compressed and encrypted data packets are written with
+    partial body lengths of STREAM_PARTIAL_LENGTH_POWER, so at most a few of
+    those are buffered whatever the length of the data.
+
+    Args:
+        chunks: Plaintext, stored as one binary literal data packet
+        passphrase, compression, armor: See encrypt
+    """
+    if compression not in (COMPRESSION_ZLIB, COMPRESSION_UNCOMPRESSED):
+        raise OpenPGPError(f"Unsupported compression algorithm {compression}")
+    session_key, skesk = _session_key_packet(passphrase)
+    return _stream_message(skesk, session_key, chunks, compression, armor)
+
+
+def _zlib_stream(parts: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj()
+    for part in parts:
+        yield compressor.compress(part)
+    yield compressor.flush()
+
+
+def _stream_message(skesk: bytes, session_key: bytes, chunks: Iterable[bytes], compression: int,
+                    armor: bool) -> Iterator[bytes]:
+    parts = _partial_packet(TAG_LITERAL, chain([b'b\x00' + int(time.time()).to_bytes(4, 'big')], chunks))
+    if compression == COMPRESSION_ZLIB:
+        parts = _partial_packet(TAG_COMPRESSED, chain([bytes([COMPRESSION_ZLIB])], _zlib_stream(parts)))
+    message = chain([skesk], _partial_packet(TAG_SEIPD, _encrypted_data(session_key, parts)))
+    return armor_stream(message) if armor else message
+
+
+def armor_message(message: bytes) -> bytes:
+    """ASCII armor a binary OpenPGP message, in the layout pgpy writes."""
+    encoded = base64.b64encode(message)
+    lines = b'\n'.join(encoded[i:i + ARMOR_LINE_LENGTH] for i in range(0, len(encoded), ARMOR_LINE_LENGTH))
+    checksum = base64.b64encode(crc24(message).to_bytes(3, 'big'))
+    return b'-----BEGIN PGP MESSAGE-----\n\n' + lines + b'\n=' + checksum + b'\n-----END PGP MESSAGE-----\n'
+
+
+def armor_stream(message: Iterable[bytes]) -> Iterator[bytes]:
+    """ASCII armor a binary OpenPGP message given in chunks, as armor_message does, a few lines at a time."""
+    yield ARMOR_BEGIN + b'\n\n'
+    checksum = CRC24_INIT
+    pending = bytearray()
+    for part in message:
+        pending += part
+        # Whole lines, keeping the last one back as armor_message does not end on an empty line
+        whole = (len(pending) - 1) // ARMOR_LINE_BYTES * ARMOR_LINE_BYTES
+        if whole > 0:
+            block = bytes(pending[:whole])
+            del pending[:whole]
+            checksum = crc24(block, crc=checksum)
+            encoded = base64.b64encode(block)
+            yield b''.join(encoded[i:i + ARMOR_LINE_LENGTH] + b'\n' for i in range(0, whole // 3 * 4, ARMOR_LINE_LENGTH))
+    checksum = crc24(pending, crc=checksum)
+    yield base64.b64encode(pending) + b'\n=' + base64.b64encode(checksum.to_bytes(3, 'big')) + b'\n' + ARMOR_END + b'\n'
+
+
+def dearmor_message(blob: bytes) -> bytes:
+    """Return the binary packets of an ASCII armored (or already binary) message."""
+    begin = blob.find(ARMOR_BEGIN, 0, 1024)
+    if begin < 0:
+        return blob
+    # Armor headers end at the first empty line
+    header_end = ARMOR_HEADERS_END.search(blob, begin)
+    end = blob.rfind(ARMOR_END)
+    checksum = blob.rfind(b'\n=', 0, end)
+    if header_end is None or end < 0 or checksum < header_end.end():
+        raise OpenPGPError("Malformed ASCII armor")
+    message = base64.b64decode(blob[header_end.end():checksum].translate(None, b'\r\n \t'))
+    expected = int.from_bytes(base64.b64decode(blob[checksum + 2:checksum + 6]), 'big')
+    if crc24(message) != expected:
+        raise OpenPGPError("ASCII armor checksum mismatch")
+    return message
+
+
+def _read_packets(data: bytes) -> Iterable[Tuple[int, bytes]]:
+    """Yield (tag, body) of the packets in data, in old or new format."""
+    view = memoryview(data)
+    offset = 0
+    while offset < len(data):
+        header = data[offset]
+        if not header & 0x80:
+            raise OpenPGPError(f"Invalid packet header at offset {offset}")
+        offset += 1
+        if header & 0x40:
+            tag = header & 0x3F
+            chunks = []
+            while True:
+                first = data[offset]
+                if first < 192:
+                    length, offset = first, offset + 1
+                elif first < 224:
+                    length, offset = ((first - 192) << 8) + data[offset + 1] + 192, offset + 2
+                elif first == 255:
+                    length, offset = int.from_bytes(data[offset + 1:offset + 5], 'big'), offset + 5
+                else:
+                    # Partial body length, more chunks follow
+                    length = 1 << (first & 0x1F)
+                    chunks.append(view[offset + 1:offset + 1 + length])
+                    offset += 1 + length
+                    continue
+                chunks.append(view[offset:offset + length])
+                offset += length
+                break
+            body = bytes(chunks[0]) if len(chunks) == 1 else b''.join(chunks)
+        else:
+            tag, length_type = (header >> 2) & 0x0F, header & 0x03
+            if length_type == 3:
+                length = len(data) - offset
+            else:
+                size = 1 << length_type
+                length = int.from_bytes(data[offset:offset + size], 'big')
+                offset += size
+            body = bytes(view[offset:offset + length])
+            offset += length
+        yield tag, body
+
+
+def _unpack_plaintext(data: bytes) -> bytes:
+    """Return the contents of the literal data packet in (possibly compressed) packets."""
+    for tag, body in _read_packets(data):
+        if tag == TAG_COMPRESSED:
+            algorithm, compressed = body[0], body[1:]
+            if algorithm == COMPRESSION_UNCOMPRESSED:
+                return _unpack_plaintext(compressed)
+            if algorithm == COMPRESSION_ZIP:
+                return _unpack_plaintext(zlib.decompress(compressed, -15))
+            if algorithm == COMPRESSION_ZLIB:
+                return _unpack_plaintext(zlib.decompress(compressed))
+            raise OpenPGPError(f"Unsupported compression algorithm {algorithm}")
+        if tag == TAG_LITERAL:
+            filename_length = body[1]
+            return body[2 + filename_length + 4:]
+    raise OpenPGPError("No literal data packet found")
+
+
+def decrypt(message: bytes, passphrase: str) -> bytes:
+    """
+    Decrypt a passphrase encrypted OpenPGP message (armored or binary).
+
+    Only the combination written by encrypt and pgpy is supported: SKESK v4
+    with an iterated and salted S2K and an AES session key, and a SEIPD packet.
+    """
+    session_key: Optional[bytes] = None
+    for tag, body in _read_packets(dearmor_message(message)):
+        if tag == TAG_SKESK:
+            version, cipher_algorithm, s2k_type = body[0], body[1], body[2]
+            if version != 4 or s2k_type != S2K_ITERATED_SALTED:
+                raise OpenPGPError(f"Unsupported session key packet (version {version}, S2K {s2k_type})")
+            hash_name = {2: 'sha1', 8: 'sha256', 9: 'sha384', 10: 'sha512', 11: 'sha224'}.get(body[3])
+            if hash_name is None or cipher_algorithm not in (7, 8, 9):
+                raise OpenPGPError("Unsupported S2K hash or cipher")
+            key_size = {7: 16, 8: 24, 9: 32}[cipher_algorithm]
+            key = _s2k_key(passphrase.encode('utf-8'), body[4:12], body[12], hash_name, key_size)
+            encrypted_session_key = body[13:]
+            if encrypted_session_key:
+                decryptor = _cfb(key, decrypt=True)
+                decrypted = decryptor.update(encrypted_session_key) + decryptor.finalize()
+                session_key = decrypted[1:]
+            else:
+                session_key = key
+        elif tag == TAG_SEIPD:
+            if session_key is None:
+                raise OpenPGPError("Encrypted data without a session key packet")
+            if body[0] != 1:
+                raise OpenPGPError(f"Unsupported encrypted data packet version {body[0]}")
+            decryptor = _cfb(session_key, decrypt=True)
+            plaintext = decryptor.update(memoryview(body)[1:]) + decryptor.finalize()
+            if plaintext[AES_BLOCK_SIZE - 2:AES_BLOCK_SIZE] != plaintext[AES_BLOCK_SIZE:AES_BLOCK_SIZE + 2]:
+                raise OpenPGPError("Wrong passphrase")
+            if plaintext[-22:-20] != bytes([0xC0 | TAG_MDC, 20]) \
+                    or hashlib.sha1(memoryview(plaintext)[:-20]).digest() != plaintext[-20:]:
+                raise OpenPGPError("Modification detection code mismatch")
+            return _unpack_plaintext(plaintext[AES_BLOCK_SIZE + 2:-22])
+    raise OpenPGPError("No encrypted data packet found")
@@ -0,0 +1,233 @@
+"""
+Multi-part submissions.
+
+A producer may split a large export into several fileDto or NDJSON parts,
+for example one per chat or per page of messages. Input files with the same
+source, user and submission_token are parts of one submission: they are
+refined into one user, one submission and one SubmissionChats row per
+chat_id, whatever the number and order of the parts. A chat may span parts.
+"""
+import codecs
+import json
+from typing import IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from refiner.utils.ndjson import LineDelimitedSubmission, is_line_delimited, open_submission
+
+# Top-level key of a fileDto that follows the submission fields
+CHATS_KEY = 'chats'
+
+JSON_WHITESPACE = ' \t\n\r'
+# Characters that may follow a key or value of an object member or an array element
+MEMBER_DELIMITERS = JSON_WHITESPACE + ':,}]'
+
+
+class SubmissionParts(NamedTuple):
+    header: Dict[str, Any]  # Submission fields of the first part
+    # Parts in input order, fileDto dicts or NDJSON submissions, possibly loaded lazily
+    parts: Iterable[Union[Dict[str, Any], LineDelimitedSubmission]]
+
+
+class _MemberScanner:
+    """
+    Reads the members of the top-level object of a JSON file one at a time,
+    reading the file only as far as the members read so far.
+    """
+
+    def __init__(self, f: IO[bytes], chunk_bytes: int):
+        self.f = f
+        self.chunk_bytes = chunk_bytes
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def _read(self, size: int = None) -> bool:
+        """
+        Append size bytes of the file to the buffer, by default at least as
+        many as it holds, so values are parsed a bounded number of times.
+        """
+        if self.eof:
+            return False
+        chunk = self.f.read(max(self.chunk_bytes, len(self.buffer) - self.position) if size is None else size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:] + self.text.decode(chunk, final=self.eof)
+        self.position = 0
+        return True
+
+    def read_rest(self) -> None:
+        """Buffer the rest of the file, for a value that spans most of it."""
+        self._read(-1)
+        self._read()
+
+    def next_char(self) -> str:
+        """Consume and return the next character that is not whitespace, '' at the end of the file."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in JSON_WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                self.position += 1
+                return self.buffer[self.position - 1]
+            if not self._read():
+                return ''
+
+    def value(self) -> Any:
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in JSON_WHITESPACE:
+                self.position += 1
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A number cut off at the end of the buffer, like 1. of 1.5, parses too
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in MEMBER_DELIMITERS):
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._read()
+
+
+def read_header(path: str, chunk_bytes: int = 4096) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    Submission fields (source, user, submission_token, ...) of a fileDto or
+    NDJSON submission, and the parsed fileDto if it had to be parsed whole.
+
+    The top-level members of a fileDto are read one at a time, chunk_bytes at
+    a time, and reading stops at its chats when the user was read before them,
+    as producers write them. Otherwise the chats are parsed too and the whole
+    document is returned, so it need not be parsed again.
+    """
+    if is_line_delimited(path):
+        return open_submission(path).header, None
+    with open(path, 'rb') as f:
+        scanner = _MemberScanner(f, chunk_bytes)
+        if scanner.next_char() != '{':
+            raise ValueError(f"{path}: a fileDto must be a JSON object")
+        document: Dict[str, Any] = {}
+        delimiter = scanner.next_char()
+        if delimiter == '}':
+            return document, document
+        scanner.position -= 1
+        while delimiter != '}':
+            key = scanner.value()
+            if not isinstance(key, str) or scanner.next_char() != ':':
+                raise ValueError(f"{path}: invalid member of the fileDto object")
+            if key == CHATS_KEY:
+                if 'user' in document:
+                    return document, None
+                scanner.read_rest()
+            document[key] = scanner.value()
+            delimiter = scanner.next_char()
+            if delimiter not in ',}':
+                raise ValueError(f"{path}: expected ',' or '}}' after the {key} member of the fileDto object")
+    return {key: value for key, value in document.items() if key != CHATS_KEY}, document
+
+
+def _members(scanner: _MemberScanner, path: str, what: str) -> Iterator[str]:
+    """
+    Keys of the object whose '{' was just read. Each value is read by the
+    caller before the next key is taken.
+    """
+    if scanner.next_char() == '}':
+        return
+    scanner.position -= 1
+    while True:
+        key = scanner.value()
+        if not isinstance(key, str) or scanner.next_char() != ':':
+            raise ValueError(f"{path}: invalid member of {what}")
+        yield key
+        delimiter = scanner.next_char()
+        if delimiter == '}':
+            return
+        if delimiter != ',':
+            raise ValueError(f"{path}: expected ',' or '}}' after the {key} member of {what}")
+
+
+def _elements(scanner: _MemberScanner, path: str, what: str) -> Iterator[None]:
+    """
+    Step through the array whose '[' was just read. Each element is read by
+    the caller before the next step.
+    """
+    if scanner.next_char() == ']':
+        return
+    scanner.position -= 1
+    while True:
+        yield
+        delimiter = scanner.next_char()
+        if delimiter == ']':
+            return
+        if delimiter != ',':
+            raise ValueError(f"{path}: expected ',' or ']' after an element of {what}")
+
+
+def _opens(scanner: _MemberScanner, bracket: str) -> bool:
+    """Read the bracket if the next value starts with it, otherwise leave the value to be read."""
+    if scanner.next_char() == bracket:
+        return True
+    scanner.position -= 1
+    return False
+
+
+def _chat_messages(scanner: _MemberScanner, path: str, chat: Dict[str, Any]) -> Iterator[Any]:
+    """Read the members of the chat whose '{' was just read into chat, yielding its messages."""
+    pending: List[Any] = []
+    for member in _members(scanner, path, "a chat"):
+        if member != 'contents':
+            chat[member] = scanner.value()
+        elif 'chat_id' in chat and _opens(scanner, '['):
+            for _ in _elements(scanner, path, "the contents of a chat"):
+                yield scanner.value()
+        else:
+            # Messages that precede the chat_id are held until it is read
+            pending = scanner.value() or []
+    yield from pending
+
+
+def read_chats(path: str, chunk_bytes: int = 1 << 16) -> Iterator[Tuple[Dict[str, Any], Iterator[Any]]]:
+    """
+    (chat, messages) for each chat of a fileDto, reading the file chunk_bytes
+    at a time and parsing one message at a time instead of the whole document.
+
+    The chat's members other than contents are read into chat as messages is
+    consumed: its chat_id is set by the time its first message is yielded,
+    and the other members once messages is exhausted. Like itertools.groupby,
+    the messages of a chat are skipped if they were not consumed before the
+    next chat is taken.
+    """
+    with open(path, 'rb') as f:
+        scanner = _MemberScanner(f, chunk_bytes)
+        if scanner.next_char() != '{':
+            raise ValueError(f"{path}: a fileDto must be a JSON object")
+        for key in _members(scanner, path, "the fileDto object"):
+            if key != CHATS_KEY or not _opens(scanner, '['):
+                scanner.value()
+                continue
+            for _ in _elements(scanner, path, "the chats"):
+                if not _opens(scanner, '{'):
+                    raise ValueError(f"{path}: a chat must be a JSON object")
+                chat: Dict[str, Any] = {}
+                messages = _chat_messages(scanner, path, chat)
+                yield chat, messages
+                for _ in messages:
+                    pass
+
+
+def part_key(header: Dict[str, Any]) -> Tuple[Any, str, Any]:
+    """Key shared by the parts of one submission."""
+    return header.get('source'), str(header.get('user')), header.get('submission_token')
+
+
+def assemble_parts(parts: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    One fileDto from the fileDto parts of a submission: the submission fields
+    of the first part, and the messages of each chat_id in part order.
+    """
+    assembled: Dict[str, Any] = {}
+    chats: Dict[Any, List[Any]] = {}
+    for part in parts:
+        if not assembled:
+            assembled = {key: value for key, value in part.items() if key != 'chats'}
+        for chat in part.get('chats') or []:
+            chats.setdefault(chat['chat_id'], []).extend(chat.get('contents') or [])
+    assembled['chats'] = [{'chat_id': chat_id, 'contents': contents} for chat_id, contents in chats.items()]
+    return assembled
@@ -0,0 +1,149 @@
+"""
+Sampling profiler for refinements of private inputs that cannot be shared.
+
+With PROFILE=true, a background thread samples the Python stacks of every
+thread of the refining process every PROFILE_INTERVAL_MS and
+profile.folded is written next to output.json, in the collapsed stack
+format read by flamegraph.pl, speedscope and similar tools:
+
+    MainThread;run (refiner/__main__.py:16);transform (refiner/refine.py:89);... 42
+
+Frames are function names with the file and first line of the function,
+relative to the sys.path entry they were imported from. No arguments,
+variables or other values are read, so the profile holds code locations
+and sample counts only.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from refiner.config import settings
+
+PROFILE_FILENAME = "profile.folded"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads but its own at a fixed interval. A
+    sample costs a walk of the frames up to the thread roots, labels are
+    derived once per code object when the profile is written.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        # (thread name, code objects from the root) -> samples
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[object, str] = {}
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="refiner-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                self.stacks[(names.get(ident, "thread"), tuple(codes))] += 1
+            self.samples += 1
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            label = f"{name} ({_relative_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def folded(self) -> Iterator[Tuple[str, int]]:
+        """Collapsed stacks, root first and frames joined by ';', with their sample counts."""
+        lines: Counter = Counter()
+        for (thread, codes), count in self.stacks.items():
+            lines[";".join([thread] + [self._label(code) for code in codes])] += count
+        return iter(sorted(lines.items()))
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as f:
+            for stack, count in self.folded():
+                f.write(f"{stack} {count}\n")
+
+
+def _relative_path(filename: str) -> str:
+    """A source file relative to the longest sys.path entry containing it, so no local paths are written."""
+    filename = os.path.abspath(filename) if not filename.startswith("<") else filename
+    best = ""
+    for entry in sys.path:
+        entry = os.path.abspath(entry or os.curdir)
+        if filename.startswith(entry + os.sep) and len(entry) > len(best):
+            best = entry
+    return os.path.relpath(filename, best) if best else os.path.basename(filename)
+
+
+@contextmanager
+def profiled(output_dir: str, enabled: bool = None, interval_ms: float = None):
+    """
+    Profile the block when PROFILE is set, writing output_dir/profile.folded
+    when it exits, also when it raises. Only the calling process is sampled,
+    not the worker processes it starts.
+    """
+    enabled = settings.PROFILE if enabled is None else enabled
+    if not enabled:
+        yield None
+        return
+    profiler = SamplingProfiler((interval_ms or settings.PROFILE_INTERVAL_MS) / 1000)
+    started = time.perf_counter()
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, PROFILE_FILENAME)
+        profiler.write(path)
+        logging.info(f"Wrote {profiler.samples} profile samples over {time.perf_counter() - started:.2f}s to {path}")
+
+
+def top_functions(path: str, limit: int = 20) -> Iterator[Tuple[str, int, int]]:
+    """(frame, self samples, total samples) of the frames of a collapsed profile with the most self samples."""
+    own: Counter = Counter()
+    total: Counter = Counter()
+    with open(path, 'r') as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += int(count)
+            for frame in set(frames):
+                total[frame] += int(count)
+    for frame, count in own.most_common(limit):
+        yield frame, count, total[frame]
+
+
+# Run with: python -m refiner.utils.profiler output/profile.folded
+if __name__ == "__main__":
+    print(f"{'self':>8}{'total':>8}  function")
+    for frame, own_samples, total_samples in top_functions(sys.argv[1]):
+        print(f"{own_samples:>8}{total_samples:>8}  {frame}")
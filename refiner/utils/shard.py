@@ -0,0 +1,168 @@
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import func, literal_column, select, update
+
+from refiner.models.refined import NORMALIZED_MESSAGES, ChatMessages, Senders, SubmissionChats
+from refiner.utils.pii import mask_pii
+
+
+class Shard(NamedTuple):
+    data: Dict[str, Any]
+    # Coverage of the split input, replaced by that of the written rows, see written_coverage
+    chat_ids: List[str]
+    first_message_date: Optional[int]
+    last_message_date: Optional[int]
+    message_count: int
+
+
+def _make_shard(input_data: Dict[str, Any], chats: List[Dict[str, Any]]) -> Shard:
+    data = {key: value for key, value in input_data.items() if key != 'chats'}
+    data['chats'] = chats
+    dates = [msg['date'] for chat in chats for msg in chat['contents'] if msg.get('date')]
+    return Shard(
+        data=data,
+        chat_ids=[str(chat['chat_id']) for chat in chats],
+        first_message_date=min(dates) if dates else None,
+        last_message_date=max(dates) if dates else None,
+        message_count=sum(len(chat['contents']) for chat in chats),
+    )
+
+
+def split_by_chat(input_data: Dict[str, Any], max_messages: int) -> List[Shard]:
+    """
+    Pack whole chats into shards of at most max_messages messages.
+    A chat larger than max_messages gets a shard of its own.
+    """
+    groups, current, current_size = [], [], 0
+    for chat in input_data['chats']:
+        size = len(chat['contents'])
+        if current and current_size + size > max_messages:
+            groups.append(current)
+            current, current_size = [], 0
+        current.append(chat)
+        current_size += size
+    if current or not groups:
+        groups.append(current)
+    return [_make_shard(input_data, chats) for chats in groups]
+
+
+def split_by_month(input_data: Dict[str, Any]) -> List[Shard]:
+    """Split messages into one shard per calendar month (UTC) of their date."""
+    months: Dict[tuple, Dict[Any, list]] = {}
+    # Chat fields other than contents are kept in every shard of the chat
+    chats: Dict[Any, Dict[str, Any]] = {}
+    empty_chats = []
+    for chat in input_data['chats']:
+        chats.setdefault(chat['chat_id'], chat)
+        if not chat['contents']:
+            empty_chats.append({**chat, 'contents': []})
+        for msg in chat['contents']:
+            month = time.gmtime(msg.get('date') or 0)[:2]
+            months.setdefault(month, {}).setdefault(chat['chat_id'], []).append(msg)
+
+    groups = [
+        [{**chats[chat_id], 'contents': contents} for chat_id, contents in months[month].items()]
+        for month in sorted(months)
+    ] or [[]]
+    groups[0].extend(empty_chats)
+    return [_make_shard(input_data, chats) for chats in groups]
+
+
+def split_submission(input_data: Dict[str, Any], by: str, max_messages: int) -> List[Shard]:
+    """
+    Split a raw fileDto submission into shards that are refined into separate databases.
+
+    Args:
+        input_data: Dictionary containing the JSON data
+        by: "chat" to pack whole chats up to max_messages per shard, "month" for one shard per month
+        max_messages: Message budget per shard when splitting by chat
+
+    Returns:
+        List of shards, each holding a fileDto payload and its chat and date coverage
+    """
+    if by == "chat":
+        return split_by_chat(input_data, max_messages)
+    if by == "month":
+        return split_by_month(input_data)
+    raise ValueError(f"Unknown shard mode '{by}'")
+
+
+def _epoch(value: Any) -> Optional[int]:
+    """Epoch seconds of a timestamp column value."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+def written_coverage(engine) -> Dict[str, Any]:
+    """
+    Manifest coverage of a shard database from the rows written to it, after
+    filtering and deduplication: its chats, message date range and count.
+    """
+    with engine.connect() as connection:
+        chat_ids = [chat_id for (chat_id,) in connection.execute(
+            select(SubmissionChats.SourceChatID).order_by(literal_column('rowid'))
+        )]
+        count, first, last = connection.execute(
+            select(func.count(), func.min(ChatMessages.MessageDate), func.max(ChatMessages.MessageDate))
+        ).one()
+    return {
+        'chat_ids': chat_ids,
+        'first_message_date': _epoch(first),
+        'last_message_date': _epoch(last),
+        'message_count': count,
+    }
+
+
+def settle_chat_statistics(engines: Iterable) -> None:
+    """
+    Set the SubmissionChats statistics of each chat written to several shard
+    databases to those of all its messages, in every one of them. Participants
+    are counted from the masked sender IDs, without unknown senders.
+    """
+    engines = list(engines)
+    if NORMALIZED_MESSAGES:
+        sender = Senders.SenderID
+        messages = ChatMessages.__table__.join(Senders, Senders.SenderKey == ChatMessages.SenderKey)
+    else:
+        sender = ChatMessages.SenderID
+        messages = ChatMessages.__table__
+    messages = messages.join(SubmissionChats, SubmissionChats.SubmissionChatID == ChatMessages.SubmissionChatID)
+
+    # SourceChatID -> [shards, count, first date, last date, senders]
+    chats: Dict[str, list] = {}
+    for engine in engines:
+        with engine.connect() as connection:
+            for chat_id, count, first, last in connection.execute(
+                select(SubmissionChats.SourceChatID, func.count(), func.min(ChatMessages.MessageDate),
+                       func.max(ChatMessages.MessageDate))
+                .select_from(messages).group_by(SubmissionChats.SourceChatID)
+            ):
+                chat = chats.setdefault(chat_id, [0, 0, first, last, set()])
+                chat[0] += 1
+                chat[1] += count
+                chat[2], chat[3] = min(chat[2], first), max(chat[3], last)
+    spanning = {chat_id: chat for chat_id, chat in chats.items() if chat[0] > 1}
+    if not spanning:
+        return
+
+    unknown = mask_pii("unknown")
+    for engine in engines:
+        with engine.connect() as connection:
+            for chat_id, sender_id in connection.execute(
+                select(SubmissionChats.SourceChatID, sender).select_from(messages).distinct()
+                .where(SubmissionChats.SourceChatID.in_(spanning), sender != unknown)
+            ):
+                spanning[chat_id][4].add(sender_id)
+    for engine in engines:
+        with engine.begin() as connection:
+            for chat_id, (_, count, first, last, senders) in spanning.items():
+                connection.execute(
+                    update(SubmissionChats).where(SubmissionChats.SourceChatID == chat_id)
+                    .values(MessageCount=count, FirstMessageDate=first, LastMessageDate=last,
+                            ParticipantCount=len(senders))
+                )